@@ -0,0 +1,156 @@
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECRET = 'test-secret'
+TERMINAL_STATUSES = ('succeeded', 'failed', 'rolled_back', 'cancelled')
+
+
+def sign(body: bytes, secret: str = SECRET) -> str:
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    
+    
+def push_payload(before: str, after: str, files, ref: str = 'refs/heads/live') -> bytes:
+    """A GitHub push payload with one commit touching files"""
+    return json.dumps({
+        'ref': ref,
+        'before': before,
+        'after': after,
+        'commits': [{'id': after, 'message': 'Change', 'author': {'name': 'Test'},
+                     'added': [], 'modified': list(files), 'removed': []}]
+    }).encode()
+    
+    
+class Hook:
+    """Test client for a listener, signing requests like GitHub does"""
+    
+    def __init__(self, listener):
+        self.listener = listener
+        self.client = listener.app.test_client()
+        
+    def post(self, body: bytes, path: str = '/webhook', delivery: str = None, **headers):
+        headers.setdefault('X-Hub-Signature-256', sign(body))
+        headers.setdefault('Content-Type', 'application/json')
+        if delivery:
+            headers['X-GitHub-Delivery'] = delivery
+        return self.client.post(path, data=body, headers=headers)
+        
+    def push(self, sandbox, install: bool = False):
+        """Push a commit in the sandbox and deliver its webhook, returning the response"""
+        before, after, files = sandbox.push(install)
+        return self.post(push_payload(before, after, files))
+        
+    def wait(self, job_id: str, timeout: float = 30, until=None) -> dict:
+        """Poll a deployment until until(job) holds, by default until it has finished"""
+        until = until or (lambda job: job.get('status') in TERMINAL_STATUSES)
+        deadline = time.time() + timeout
+        while True:
+            job = self.client.get(f'/deployments/{job_id}').get_json()
+            if until(job) or time.time() > deadline:
+                return job
+            time.sleep(0.02)
+            
+            
+@pytest.fixture
+def fake_tools(tmp_path, monkeypatch):
+    """Directory on PATH with the benchmark's pm2 shim"""
+    from webhook_benchmark import FAKE_PM2
+    
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    pm2 = bin_dir / 'pm2'
+    pm2.write_text(FAKE_PM2)
+    pm2.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return bin_dir
+    
+    
+@pytest.fixture
+def sandbox(tmp_path, monkeypatch):
+    """The benchmark's origin repository, deploy checkout and fake pm2/npm"""
+    from webhook_benchmark import Sandbox
+    
+    box = Sandbox(str(tmp_path / 'sandbox'))
+    os.makedirs(box.workdir)
+    box.create()
+    monkeypatch.setenv('PATH', f"{box.bin}{os.pathsep}{os.environ['PATH']}")
+    return box
+    
+    
+@pytest.fixture
+def health_stub():
+    from webhook_benchmark import HealthStub
+    
+    stub = HealthStub()
+    stub.start()
+    yield stub
+    stub.stop()
+    
+    
+@pytest.fixture
+def make_hook(tmp_path, monkeypatch, sandbox, health_stub):
+    """Build a listener deploying the sandbox checkout, configured by keyword env overrides"""
+    monkeypatch.chdir(tmp_path)
+    for name in ('STATE_DIR', 'DEPLOY_TARGETS', 'DEPLOY_TARGETS_FILE', 'DELIVERY_CACHE_FILE', 'STEP_TIMEOUTS',
+                 'DEPLOY_MODE', 'HEALTH_FAILURE_POLICY', 'JSON_BACKEND', 'MAX_PAYLOAD_BYTES'):
+        monkeypatch.delenv(name, raising=False)
+    env = {
+        'GITHUB_WEBHOOK_SECRET': SECRET,
+        'TARGET_BRANCH': 'live',
+        'DEPLOY_DEBOUNCE_SECONDS': '0',
+        'RELEASES_DIR': str(tmp_path / 'releases'),
+        'CURRENT_LINK': str(tmp_path / 'current'),
+        'DEPENDENCY_CACHE_DIR': str(tmp_path / 'dependency-cache'),
+        'DEPLOY_HISTORY_DB': str(tmp_path / 'deployments.db'),
+        'PM2_HOME': str(tmp_path / 'pm2'),
+        'HEALTH_CHECK_URL': f"{health_stub.url}/api/health",
+        'DB_HEALTH_CHECK_URL': f"{health_stub.url}/api/db/health",
+        'HEALTH_CHECK_DEADLINE': '2',
+        'HEALTH_CHECK_INITIAL_DELAY': '0.05',
+        'HEALTH_CHECK_MAX_DELAY': '0.2',
+        'BENCH_NPM_DELAY': '0',
+        'BENCH_NPM_LINES': '5',
+    }
+    
+    def make(**overrides) -> Hook:
+        import webhook_listener
+        
+        for name, value in {**env, **overrides}.items():
+            monkeypatch.setenv(name, value)
+        listener = webhook_listener.WebhookListener()
+        listener.repo_path = sandbox.app
+        return Hook(listener)
+        
+    return make
+    
+    
+@pytest.fixture
+def release_health(tmp_path):
+    """Health endpoint that only answers 200 while `current` points at a release in healthy"""
+    healthy = set()
+    current = str(tmp_path / 'current')
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200 if not healthy or os.path.realpath(current) in healthy else 503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            
+        def log_message(self, *args):
+            pass
+            
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/api/health", healthy
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,76 @@
+import os
+import threading
+
+
+def running_step(name):
+    return lambda job: any(step['name'] == name and step['status'] == 'running' for step in job.get('steps', []))
+    
+    
+def cancel(hook, job_id):
+    return hook.post(b'{}', path=f'/deployments/{job_id}/cancel')
+    
+    
+def test_cancel_during_release_health_check_still_rolls_back(make_hook, sandbox, tmp_path, release_health):
+    url, healthy = release_health
+    hook = make_hook(DEPLOY_MODE='release', HEALTH_CHECK_DEADLINE='1.5', HEALTH_CHECK_URL=url)
+    good = hook.wait(hook.push(sandbox).get_json()['job_id'])
+    assert good['status'] == 'succeeded'
+    good_release = os.path.realpath(tmp_path / 'current')
+    healthy.add(good_release)
+    
+    job_id = hook.push(sandbox).get_json()['job_id']
+    assert running_step('perform_health_checks')(hook.wait(job_id, until=running_step('perform_health_checks')))
+    
+    response = cancel(hook, job_id)
+    job = hook.wait(job_id)
+    
+    assert response.status_code == 409
+    assert job['status'] == 'rolled_back'
+    assert job['rollback']['healthy'] and job['rollback']['sha'] == good['sha']
+    assert os.path.realpath(tmp_path / 'current') == good_release
+    assert hook.listener.current_sha() == good['sha']
+    
+    
+def test_cancel_during_health_check_is_refused_in_place(make_hook, sandbox):
+    hook = make_hook(HEALTH_CHECK_DEADLINE='1.5', HEALTH_FAILURE_POLICY='abort')
+    hook.listener.health_check_url = hook.listener.health_check_url.replace('/api/health', '/broken')
+    job_id = hook.push(sandbox).get_json()['job_id']
+    hook.wait(job_id, until=running_step('perform_health_checks'))
+    
+    response = cancel(hook, job_id)
+    job = hook.wait(job_id)
+    
+    assert response.status_code == 409
+    assert job['status'] == 'failed'
+    assert job['plan'] == 'reload'
+    assert [step['name'] for step in job['steps']][-1] == 'perform_health_checks'
+    
+    
+def test_cancel_before_switch_keeps_current_release(make_hook, sandbox, tmp_path):
+    hook = make_hook(DEPLOY_MODE='release', BENCH_NPM_DELAY='1')
+    first = hook.wait(hook.push(sandbox, install=True).get_json()['job_id'])
+    current = os.path.realpath(tmp_path / 'current')
+    
+    job_id = hook.push(sandbox, install=True).get_json()['job_id']
+    hook.wait(job_id, until=running_step('install_dependencies'))
+    response = cancel(hook, job_id)
+    job = hook.wait(job_id)
+    
+    assert response.status_code == 202
+    assert job['status'] == 'cancelled'
+    assert os.path.realpath(tmp_path / 'current') == current
+    assert hook.listener.current_sha() == first['sha']
+    assert sorted(os.listdir(tmp_path / 'releases')) == [os.path.basename(current)]
+    
+    
+def test_health_poll_stops_when_cancelled(health_stub):
+    from webhook_listener import HealthChecker
+    
+    checker = HealthChecker(deadline=10, initial_delay=0.05, max_delay=0.2, probe_timeout=1)
+    cancelled = threading.Event()
+    threading.Timer(0.3, cancelled.set).start()
+    
+    result = checker.wait_until_healthy({'api': f"{health_stub.url}/broken"}, cancelled)
+    
+    assert not result['healthy'] and result['cancelled']
+    assert result['waited'] < 1
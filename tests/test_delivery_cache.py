@@ -0,0 +1,131 @@
+import threading
+
+import pytest
+
+from conftest import push_payload
+from webhook_listener import DeliveryCache, QueueFullError
+
+
+def completed(cache, *delivery_ids):
+    for delivery_id in delivery_ids:
+        assert cache.claim(delivery_id) is None
+        cache.complete(delivery_id, f"job-{delivery_id}")
+        
+        
+def test_duplicate_returns_original_job():
+    cache = DeliveryCache(10, 60)
+    completed(cache, 'a')
+    
+    assert cache.claim('a')['job_id'] == 'job-a'
+    assert cache.stats()['duplicate_hits'] == 1
+    
+    
+def test_expired_entries_are_claimable_again():
+    cache = DeliveryCache(10, 60)
+    completed(cache, 'a', 'b')
+    cache.entries['a']['seen_at'] -= 61
+    
+    assert cache.claim('a') is None
+    assert cache.claim('b')['job_id'] == 'job-b'
+    
+    
+def test_least_recently_seen_entry_is_evicted():
+    cache = DeliveryCache(2, 60)
+    completed(cache, 'a', 'b')
+    cache.claim('a')
+    completed(cache, 'c')
+    
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.claim('b') is None
+    
+    
+def test_entries_are_reloaded_from_file(tmp_path):
+    path = str(tmp_path / 'deliveries.json')
+    cache = DeliveryCache(10, 60, path)
+    completed(cache, 'a', 'old')
+    cache.claim('pending')
+    cache.entries['old']['seen_at'] -= 61
+    cache.complete('a', 'job-a')
+    
+    reloaded = DeliveryCache(10, 60, path)
+    
+    assert list(reloaded.entries) == ['a']
+    assert reloaded.claim('a')['job_id'] == 'job-a'
+    assert reloaded.claim('pending') is None
+    
+    
+def test_release_only_drops_pending_claims():
+    cache = DeliveryCache(10, 60)
+    completed(cache, 'a')
+    cache.claim('b')
+    
+    cache.release('a')
+    cache.release('b')
+    
+    assert cache.claim('a')['job_id'] == 'job-a'
+    assert cache.claim('b') is None
+    
+    
+@pytest.fixture
+def hook(make_hook, tmp_path):
+    return make_hook(DELIVERY_CACHE_FILE=str(tmp_path / 'deliveries.json'), DEPLOY_DEBOUNCE_SECONDS='60')
+    
+    
+def body():
+    return push_payload('a' * 40, 'b' * 40, ['server.js'])
+    
+    
+def test_redelivery_is_answered_from_cache(hook):
+    first = hook.post(body(), delivery='d-1')
+    second = hook.post(body(), delivery='d-1')
+    
+    assert first.status_code == 202
+    assert second.status_code == 200
+    assert second.get_json()['job_id'] == first.get_json()['job_id']
+    assert second.get_json()['deployment']['status'] == 'queued'
+    assert hook.listener.deployment_queue.stats()['depth'] == 1
+    
+    
+def test_invalid_json_releases_the_claim(hook):
+    assert hook.post(b'[]', delivery='d-1').status_code == 400
+    
+    assert hook.post(body(), delivery='d-1').status_code == 202
+    
+    
+def test_full_queue_releases_the_claim(hook, monkeypatch):
+    put = hook.listener.deployment_queue.put
+    
+    def full(job):
+        raise QueueFullError('Deployment queue is full (10 jobs pending)')
+        
+    monkeypatch.setattr(hook.listener.deployment_queue, 'put', full)
+    assert hook.post(body(), delivery='d-1').status_code == 503
+    monkeypatch.setattr(hook.listener.deployment_queue, 'put', put)
+    
+    assert hook.post(body(), delivery='d-1').status_code == 202
+    
+    
+def test_concurrent_duplicate_while_first_delivery_is_pending(hook):
+    parsing, resume = threading.Event(), threading.Event()
+    loads = hook.listener.json_loads
+    
+    def slow_loads(data):
+        parsing.set()
+        resume.wait(10)
+        return loads(data)
+        
+    hook.listener.json_loads = slow_loads
+    first = []
+    thread = threading.Thread(target=lambda: first.append(hook.post(body(), delivery='d-1')))
+    thread.start()
+    assert parsing.wait(10)
+    
+    duplicate = hook.post(body(), delivery='d-1')
+    resume.set()
+    thread.join(10)
+    
+    assert duplicate.status_code == 200
+    assert duplicate.get_json() == {'message': 'Duplicate delivery', 'delivery_id': 'd-1', 'job_id': None}
+    assert first[0].status_code == 202
+    assert hook.listener.deployment_queue.stats()['depth'] == 1
+    assert hook.post(body(), delivery='d-1').get_json()['job_id'] == first[0].get_json()['job_id']
@@ -0,0 +1,110 @@
+import pytest
+
+from webhook_listener import DeploymentHistory, DeploymentJob
+
+NOW = 1_800_000_000.0
+
+
+def finished(status, duration, finished_at, sha='a' * 40, plan='reload', ref='refs/heads/live', steps=None, **attrs):
+    job = DeploymentJob(ref, sha, [])
+    job.status, job.plan = status, plan
+    job.started_at, job.finished_at = finished_at - duration, finished_at
+    job.steps = [{'name': name, 'status': 'succeeded', 'started_at': job.started_at, 'duration': step_duration}
+                 for name, step_duration in (steps or [])]
+    for name, value in attrs.items():
+        setattr(job, name, value)
+    return job
+    
+    
+@pytest.fixture
+def history(tmp_path):
+    return DeploymentHistory(str(tmp_path / 'deployments.db'))
+    
+    
+def test_where_combines_filters():
+    where, params = DeploymentHistory.where({'status': 'failed', 'plan': 'full', 'sha': 'abc1', 'since': '10', 'until': '20.5'})
+    
+    assert where == ' WHERE status = ? AND plan = ? AND sha GLOB ? AND finished_at >= ? AND finished_at < ?'
+    assert params == ['failed', 'full', 'abc1*', 10.0, 20.5]
+    assert DeploymentHistory.where({}) == ('', [])
+    assert DeploymentHistory.where({'unknown': 'x', 'status': ''}) == ('', [])
+    
+    
+@pytest.mark.parametrize('filters', [
+    {'sha': 'ABC'},
+    {'sha': 'abc*'},
+    {'sha': '[a-f]'},
+    {'sha': 'a' * 41},
+    {'since': 'yesterday'},
+    {'until': '2026-01-01'},
+])
+def test_where_rejects_malformed_values(filters):
+    with pytest.raises(ValueError):
+        DeploymentHistory.where(filters)
+        
+        
+def test_query_filters_by_sha_prefix_and_time(history):
+    history.record(finished('succeeded', 5, NOW - 30, sha='abc' + '0' * 37))
+    history.record(finished('succeeded', 5, NOW - 20, sha='abd' + '0' * 37))
+    history.record(finished('failed', 5, NOW - 10, sha='abc' + '1' * 37))
+    
+    jobs, total = history.query({'sha': 'abc'})
+    assert total == 2 and [job.sha[:4] for job in jobs] == ['abc1', 'abc0']
+    
+    _, total = history.query({'since': str(NOW - 20), 'until': str(NOW - 10)})
+    assert total == 1
+    
+    
+@pytest.mark.parametrize('values, p50, p95', [
+    ([], None, None),
+    ([7.0], 7.0, 7.0),
+    ([1.0, 2.0], 1.0, 2.0),
+    ([float(i) for i in range(1, 21)], 10.0, 19.0),
+    ([float(i) for i in range(1, 101)], 50.0, 95.0),
+])
+def test_percentiles_use_nearest_rank(values, p50, p95):
+    assert DeploymentHistory.percentiles(values) == {'p50': p50, 'p95': p95}
+    
+    
+def test_stats_counts_rollbacks_as_failures(history):
+    for i, (status, duration) in enumerate([('succeeded', 10), ('succeeded', 20), ('succeeded', 30),
+                                            ('failed', 40), ('rolled_back', 50), ('cancelled', 60)]):
+        history.record(finished(status, duration, NOW + i, steps=[('git_fetch', duration / 10)]))
+        
+    stats = history.stats({})
+    
+    assert stats['count'] == 6
+    assert stats['outcomes'] == {'succeeded': 3, 'failed': 1, 'rolled_back': 1, 'cancelled': 1}
+    assert stats['failure_rate'] == 0.4
+    assert stats['duration'] == {'p50': 30.0, 'p95': 60.0}
+    assert stats['time_to_healthy'] == {'p50': None, 'p95': None}
+    assert stats['steps']['git_fetch'] == {'p50': 3.0, 'p95': 6.0, 'count': 6}
+    
+    
+def test_stats_apply_filters(history):
+    history.record(finished('succeeded', 10, NOW, plan='reload'))
+    history.record(finished('failed', 90, NOW, plan='full'))
+    
+    stats = history.stats({'plan': 'full'})
+    
+    assert (stats['count'], stats['failure_rate'], stats['duration']['p50']) == (1, 1.0, 90.0)
+    assert history.stats({'status': 'cancelled'})['failure_rate'] is None
+    
+    
+def test_deployments_endpoint_paginates_and_validates(make_hook):
+    hook = make_hook()
+    jobs = [finished('succeeded', 1, NOW + i) for i in range(5)]
+    for job in jobs:
+        hook.listener.deployment_history.record(job)
+        
+    first = hook.client.get('/deployments?limit=2').get_json()
+    last = hook.client.get('/deployments?limit=2&offset=4').get_json()
+    
+    assert (first['total'], len(first['deployments']), first['next_offset']) == (5, 2, 2)
+    assert [job['id'] for job in first['deployments']] == [jobs[4].id, jobs[3].id]
+    assert [job['id'] for job in last['deployments']] == [jobs[0].id] and last['next_offset'] is None
+    for query in ('limit=x', 'since=yesterday', 'until=tomorrow', 'sha=XYZ'):
+        assert hook.client.get(f'/deployments?{query}').status_code == 400
+    for query in ('since=yesterday', 'sha=not-hex'):
+        assert hook.client.get(f'/deployments/stats?{query}').status_code == 400
+    assert hook.client.get(f'/deployments/stats?since={NOW + 3}').get_json()['count'] == 2
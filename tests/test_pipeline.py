@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from webhook_listener import Pipeline, PipelineStep
+
+
+def noop():
+    return True
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def run(pipeline, results=None, delays=None):
+    """Run a pipeline, recording the order in which steps start"""
+    started = []
+    lock = threading.Lock()
+    
+    def execute(step):
+        with lock:
+            started.append(step.name)
+        time.sleep((delays or {}).get(step.name, 0))
+        return (results or {}).get(step.name, True)
+        
+    return pipeline.run(execute), started
+
+
+def test_topological_order_respects_dependencies():
+    pipeline = Pipeline([
+        PipelineStep('restart', noop, after=('install', 'build')),
+        PipelineStep('fetch', noop),
+        PipelineStep('install', noop, after=('fetch',)),
+        PipelineStep('build', noop, after=('fetch',)),
+    ], None)
+    
+    assert pipeline.order == ['fetch', 'install', 'build', 'restart']
+
+
+def test_cycle_is_rejected():
+    with pytest.raises(ValueError, match=r"\['a', 'b'\] form a dependency cycle"):
+        Pipeline([
+            PipelineStep('a', noop, after=('b',)),
+            PipelineStep('b', noop, after=('a',)),
+            PipelineStep('c', noop),
+        ], None)
+        
+        
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError, match='unknown steps'):
+        Pipeline([PipelineStep('a', noop, after=('missing',))], None)
+        
+        
+def test_steps_wait_for_their_dependencies(executor):
+    pipeline = Pipeline([
+        PipelineStep('fetch', noop),
+        PipelineStep('install', noop, after=('fetch',)),
+        PipelineStep('build', noop, after=('fetch',)),
+        PipelineStep('restart', noop, after=('install', 'build')),
+    ], executor)
+    
+    result, started = run(pipeline, delays={'fetch': 0.05, 'install': 0.1, 'build': 0.02})
+    
+    assert result['success'] and result['skipped'] == []
+    assert started[0] == 'fetch' and started[-1] == 'restart'
+    assert result['critical_path'] == ['fetch', 'install', 'restart']
+    
+    
+def test_independent_steps_run_in_parallel(executor):
+    pipeline = Pipeline([PipelineStep(name, noop) for name in ('a', 'b', 'c')], executor)
+    
+    result, _ = run(pipeline, delays={'a': 0.2, 'b': 0.2, 'c': 0.2})
+    
+    assert result['wall_seconds'] < 0.5
+    
+    
+def test_failure_aborts_dependents_and_runs_handler(executor):
+    rolled_back = []
+    pipeline = Pipeline([
+        PipelineStep('fetch', noop),
+        PipelineStep('install', noop, after=('fetch',), on_failure=lambda: rolled_back.append(True)),
+        PipelineStep('restart', noop, after=('install',)),
+    ], executor)
+    
+    result, started = run(pipeline, results={'install': False})
+    
+    assert not result['success']
+    assert result['failed_step'] == 'install'
+    assert result['skipped'] == ['restart']
+    assert 'restart' not in started
+    assert rolled_back == [True]
+    
+    
+def test_continue_on_failure_keeps_going(executor):
+    pipeline = Pipeline([
+        PipelineStep('log_commits', noop, on_failure='continue'),
+        PipelineStep('restart', noop, after=('log_commits',)),
+    ], executor)
+    
+    result, started = run(pipeline, results={'log_commits': False})
+    
+    assert result['success']
+    assert started == ['log_commits', 'restart']
+    
+    
+def test_step_exception_is_reraised_after_running_steps(executor):
+    finished = []
+    
+    def execute(step):
+        if step.name == 'a':
+            raise RuntimeError('boom')
+        time.sleep(0.1)
+        finished.append(step.name)
+        return True
+        
+    pipeline = Pipeline([PipelineStep('a', noop), PipelineStep('b', noop), PipelineStep('c', noop, after=('a',))], executor)
+    
+    with pytest.raises(RuntimeError, match='boom'):
+        pipeline.run(execute)
+    assert finished == ['b']
+    
+    
+def test_failed_log_flush_is_recorded_but_does_not_fail_the_deploy(make_hook, sandbox, tmp_path, monkeypatch, caplog):
+    from webhook_benchmark import FAKE_PM2
+    
+    failing_bin = tmp_path / 'failing-bin'
+    failing_bin.mkdir()
+    pm2 = failing_bin / 'pm2'
+    pm2.write_text(FAKE_PM2.replace('#!/bin/sh\n', '#!/bin/sh\n[ "$1" = "flush" ] && exit 1\n', 1))
+    pm2.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{failing_bin}:{os.environ['PATH']}")
+    hook = make_hook()
+    
+    job = hook.wait(hook.push(sandbox).get_json()['job_id'])
+    
+    steps = {step['name']: step['status'] for step in job['steps']}
+    assert job['status'] == 'succeeded'
+    assert steps['flush_pm2_logs'] == 'failed'
+    assert steps['reload_pm2_process'] == 'succeeded'
+    assert 'flush_pm2_logs failed, but deployment continued' in caplog.text
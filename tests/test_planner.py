@@ -0,0 +1,111 @@
+import pytest
+
+from conftest import push_payload
+from webhook_listener import DeployPlanner
+
+
+def commits(*files_per_commit):
+    return [{'id': f"c{i}", 'added': [], 'modified': list(files), 'removed': []}
+            for i, files in enumerate(files_per_commit)]
+            
+            
+def push_files(sandbox, files):
+    """Commit and push the given {path: content} changes, returning (before, after, paths)"""
+    before = sandbox.git('rev-parse', 'HEAD')
+    for path, content in files.items():
+        sandbox.write(path, content)
+    sandbox.git('add', '-A')
+    sandbox.git('commit', '-qm', f"Change {', '.join(files)}")
+    sandbox.git('push', '-q', 'origin', sandbox.BRANCH)
+    return before, sandbox.git('rev-parse', 'HEAD'), list(files)
+    
+    
+def deliver(hook, before, after, files):
+    return hook.wait(hook.post(push_payload(before, after, files)).get_json()['job_id'])
+    
+    
+@pytest.mark.parametrize('path, plan', [
+    ('package.json', 'full'),
+    ('package-lock.json', 'full'),
+    ('npm-shrinkwrap.json', 'full'),
+    ('public/css/style.css', 'static'),
+    ('public/index.html', 'static'),
+    ('README.md', 'noop'),
+    ('docs/setup/guide.txt', 'noop'),
+    ('LICENSE', 'noop'),
+    ('server.js', 'reload'),
+    ('lib/db.js', 'reload'),
+    ('ecosystem.config.js', 'reload'),
+])
+def test_classify(path, plan):
+    assert DeployPlanner().classify(path) == plan
+    
+    
+def test_most_expensive_path_wins():
+    plan, reason = DeployPlanner().plan(commits(['README.md', 'public/a.css', 'server.js', 'a.js', 'b.js', 'c.js']),
+                                        ['README.md', 'public/a.css', 'server.js', 'a.js', 'b.js', 'c.js'])
+    
+    assert plan == 'reload'
+    assert reason == 'server files changed: server.js, a.js, b.js (+1 more)'
+    
+    
+@pytest.mark.parametrize('payload_commits, files, reason', [
+    ([], ['README.md'], 'no commit information in payload'),
+    (commits(*[['README.md']] * 20), ['README.md'], '20 commits, payload file list may be truncated'),
+    (commits([]), [], 'no file information in payload'),
+])
+def test_incomplete_payloads_plan_full(payload_commits, files, reason):
+    assert DeployPlanner().plan(payload_commits, files) == ('full', reason)
+    
+    
+def test_push_after_docs_only_push_is_not_full(make_hook, sandbox):
+    hook = make_hook()
+    
+    first = deliver(hook, *push_files(sandbox, {'server.js': "console.log('one');\n"}))
+    docs = deliver(hook, *push_files(sandbox, {'README.md': '# docs\n'}))
+    second = deliver(hook, *push_files(sandbox, {'server.js': "console.log('two');\n"}))
+    
+    assert [first['plan'], docs['plan'], second['plan']] == ['reload', 'noop', 'reload']
+    assert second['status'] == 'succeeded'
+    assert 'stop_pm2_process' not in [step['name'] for step in second['steps']]
+    assert hook.listener.current_sha() == second['sha']
+    
+    
+def test_push_not_based_on_deployed_commit_is_full(make_hook, sandbox):
+    hook = make_hook()
+    deliver(hook, *push_files(sandbox, {'server.js': "console.log('one');\n"}))
+    push_files(sandbox, {'package.json': '{"name": "live-error-display", "version": "2.0.0"}'})
+    
+    job = deliver(hook, *push_files(sandbox, {'server.js': "console.log('two');\n"}))
+    
+    assert job['plan'] == 'full'
+    assert job['plan_reason'].startswith('deployed ')
+    
+    
+def test_redelivered_deployed_sha_is_noop(make_hook, sandbox):
+    hook = make_hook()
+    before, after, files = push_files(sandbox, {'server.js': "console.log('one');\n"})
+    deliver(hook, before, after, files)
+    
+    job = deliver(hook, before, after, files)
+    
+    assert (job['plan'], job['plan_reason']) == ('noop', f"already at {after[:8]}")
+    
+    
+def test_failed_deploy_forces_full_plan(make_hook, sandbox):
+    hook = make_hook()
+    hook.listener.status_board.set('last_job_failed', True)
+    
+    job = deliver(hook, *push_files(sandbox, {'public/css/style.css': 'body {}\n'}))
+    
+    assert (job['plan'], job['plan_reason']) == ('full', 'previous deployment failed')
+    
+    
+def test_release_mode_reloads_for_static_assets(make_hook, sandbox):
+    hook = make_hook(DEPLOY_MODE='release')
+    deliver(hook, *push_files(sandbox, {'server.js': "console.log('one');\n"}))
+    
+    job = deliver(hook, *push_files(sandbox, {'public/css/style.css': 'body {}\n'}))
+    
+    assert job['plan'] == 'reload'
+    assert job['plan_reason'].endswith('(release mode needs a reload to serve them)')
@@ -0,0 +1,165 @@
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from webhook_listener import AmpDecoder, PM2Client, amp_encode
+
+PROCESSES = [{'name': 'live-error-display', 'pid': 4242,
+              'pm2_env': {'status': 'online', 'pm_uptime': 1, 'restart_time': 3}}]
+
+
+class RpcStub:
+    """Unix-socket server answering PM2 RPC calls the way the daemon does"""
+    
+    def __init__(self, path, handler):
+        self.handler = handler
+        self.calls = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        threading.Thread(target=self.serve, daemon=True).start()
+        
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.answer, args=(conn,), daemon=True).start()
+            
+    def answer(self, conn):
+        decoder = AmpDecoder()
+        with conn:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    return
+                for request, request_id in decoder.feed(data):
+                    self.calls.append(request['method'])
+                    conn.sendall(amp_encode([self.handler(request), request_id]))
+                    
+    def close(self):
+        self.server.close()
+        
+        
+@pytest.fixture
+def pm2_home(tmp_path):
+    home = tmp_path / 'pm2'
+    home.mkdir()
+    return str(home)
+    
+    
+def make_client(pm2_home, fallback=None, ttl=60):
+    return PM2Client(pm2_home, ttl, fallback, logging.getLogger('test-pm2'), rpc_timeout=2)
+    
+    
+def test_amp_roundtrip():
+    message = [{'type': 'call', 'method': 'getMonitorData', 'args': [{}]}, 'webhook-1:1', b'\x00raw']
+    
+    assert AmpDecoder().feed(amp_encode(message)) == [message]
+    
+    
+def test_amp_decoder_handles_split_and_batched_frames():
+    first = amp_encode(['process:event', {'event': 'online'}])
+    second = amp_encode([{'args': [PROCESSES]}, 'webhook-1:2'])
+    data = first + second
+    decoder = AmpDecoder()
+    
+    messages = []
+    for i in range(0, len(data), 7):
+        messages += decoder.feed(data[i:i + 7])
+        
+    assert messages == [['process:event', {'event': 'online'}], [{'args': [PROCESSES]}, 'webhook-1:2']]
+    assert decoder.buffer == b''
+    
+    
+def test_amp_encode_header_and_lengths():
+    frame = amp_encode(['ab'])
+    
+    assert frame[0] == 0x11
+    assert struct.unpack('>I', frame[1:5]) == (4,)
+    assert frame[5:] == b's:ab'
+    
+    
+def test_refresh_over_rpc(pm2_home):
+    stub = RpcStub(os.path.join(pm2_home, 'rpc.sock'), lambda request: {'args': [PROCESSES]})
+    client = make_client(pm2_home, fallback=lambda: pytest.fail('fallback used'))
+    try:
+        assert client.refresh() == PROCESSES
+        assert client.refresh() == PROCESSES
+        assert client.process_status('live-error-display') == {
+            'status': 'online', 'pid': 4242, 'uptime': 1, 'restarts': 3
+        }
+        assert client.process_status('missing') == {'status': 'unknown'}
+    finally:
+        client.disconnect()
+        stub.close()
+    assert stub.calls == ['getMonitorData', 'getMonitorData']
+    assert client.stats()['source'] == 'rpc'
+    assert client.stats()['rpc_calls'] == 2
+    
+    
+def test_rpc_error_falls_back_to_cli(pm2_home):
+    stub = RpcStub(os.path.join(pm2_home, 'rpc.sock'), lambda request: {'type': 'error', 'error': 'boom'})
+    client = make_client(pm2_home, fallback=lambda: PROCESSES)
+    try:
+        assert client.refresh() == PROCESSES
+    finally:
+        stub.close()
+    stats = client.stats()
+    assert stats['source'] == 'cli'
+    assert (stats['rpc_calls'], stats['fallback_calls']) == (0, 1)
+    
+    
+def test_missing_socket_uses_fallback(pm2_home):
+    client = make_client(pm2_home, fallback=lambda: PROCESSES)
+    
+    assert client.refresh() == PROCESSES
+    assert client.stats()['source'] == 'cli'
+    
+    
+def test_snapshot_does_not_block_on_refresh(pm2_home):
+    release = threading.Event()
+    
+    def slow_fallback():
+        release.wait(5)
+        return PROCESSES
+        
+    client = make_client(pm2_home, fallback=slow_fallback)
+    started = time.time()
+    assert client.snapshot() is None
+    assert client.snapshot() is None
+    assert time.time() - started < 0.5
+    
+    release.set()
+    deadline = time.time() + 5
+    while client.snapshot() is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert client.snapshot() == PROCESSES
+    assert client.stats()['fallback_calls'] == 1
+    
+    
+def test_bus_event_refreshes_snapshot(pm2_home):
+    bus = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    bus.bind(os.path.join(pm2_home, 'pub.sock'))
+    bus.listen()
+    calls = []
+    client = make_client(pm2_home, fallback=lambda: calls.append(1) or PROCESSES)
+    threading.Thread(target=client.follow_bus, daemon=True).start()
+    try:
+        conn, _ = bus.accept()
+        with conn:
+            conn.sendall(amp_encode(['log:out', {'data': 'hello'}]) + amp_encode(['process:event', {'event': 'restart'}]))
+            deadline = time.time() + 5
+            while client.processes is None and time.time() < deadline:
+                time.sleep(0.01)
+    finally:
+        bus.close()
+    assert client.stats()['bus_events'] == 1
+    assert calls == [1]
+    assert client.processes == PROCESSES
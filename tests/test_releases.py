@@ -0,0 +1,113 @@
+import json
+import os
+import time
+
+import pytest
+
+from webhook_listener import read_git_head
+
+
+def deploy(hook, sandbox):
+    job = hook.wait(hook.push(sandbox).get_json()['job_id'])
+    assert job['status'] == 'succeeded', job['error']
+    return job
+    
+    
+def make_release(listener, name, marked_at=None):
+    """A release directory, known-good at marked_at when given"""
+    path = os.path.join(listener.releases_dir, name)
+    os.makedirs(path)
+    if marked_at is not None:
+        with open(os.path.join(path, listener.KNOWN_GOOD_MARKER), 'w') as f:
+            json.dump({'sha': None, 'job_id': None, 'marked_at': marked_at}, f)
+    return path
+    
+    
+def go_live(listener, release_dir):
+    os.symlink(release_dir, listener.current_link)
+    
+    
+@pytest.fixture
+def listener(make_hook):
+    return make_hook(DEPLOY_MODE='release', KEEP_RELEASES='2').listener
+    
+    
+def test_failed_health_check_rolls_back_to_last_good_release(make_hook, sandbox, tmp_path, release_health):
+    url, healthy = release_health
+    hook = make_hook(DEPLOY_MODE='release', HEALTH_CHECK_DEADLINE='0.5', HEALTH_CHECK_URL=url)
+    good = deploy(hook, sandbox)
+    good_release = os.path.realpath(tmp_path / 'current')
+    healthy.add(good_release)
+    
+    job = hook.wait(hook.push(sandbox).get_json()['job_id'])
+    
+    assert job['status'] == 'rolled_back'
+    assert job['rollback']['trigger'] == 'health_check' and job['rollback']['healthy']
+    assert job['rollback']['to'] == os.path.basename(good_release)
+    assert job['error'] == f"Deployment failed (health_check), rolled back to {good['sha'][:8]}"
+    assert os.path.realpath(tmp_path / 'current') == good_release
+    assert hook.listener.known_good_releases() == [good_release]
+    
+    
+def test_manual_rollback_by_sha_prefix(make_hook, sandbox):
+    hook = make_hook(DEPLOY_MODE='release')
+    first, second, third = deploy(hook, sandbox), deploy(hook, sandbox), deploy(hook, sandbox)
+    
+    response = hook.post(json.dumps({'sha': first['sha'][:7]}).encode(), path='/rollback')
+    job = hook.wait(response.get_json()['job_id'])
+    
+    assert response.status_code == 202
+    assert (job['plan'], job['status']) == ('rollback', 'succeeded')
+    assert hook.listener.current_sha() == first['sha']
+    # The release rolled away from is no longer a rollback candidate
+    assert [read_git_head(path) for path in hook.listener.known_good_releases()] == [first['sha'], second['sha']]
+    
+    
+def test_manual_rollback_errors(make_hook, sandbox):
+    hook = make_hook(DEPLOY_MODE='release')
+    deploy(hook, sandbox)
+    
+    assert hook.post(b'{}', path='/rollback').status_code == 404
+    assert hook.post(b'{"sha": "0000000"}', path='/rollback').status_code == 404
+    assert hook.post(b'[]', path='/rollback').status_code == 400
+    assert hook.post(b'{}', path='/rollback', **{'X-Hub-Signature-256': 'sha256=' + '0' * 64}).status_code == 401
+    
+    
+def test_manual_rollback_needs_release_mode(make_hook):
+    assert make_hook().post(b'{}', path='/rollback').status_code == 409
+    
+    
+def test_known_good_releases_are_ordered_by_verification_time(listener):
+    now = time.time()
+    # Same second: the names alone would put b last
+    a = make_release(listener, '20260101120000000001-aaaaaaaa', marked_at=now - 2)
+    b = make_release(listener, '20260101120000000002-bbbbbbbb', marked_at=now - 5)
+    c = make_release(listener, '20260101120000000003-cccccccc', marked_at=now - 1)
+    make_release(listener, '20260101120000000004-dddddddd')
+    go_live(listener, c)
+    
+    assert listener.known_good_releases() == [c, a, b]
+    assert listener.rollback_target() == a
+    
+    
+def test_marker_without_timestamp_falls_back_to_its_mtime(listener):
+    old = make_release(listener, '20260101120000000001-aaaaaaaa', marked_at=time.time() - 60)
+    legacy = make_release(listener, '20260101110000000000-bbbbbbbb')
+    open(os.path.join(legacy, listener.KNOWN_GOOD_MARKER), 'w').close()
+    
+    assert listener.known_good_releases() == [legacy, old]
+    
+    
+def test_prune_keeps_newest_known_good_and_live_release(listener):
+    now = time.time()
+    live = make_release(listener, '20260101120000000001-live0000')
+    kept = [make_release(listener, f"2026010112000000001{i}-good000{i}", marked_at=now - i) for i in range(2)]
+    stale = make_release(listener, '20260101120000000020-stale000', marked_at=now - 10)
+    failed = make_release(listener, '20260101120000000030-failed00')
+    go_live(listener, live)
+    
+    listener.prune_releases()
+    
+    remaining = sorted(os.path.join(listener.releases_dir, name) for name in os.listdir(listener.releases_dir))
+    assert remaining == sorted([live] + kept)
+    assert not os.path.exists(stale) and not os.path.exists(failed)
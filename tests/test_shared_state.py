@@ -0,0 +1,170 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from webhook_listener import (
+    DeploymentJob, ProcessLock, SharedDeliveryCache, SharedDeploymentQueue, SharedStatusBoard, StateStore
+)
+
+fork = multiprocessing.get_context('fork')
+
+
+def increment(state_dir, times):
+    store = StateStore(state_dir)
+    for _ in range(times):
+        with store.transaction() as state:
+            state['counter'] = state.get('counter', 0) + 1
+            
+            
+def hold_lock(path, locked, release):
+    lock = ProcessLock(path)
+    lock.acquire()
+    locked.set()
+    release.wait(10)
+    
+    
+def make_queue(store, **kwargs):
+    return SharedDeploymentQueue(10, 50, store, ProcessLock(os.path.join(store.state_dir, 'deploy.lock')),
+                                 status=SharedStatusBoard(store), **kwargs)
+                                 
+                                 
+def job(sha, ref='refs/heads/live'):
+    return DeploymentJob(ref, sha, [{'id': sha, 'added': [], 'modified': ['server.js'], 'removed': []}])
+    
+    
+@pytest.fixture
+def store(tmp_path):
+    return StateStore(str(tmp_path / 'state'))
+    
+    
+def test_transactions_from_several_processes_do_not_lose_updates(store):
+    workers = [fork.Process(target=increment, args=(store.state_dir, 50)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        
+    assert store.read()['counter'] == 200
+    assert not [name for name in os.listdir(store.state_dir) if '.tmp-' in name]
+    
+    
+def test_failed_transaction_keeps_previous_state(store):
+    with store.transaction() as state:
+        state['value'] = 1
+    with pytest.raises(RuntimeError):
+        with store.transaction() as state:
+            state['value'] = 2
+            raise RuntimeError('abort')
+            
+    assert store.read() == {'value': 1}
+    
+    
+def test_process_lock_is_released_when_holder_exits(tmp_path):
+    path = str(tmp_path / 'deploy.lock')
+    locked, release = fork.Event(), fork.Event()
+    holder = fork.Process(target=hold_lock, args=(path, locked, release))
+    holder.start()
+    assert locked.wait(10)
+    lock = ProcessLock(path)
+    
+    assert not lock.acquire(blocking=False)
+    holder.terminate()
+    holder.join(10)
+    assert lock.acquire(blocking=False) and lock.held
+    lock.release()
+    assert not lock.held
+    
+    
+def test_queue_is_shared_between_workers(store):
+    first, second = make_queue(store), make_queue(store)
+    older, newer = job('a' * 40), job('b' * 40)
+    
+    first.put(older)
+    second.put(newer)
+    
+    assert first.stats()['depth'] == 1
+    assert (first.find(older.id).status, first.find(older.id).coalesced_into) == ('coalesced', newer.id)
+    claimed = second.get()
+    assert claimed.id == newer.id and claimed.superseded == [older.id]
+    assert first.find(newer.id).id == newer.id
+    assert store.read()['status']['coalesced_deploys'] == 1
+    
+    
+def test_cancel_request_reaches_the_deploying_worker(store):
+    deploying, other = make_queue(store), make_queue(store)
+    other.put(job('a' * 40))
+    running = deploying.get()
+    running.status = 'running'
+    deploying.update(running)
+    
+    other.request_cancel(other.find(running.id))
+    deploying.update(running)
+    
+    assert running.cancel_event.is_set()
+    
+    
+def test_worker_takes_over_and_fails_the_interrupted_job(store, tmp_path):
+    lock_path = os.path.join(store.state_dir, 'deploy.lock')
+    locked, release = fork.Event(), fork.Event()
+    holder = fork.Process(target=hold_lock, args=(lock_path, locked, release))
+    holder.start()
+    assert locked.wait(10)
+    
+    queue = make_queue(store)
+    interrupted = job('a' * 40)
+    queue.put(interrupted)
+    with store.transaction() as state:
+        queue_state = SharedDeploymentQueue.queue_state(state)
+        queue_state['pending'].pop(0)
+        queue_state['current'] = interrupted.id
+        queue_state['jobs'][interrupted.id]['status'] = 'running'
+    queue.put(job('b' * 40, ref='refs/heads/other'))
+    
+    claimed = []
+    taker = threading.Thread(target=lambda: claimed.append(queue.get()), daemon=True)
+    taker.start()
+    time.sleep(0.5)
+    assert not claimed
+    
+    holder.terminate()
+    holder.join(10)
+    taker.join(10)
+    
+    assert claimed and claimed[0].sha == 'b' * 40
+    record = store.read()['queue']['jobs'][interrupted.id]
+    assert (record['status'], record['error']) == ('failed', 'Interrupted: the deploying worker exited')
+    assert store.read()['status']['last_job_failed'] is True
+    
+    
+def test_delivery_cache_is_shared_between_workers(store):
+    first = SharedDeliveryCache(10, 60, store, SharedStatusBoard(store))
+    second = SharedDeliveryCache(10, 60, store, SharedStatusBoard(store))
+    
+    assert first.claim('delivery-1') is None
+    assert second.claim('delivery-1') == {'job_id': None, 'seen_at': None}
+    first.complete('delivery-1', 'job-1')
+    assert second.claim('delivery-1')['job_id'] == 'job-1'
+    
+    assert second.claim('delivery-2') is None
+    first.release('delivery-2')
+    assert second.claim('delivery-2') is None
+    assert store.read()['status']['duplicate_deliveries'] == 2
+    
+    
+def test_shared_log_file_is_reopened_after_external_rotation(make_hook, tmp_path):
+    listener = make_hook().listener
+    log_file = str(tmp_path / 'shared.log')
+    handler = listener.create_file_handler(log_file, logging.Formatter('%(message)s'), shared=True)
+    
+    assert isinstance(handler, logging.handlers.WatchedFileHandler)
+    handler.emit(logging.makeLogRecord({'msg': 'before rotation'}))
+    os.rename(log_file, f"{log_file}.1")
+    handler.emit(logging.makeLogRecord({'msg': 'after rotation'}))
+    handler.close()
+    
+    assert open(f"{log_file}.1").read() == 'before rotation\n'
+    assert open(log_file).read() == 'after rotation\n'
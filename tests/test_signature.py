@@ -0,0 +1,121 @@
+import io
+import json
+
+import pytest
+
+import webhook_listener
+from conftest import push_payload, sign
+
+
+class UnreadableStream(io.BytesIO):
+    """Request body that fails the test if anything reads it"""
+    
+    def read(self, *args):
+        raise AssertionError('body was read')
+        
+    readline = readinto = read
+        
+        
+@pytest.fixture(params=['json', 'orjson'])
+def hook(request, make_hook):
+    if request.param == 'orjson' and webhook_listener.orjson is None:
+        pytest.skip('orjson is not installed')
+    hook = make_hook(JSON_BACKEND='json' if request.param == 'json' else 'auto', MAX_PAYLOAD_BYTES='4096')
+    expected = json.loads if request.param == 'json' else webhook_listener.orjson.loads
+    assert hook.listener.json_loads is expected
+    return hook
+    
+    
+@pytest.fixture
+def parsed(hook):
+    """Bodies handed to the JSON parser"""
+    calls = []
+    loads = hook.listener.json_loads
+    hook.listener.json_loads = lambda body: calls.append(bytes(body)) or loads(body)
+    return calls
+    
+    
+def test_signed_push_is_queued(hook, parsed):
+    body = push_payload('a' * 40, 'b' * 40, ['server.js'], ref='refs/heads/other')
+    
+    response = hook.post(body)
+    
+    assert response.status_code == 200
+    assert parsed == [body]
+    
+    
+@pytest.mark.parametrize('signature', [
+    None,
+    '',
+    'sha256=',
+    'sha1=0123456789abcdef',
+    'sha256',
+    'sha256=' + '0' * 64,
+])
+def test_bad_signatures_are_rejected_before_parsing(hook, parsed, signature):
+    body = b'{"ref": "refs/heads/live", "commits": []}'
+    headers = {'Content-Type': 'application/json'}
+    if signature is not None:
+        headers['X-Hub-Signature-256'] = signature
+        
+    response = hook.client.post('/webhook', data=body, headers=headers)
+    
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Invalid signature'}
+    assert parsed == []
+    
+    
+def test_signature_for_another_secret_is_rejected(hook, parsed):
+    body = b'{"ref": "refs/heads/live"}'
+    
+    assert hook.post(body, **{'X-Hub-Signature-256': sign(body, 'other-secret')}).status_code == 401
+    assert parsed == []
+    
+    
+def test_invalid_json_with_bad_signature_is_401_not_400(hook, parsed):
+    assert hook.post(b'not json', **{'X-Hub-Signature-256': 'sha256=' + '0' * 64}).status_code == 401
+    assert parsed == []
+    
+    
+def test_oversized_content_length_is_rejected_before_reading(hook):
+    response = hook.client.post('/webhook', input_stream=UnreadableStream(), headers={
+        'X-Hub-Signature-256': 'sha256=' + '0' * 64,
+        'Content-Type': 'application/json'
+    }, environ_overrides={'CONTENT_LENGTH': '4097'})
+    
+    assert response.status_code == 413
+    assert response.get_json() == {'error': 'Payload too large'}
+    
+    
+def test_oversized_chunked_body_is_rejected(hook, parsed):
+    body = json.dumps({'ref': 'refs/heads/live', 'padding': 'x' * 5000}).encode()
+    
+    response = hook.client.post('/webhook', input_stream=io.BytesIO(body), headers={
+        'X-Hub-Signature-256': sign(body),
+        'Transfer-Encoding': 'chunked',
+        'Content-Type': 'application/json'
+    }, environ_overrides={'wsgi.input_terminated': True})
+    
+    assert response.status_code == 413
+    assert parsed == []
+    
+    
+def test_chunked_body_within_limit_is_accepted(hook, parsed):
+    body = push_payload('a' * 40, 'b' * 40, ['server.js'], ref='refs/heads/other')
+    
+    response = hook.client.post('/webhook', input_stream=io.BytesIO(body), headers={
+        'X-Hub-Signature-256': sign(body),
+        'Transfer-Encoding': 'chunked',
+        'Content-Type': 'application/json'
+    }, environ_overrides={'wsgi.input_terminated': True})
+    
+    assert response.status_code == 200
+    assert parsed == [body]
+    
+    
+@pytest.mark.parametrize('body', [b'not json', b'[]', b'"push"', b'42', b'null'])
+def test_signed_non_object_payload_is_400(hook, body):
+    response = hook.post(body)
+    
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid JSON payload'}
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+from webhook_listener import DeploymentJob
+
+
+def events(body: str):
+    """Parse a text/event-stream body into (id, data) pairs, skipping comments"""
+    parsed = []
+    for block in body.split('\n\n'):
+        lines = [line for line in block.split('\n') if line and not line.startswith(':')]
+        if not lines:
+            continue
+        fields = dict(line.split(': ', 1) for line in lines)
+        parsed.append((int(fields['id']) if 'id' in fields else None, json.loads(fields['data'])))
+    return parsed
+    
+    
+def finished_job(listener, lines: int, output_limit: int = 500) -> DeploymentJob:
+    job = DeploymentJob('refs/heads/live', 'a' * 40, [], output_limit)
+    for i in range(lines):
+        job.append_output('stdout', f"line {i + 1}")
+    job.status = 'succeeded'
+    listener.deployment_queue.remember(job)
+    return job
+    
+    
+def read(hook, path, **headers):
+    response = hook.client.get(path, headers=headers)
+    try:
+        return response.status_code, response.get_data(as_text=True)
+    finally:
+        response.close()
+        
+        
+@pytest.fixture
+def hook(make_hook):
+    return make_hook()
+    
+    
+def test_stream_replays_buffer_and_ends_with_final_status(hook):
+    job = finished_job(hook.listener, 3)
+    
+    status, body = read(hook, f'/deployments/{job.id}/stream')
+    
+    assert status == 200 and body.startswith(':ok\n\n')
+    assert [(event_id, data['type'], data.get('line')) for event_id, data in events(body)] == [
+        (1, 'output', 'line 1'), (2, 'output', 'line 2'), (3, 'output', 'line 3'), (None, 'status', None)
+    ]
+    assert events(body)[-1][1]['status'] == 'succeeded'
+    
+    
+def test_stream_resumes_after_last_event_id(hook):
+    job = finished_job(hook.listener, 5)
+    
+    _, by_header = read(hook, f'/deployments/{job.id}/stream', **{'Last-Event-ID': '3'})
+    _, by_query = read(hook, f'/deployments/{job.id}/stream?cursor=3')
+    
+    assert [event_id for event_id, _ in events(by_header)] == [4, 5, None]
+    assert by_query == by_header
+    
+    
+def test_stream_reports_entries_lost_from_the_ring_buffer(hook):
+    job = finished_job(hook.listener, 10, output_limit=4)
+    
+    _, body = read(hook, f'/deployments/{job.id}/stream?cursor=2')
+    
+    parsed = events(body)
+    assert parsed[0] == (None, {'type': 'truncated', 'missed': 4})
+    assert [event_id for event_id, _ in parsed[1:-1]] == [7, 8, 9, 10]
+    
+    
+def test_stream_rejects_bad_cursor_and_unknown_job(hook):
+    job = finished_job(hook.listener, 1)
+    
+    assert read(hook, f'/deployments/{job.id}/stream?cursor=abc')[0] == 400
+    assert read(hook, '/deployments/unknown/stream')[0] == 404
+    
+    
+def test_stream_cap_is_sized_from_request_threads(make_hook):
+    hook = make_hook(WEB_THREADS='3', STREAM_RESERVED_THREADS='2')
+    running = DeploymentJob('refs/heads/live', 'b' * 40, [])
+    running.status = 'running'
+    hook.listener.deployment_queue.remember(running)
+    
+    assert hook.listener.max_stream_subscribers == 1
+    first = hook.client.get(f'/deployments/{running.id}/stream')
+    second = hook.client.get(f'/deployments/{running.id}/stream')
+    assert first.status_code == 200
+    assert second.status_code == 503 and second.headers['Retry-After'] == '5'
+    assert hook.client.get('/status').get_json()['worker']['stream_subscribers'] == 1
+    
+    first.close()
+    third = hook.client.get(f'/deployments/{running.id}/stream')
+    assert third.status_code == 200
+    third.close()
+    
+    
+def test_streaming_disabled_without_spare_threads(make_hook):
+    hook = make_hook(WEB_THREADS='2')
+    job = finished_job(hook.listener, 1)
+    
+    status, body = read(hook, f'/deployments/{job.id}/stream')
+    
+    assert status == 503
+    assert 'disabled' in body
@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from webhook_listener import ConfigurationError, DeploymentJob, sync_tree
+
+
+def write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    
+    
+class TargetHealth:
+    """Health endpoints for several targets, /<name> answers 500 while the target is broken"""
+    
+    def __init__(self):
+        self.broken = set()
+        self.probes = []
+        health = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.strip('/')
+                health.probes.append((name, time.time()))
+                self.send_response(500 if name in health.broken else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                
+            def log_message(self, *args):
+                pass
+                
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        
+        
+@pytest.fixture
+def health():
+    stub = TargetHealth()
+    yield stub
+    stub.stop()
+    
+    
+@pytest.fixture
+def make_listener(tmp_path, monkeypatch, fake_tools):
+    """Build a listener for the given targets, running from a scratch directory"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('GITHUB_WEBHOOK_SECRET', 'test-secret')
+    monkeypatch.setenv('PM2_HOME', str(tmp_path / 'pm2'))
+    monkeypatch.setenv('HEALTH_CHECK_DEADLINE', '1')
+    monkeypatch.setenv('HEALTH_CHECK_INITIAL_DELAY', '0.1')
+    monkeypatch.setenv('HEALTH_CHECK_MAX_DELAY', '0.2')
+    monkeypatch.setenv('TARGET_SYNC_EXCLUDE', 'logs,.env')
+    
+    def make(targets, **env):
+        import webhook_listener
+        
+        monkeypatch.setenv('DEPLOY_TARGETS', json.dumps(targets))
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        listener = webhook_listener.WebhookListener()
+        listener.repo_path = str(tmp_path / 'build')
+        return listener
+        
+    return make
+    
+    
+@pytest.fixture
+def build(tmp_path):
+    root = tmp_path / 'build'
+    write(root / 'server.js', 'v2')
+    write(root / 'public' / 'app.css', 'body {}')
+    return root
+    
+    
+def local_targets(tmp_path, health, count):
+    return [{'path': str(tmp_path / f"t{i}"), 'pm2_app': f"app-{i}", 'health_url': f"{health.url}/t{i}"}
+            for i in range(1, count + 1)]
+            
+            
+def test_sync_tree_mirrors_and_deletes(tmp_path):
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    write(src / 'server.js', 'new')
+    write(src / 'public' / 'a.css', 'a')
+    (src / 'link').symlink_to('server.js')
+    write(dst / 'server.js', 'old')
+    os.utime(dst / 'server.js', (0, 0))
+    write(dst / 'stale.js', 'x')
+    write(dst / 'public' / 'gone' / 'b.css', 'b')
+    write(dst / 'logs' / 'app.log', 'keep')
+    
+    stats = sync_tree(str(src), str(dst), ('logs',))
+    
+    assert (dst / 'server.js').read_text() == 'new'
+    assert (dst / 'public' / 'a.css').read_text() == 'a'
+    assert os.readlink(dst / 'link') == 'server.js'
+    assert not (dst / 'stale.js').exists()
+    assert not (dst / 'public' / 'gone').exists()
+    assert (dst / 'logs' / 'app.log').read_text() == 'keep'
+    assert stats == {'copied': 3, 'deleted': 2, 'unchanged': 0}
+    
+    
+def test_sync_tree_skips_unchanged_files(tmp_path):
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    write(src / 'server.js', 'same')
+    write(src / 'public' / 'a.css', 'a')
+    sync_tree(str(src), str(dst))
+    write(src / 'public' / 'a.css', 'changed')
+    os.utime(src / 'public' / 'a.css', (time.time() + 5, time.time() + 5))
+    
+    stats = sync_tree(str(src), str(dst))
+    
+    assert stats == {'copied': 1, 'deleted': 0, 'unchanged': 1}
+    assert (dst / 'public' / 'a.css').read_text() == 'changed'
+    
+    
+def test_sync_tree_replaces_file_with_directory(tmp_path):
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    write(src / 'public' / 'a.css', 'a')
+    write(dst / 'public', 'was a file')
+    
+    sync_tree(str(src), str(dst))
+    
+    assert (dst / 'public' / 'a.css').read_text() == 'a'
+    
+    
+def test_several_targets_need_distinct_health_urls(tmp_path, make_listener, health):
+    targets = local_targets(tmp_path, health, 2)
+    
+    del targets[1]['health_url']
+    with pytest.raises(ConfigurationError, match='needs its own health_url'):
+        make_listener(targets)
+        
+    targets[1]['health_url'] = targets[0]['health_url']
+    with pytest.raises(ConfigurationError, match='must not share a health_url'):
+        make_listener(targets)
+        
+        
+def test_rollout_deploys_batch_by_batch(tmp_path, make_listener, health, build):
+    listener = make_listener(local_targets(tmp_path, health, 4), TARGET_BATCH_SIZE='2', TARGET_CONCURRENCY='2')
+    job = DeploymentJob('refs/heads/live', None, [])
+    
+    assert listener.rollout(job, 'full')
+    
+    assert [(t['name'], t['batch'], t['status']) for t in job.targets] == [
+        ('app-1', 0, 'succeeded'), ('app-2', 0, 'succeeded'), ('app-3', 1, 'succeeded'), ('app-4', 1, 'succeeded')
+    ]
+    assert all([step['name'] for step in t['steps']] == ['sync', 'reload', 'health'] for t in job.targets)
+    for i in range(1, 5):
+        assert (tmp_path / f"t{i}" / 'server.js').read_text() == 'v2'
+    # The second batch only starts once the first one is healthy
+    first_batch_healthy = max(at for name, at in health.probes if name in ('t1', 't2'))
+    second_batch_synced = min(step['started_at'] for t in job.targets[2:] for step in t['steps'])
+    assert second_batch_synced >= first_batch_healthy
+    
+    
+def test_failed_batch_skips_remaining_targets(tmp_path, make_listener, health, build):
+    listener = make_listener(local_targets(tmp_path, health, 5), TARGET_BATCH_SIZE='2', TARGET_CONCURRENCY='2')
+    health.broken.add('t3')
+    job = DeploymentJob('refs/heads/live', None, [])
+    
+    assert not listener.rollout(job, 'full')
+    
+    assert [t['status'] for t in job.targets] == ['succeeded', 'succeeded', 'failed', 'succeeded', 'skipped']
+    assert job.targets[2]['steps'][-1] == dict(job.targets[2]['steps'][-1], name='health', status='failed')
+    assert job.error == 'Batch 2/3 failed on app-3'
+    assert not (tmp_path / 't5').exists()
+    assert not any(name == 't5' for name, _ in health.probes)
+    
+    
+def test_static_rollout_only_syncs(tmp_path, make_listener, health, build):
+    listener = make_listener(local_targets(tmp_path, health, 2))
+    health.broken.update({'t1', 't2'})
+    job = DeploymentJob('refs/heads/live', None, [])
+    
+    assert listener.rollout(job, 'static')
+    
+    assert [[step['name'] for step in t['steps']] for t in job.targets] == [['sync'], ['sync']]
+    assert health.probes == []
@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+"""
+Webhook Listener Benchmark
+==========================
+
+Drives WebhookListener end to end against local stand-ins and reports how it
+performs:
+
+- a temporary bare git repository acting as `origin` (branch `live`)
+- fake `pm2` and `npm` executables (npm sleeps --npm-delay seconds)
+- a stub health server answering /api/health and /api/db/health
+
+Scenarios:
+
+- ack: signed synthetic pushes of several payload sizes, sent in bursts from
+  several threads; reports webhook ack latency percentiles
+- deploy: sequential pushes that each wait until the deployment is healthy;
+  reports deploys per minute and push-to-healthy time
+- burst: many pushes at once; reports how many deployments actually ran
+  after coalescing and the time until the last push is live
+- log_commits: peak RSS while logging one very large payload
+
+Results are written as JSON (--output). Pass an earlier result with
+--baseline to compare; the exit status is 1 when a metric regressed by
+more than --tolerance.
+
+Usage:
+    python3 webhook_benchmark.py
+    python3 webhook_benchmark.py --deploys 20 --npm-delay 1 --output baseline.json
+    python3 webhook_benchmark.py --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import hmac
+import hashlib
+import argparse
+import contextlib
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from colorama import Fore, Style, init
+
+init(autoreset=True)
+
+RESULT_VERSION = 1
+
+# (metric path, direction, noise) compared against a baseline; 'lower' means smaller
+# is better, and absolute changes below noise never count as a regression
+COMPARED_METRICS = (
+    ('ack_latency.all.p50', 'lower', 0.001),
+    ('ack_latency.all.p99', 'lower', 0.005),
+    ('deploy.deploys_per_minute', 'higher', 1),
+    ('deploy.push_to_healthy.p50', 'lower', 0.05),
+    ('deploy.push_to_healthy.p95', 'lower', 0.05),
+    ('burst.seconds_to_healthy', 'lower', 0.05),
+    ('log_commits.peak_delta_bytes', 'lower', 4 * 1024 * 1024),
+    ('log_commits.seconds', 'lower', 0.05),
+)
+
+FAKE_PM2 = """#!/bin/sh
+if [ "$1" = "jlist" ]; then
+  echo '[{"name":"live-error-display","pid":4242,"pm2_env":{"status":"online","pm_uptime":1,"restart_time":0}}]'
+fi
+exit 0
+"""
+
+FAKE_NPM = """#!/bin/sh
+i=0
+while [ $i -lt "${BENCH_NPM_LINES:-200}" ]; do echo "npm http fetch GET 200 package-$i"; i=$((i+1)); done
+sleep "${BENCH_NPM_DELAY:-0.5}"
+echo "added ${BENCH_NPM_LINES:-200} packages"
+"""
+
+
+def percentiles(values: List[float]) -> Dict:
+    """Nearest-rank percentiles (same method as /deployments/stats)"""
+    values = sorted(values)
+    if not values:
+        return {'count': 0, 'p50': None, 'p90': None, 'p95': None, 'p99': None, 'max': None}
+    result = {'count': len(values)}
+    for pct in (50, 90, 95, 99):
+        result[f"p{pct}"] = round(values[max(0, -(-len(values) * pct // 100) - 1)], 6)
+    result['max'] = round(values[-1], 6)
+    return result
+
+
+def reset_peak_rss() -> bool:
+    """Reset the kernel's peak RSS mark (VmHWM) of this process, Linux only"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def read_rss() -> Tuple[int, int]:
+    """Current and peak RSS of this process in bytes"""
+    try:
+        with open('/proc/self/status') as f:
+            status = f.read()
+        current = int(re.search(r'VmRSS:\s+(\d+)', status).group(1)) * 1024
+        peak = int(re.search(r'VmHWM:\s+(\d+)', status).group(1)) * 1024
+        return current, peak
+    except (OSError, AttributeError):
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == 'darwin' else 1024
+        return peak, peak
+
+
+class HealthStub:
+    """Threaded HTTP server standing in for the app's health endpoints"""
+
+    def __init__(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                healthy = self.path in ('/api/health', '/api/db/health')
+                body = json.dumps({'status': 'ok' if healthy else 'unknown'}).encode()
+                self.send_response(200 if healthy else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='health-stub', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.server.shutdown()
+        self.server.server_close()
+
+
+class Sandbox:
+    """Temporary origin, working clone, deploy checkout and fake tools"""
+
+    BRANCH = 'live'
+
+    def __init__(self, workdir: str):
+        self.workdir = workdir
+        self.origin = os.path.join(workdir, 'origin.git')
+        self.work = os.path.join(workdir, 'work')
+        self.app = os.path.join(workdir, 'app')
+        self.bin = os.path.join(workdir, 'bin')
+        self.commits = 0
+
+    def git(self, *args, cwd: str = None) -> str:
+        result = subprocess.run(
+            ['git', '-c', 'user.name=Benchmark', '-c', 'user.email=bench@localhost', *args],
+            cwd=cwd or self.work, capture_output=True, text=True, check=True
+        )
+        return result.stdout.strip()
+
+    def create(self):
+        os.makedirs(self.bin)
+        for name, script in (('pm2', FAKE_PM2), ('npm', FAKE_NPM)):
+            path = os.path.join(self.bin, name)
+            with open(path, 'w') as f:
+                f.write(script)
+            os.chmod(path, 0o755)
+
+        self.git('init', '-q', '--bare', self.origin, cwd=self.workdir)
+        self.git('clone', '-q', self.origin, self.work, cwd=self.workdir)
+        self.git('checkout', '-q', '-b', self.BRANCH)
+        self.write('package.json', json.dumps({'name': 'live-error-display', 'version': '1.0.0'}))
+        self.write('server.js', "console.log('bench 0');\n")
+        self.write('public/css/style.css', 'body { color: #000; }\n')
+        self.write('README.md', '# bench\n')
+        self.git('add', '-A')
+        self.git('commit', '-qm', 'Initial commit')
+        self.git('push', '-q', 'origin', self.BRANCH)
+        self.git('clone', '-q', '-b', self.BRANCH, self.origin, self.app, cwd=self.workdir)
+
+    def write(self, path: str, content: str):
+        full_path = os.path.join(self.work, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            f.write(content)
+
+    def push(self, install: bool) -> Tuple[str, str, List[str]]:
+        """Commit a change (package.json when install is set, else server.js) and push it
+        
+        Returns (before, after, changed files) like a GitHub push payload.
+        """
+        before = self.git('rev-parse', 'HEAD')
+        self.commits += 1
+        if install:
+            path = 'package.json'
+            self.write(path, json.dumps({'name': 'live-error-display', 'version': f"1.0.{self.commits}"}))
+        else:
+            path = 'server.js'
+            self.write(path, f"console.log('bench {self.commits}');\n")
+        self.git('commit', '-qam', f"Benchmark change {self.commits}")
+        self.git('push', '-q', 'origin', self.BRANCH)
+        return before, self.git('rev-parse', 'HEAD'), [path]
+
+
+class WebhookBenchmark:
+    """Runs the benchmark scenarios against an in-process WebhookListener"""
+
+    TERMINAL_STATUSES = ('succeeded', 'failed', 'rolled_back', 'cancelled')
+
+    def __init__(self, args: argparse.Namespace, workdir: str):
+        self.args = args
+        self.workdir = workdir
+        self.sandbox = Sandbox(workdir)
+        self.health = HealthStub()
+        self.secret = uuid.uuid4().hex
+        self.listener = None
+        self.client = None
+
+    def setup(self):
+        self.sandbox.create()
+        self.health.start()
+
+        os.environ['PATH'] = f"{self.sandbox.bin}{os.pathsep}{os.environ['PATH']}"
+        for name in ('STATE_DIR', 'DEPLOY_TARGETS', 'DEPLOY_TARGETS_FILE', 'DELIVERY_CACHE_FILE', 'STEP_TIMEOUTS'):
+            os.environ.pop(name, None)
+        os.environ.update({
+            'GITHUB_WEBHOOK_SECRET': self.secret,
+            'TARGET_BRANCH': Sandbox.BRANCH,
+            'DEPLOY_MODE': self.args.mode,
+            'DEPLOY_DEBOUNCE_SECONDS': str(self.args.debounce),
+            'DEPLOY_QUEUE_SIZE': str(max(10, self.args.burst_pushes)),
+            'RELEASES_DIR': os.path.join(self.workdir, 'releases'),
+            'CURRENT_LINK': os.path.join(self.workdir, 'current'),
+            'DEPENDENCY_CACHE_DIR': os.path.join(self.workdir, 'dependency-cache'),
+            'DEPLOY_HISTORY_DB': os.path.join(self.workdir, 'deployments.db'),
+            'PM2_HOME': os.path.join(self.workdir, 'pm2'),
+            'HEALTH_CHECK_URL': f"{self.health.url}/api/health",
+            'DB_HEALTH_CHECK_URL': f"{self.health.url}/api/db/health",
+            'BENCH_NPM_DELAY': str(self.args.npm_delay),
+            'BENCH_NPM_LINES': str(self.args.npm_lines),
+        })
+
+        import webhook_listener
+
+        # The listener's console handler binds sys.stderr when it is created;
+        # the file stays open for as long as the listener may log
+        self.console_log = open(os.path.join(self.workdir, 'listener-console.log'), 'a')
+        redirect = contextlib.nullcontext() if self.args.verbose else contextlib.redirect_stderr(self.console_log)
+        with redirect:
+            self.listener = webhook_listener.WebhookListener()
+        self.listener.repo_path = self.sandbox.app
+        self.client = self.listener.app.test_client()
+
+    def teardown(self):
+        self.health.stop()
+
+    def sign(self, body: bytes) -> str:
+        return 'sha256=' + hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+
+    def payload(self, sha: str, commit_count: int, files_per_commit: int, files: List[str] = None,
+                before: str = None) -> bytes:
+        """Build a GitHub push payload; synthetic commits touch docs/ so they plan as noop"""
+        commits = []
+        for i in range(commit_count):
+            commit_files = files or [f"docs/bench/{i}/file-{j}.md" for j in range(files_per_commit)]
+            commits.append({
+                'id': sha if i == commit_count - 1 else hashlib.sha1(f"{sha}{i}".encode()).hexdigest(),
+                'message': f"Benchmark commit {i}",
+                'timestamp': datetime.now().isoformat(),
+                'author': {'name': 'Benchmark', 'email': 'bench@localhost'},
+                'added': [],
+                'modified': commit_files,
+                'removed': []
+            })
+        return json.dumps({
+            'ref': f"refs/heads/{Sandbox.BRANCH}",
+            'before': before or '0' * 40,
+            'after': sha,
+            'repository': {'full_name': 'bench/live-error-display'},
+            'pusher': {'name': 'Benchmark'},
+            'commits': commits
+        }).encode()
+
+    def post(self, body: bytes) -> Tuple[int, float, Optional[str]]:
+        """Send a signed webhook; returns (status code, seconds, job id)"""
+        headers = {
+            'Content-Type': 'application/json',
+            'X-GitHub-Event': 'push',
+            'X-GitHub-Delivery': str(uuid.uuid4()),
+            'X-Hub-Signature-256': self.sign(body)
+        }
+        start = time.perf_counter()
+        response = self.client.post('/webhook', data=body, headers=headers)
+        elapsed = time.perf_counter() - start
+        job_id = (response.get_json(silent=True) or {}).get('job_id')
+        return response.status_code, elapsed, job_id
+
+    def wait_for(self, job_id: str, timeout: float):
+        """Wait until a job (or the job it was coalesced into) has finished"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = self.listener.find_deployment(job_id)
+            if job is not None and job.status == 'coalesced' and job.coalesced_into:
+                job_id = job.coalesced_into
+                continue
+            if job is not None and job.status in self.TERMINAL_STATUSES:
+                return job
+            time.sleep(0.01)
+        raise TimeoutError(f"Deployment {job_id} did not finish within {timeout}s")
+
+    def wait_idle(self, timeout: float = 60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            stats = self.listener.deployment_queue.stats()
+            if not stats['depth'] and not stats['current_job']:
+                return
+            time.sleep(0.05)
+
+    def run_ack(self) -> Dict:
+        """Ack latency of signed pushes per payload size, sent in bursts"""
+        sha = self.sandbox.git('rev-parse', 'HEAD')
+        results = {}
+        everything = []
+        for size in self.args.sizes:
+            commit_count, files_per_commit = size
+            body = self.payload(sha, commit_count, files_per_commit)
+            latencies = []
+            codes = {}
+            with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+                remaining = self.args.requests
+                while remaining > 0:
+                    burst = min(self.args.burst_size, remaining)
+                    for code, elapsed, _ in pool.map(lambda _: self.post(body), range(burst)):
+                        latencies.append(elapsed)
+                        codes[code] = codes.get(code, 0) + 1
+                    remaining -= burst
+                    if self.args.burst_interval:
+                        time.sleep(self.args.burst_interval)
+            self.wait_idle()
+            name = f"{commit_count}x{files_per_commit}"
+            results[name] = dict(percentiles(latencies), payload_bytes=len(body), status_codes=codes)
+            everything.extend(latencies)
+            self.report_line(f"ack {name}", results[name], f"{len(body) / 1024:.1f} KiB")
+        results['all'] = percentiles(everything)
+        return results
+
+    def run_deploy(self) -> Dict:
+        """Sequential push -> healthy deployments"""
+        durations = []
+        plans = {}
+        failures = 0
+        started = time.perf_counter()
+        for i in range(self.args.deploys):
+            install = self.args.install_every > 0 and i % self.args.install_every == 0
+            before, sha, files = self.sandbox.push(install)
+            pushed_at = time.time()
+            code, _, job_id = self.post(self.payload(sha, 1, 0, files, before))
+            if code != 202:
+                failures += 1
+                continue
+            job = self.wait_for(job_id, self.args.timeout)
+            plans[job.plan] = plans.get(job.plan, 0) + 1
+            if job.status == 'succeeded':
+                durations.append(job.finished_at - pushed_at)
+            else:
+                failures += 1
+        elapsed = time.perf_counter() - started
+        result = {
+            'deploys': self.args.deploys,
+            'failures': failures,
+            'seconds': round(elapsed, 3),
+            'deploys_per_minute': round(self.args.deploys * 60 / elapsed, 2),
+            'plans': plans,
+            'push_to_healthy': percentiles(durations)
+        }
+        self.report_line('push-to-healthy', result['push_to_healthy'])
+        print(f"  {'deploys/minute':<18} {result['deploys_per_minute']:>10} ({failures} failed, plans {plans})")
+        return result
+
+    def run_burst(self) -> Dict:
+        """Many pushes at once; coalescing decides how many deployments run"""
+        pushes = []
+        for i in range(self.args.burst_pushes):
+            pushes.append(self.sandbox.push(install=False))
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            posted = list(pool.map(lambda push: self.post(self.payload(push[1], 1, 0, push[2], push[0])), pushes))
+        job_ids = [job_id for code, _, job_id in posted if code == 202]
+        last = self.wait_for(job_ids[-1], self.args.timeout) if job_ids else None
+        self.wait_idle()
+        ran = [
+            job for job in (self.listener.find_deployment(job_id) for job_id in job_ids)
+            if job is not None and job.status != 'coalesced'
+        ]
+        result = {
+            'pushes': self.args.burst_pushes,
+            'accepted': len(job_ids),
+            'deployments': len(ran),
+            'status': last.status if last else None,
+            'seconds_to_healthy': round(last.finished_at - started, 3) if last else None
+        }
+        print(f"  {'burst':<18} {result['pushes']} pushes -> {result['deployments']} deployments, "
+              f"live after {result['seconds_to_healthy']}s ({result['status']})")
+        return result
+
+    def run_log_commits(self) -> Dict:
+        """Peak RSS while logging one large push payload"""
+        commit_count, files_per_commit = self.args.log_size
+        body = self.payload(uuid.uuid4().hex + '0' * 8, commit_count, files_per_commit)
+        commits = json.loads(body)['commits']
+        dropped_before = self.listener.log_handler.dropped
+        exact = reset_peak_rss()
+        before, _ = read_rss()
+        start = time.perf_counter()
+        self.listener.log_commits(commits)
+        # Records are formatted on the logging thread; include that work
+        while not self.listener.log_handler.queue.empty():
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        _, peak = read_rss()
+        result = {
+            'commits': commit_count,
+            'files_per_commit': files_per_commit,
+            'payload_bytes': len(body),
+            'rss_before_bytes': before,
+            'peak_rss_bytes': peak,
+            'peak_delta_bytes': max(0, peak - before),
+            'peak_is_exact': exact,
+            'seconds': round(elapsed, 6),
+            'log_records_dropped': self.listener.log_handler.dropped - dropped_before
+        }
+        print(f"  {'log_commits':<18} {commit_count}x{files_per_commit} ({len(body) / 1024 / 1024:.1f} MiB): "
+              f"peak +{result['peak_delta_bytes'] / 1024 / 1024:.1f} MiB, {elapsed * 1000:.1f} ms"
+              + ('' if exact else ' (process peak, not reset)'))
+        return result
+
+    @staticmethod
+    def report_line(name: str, stats: Dict, note: str = ''):
+        if not stats['count']:
+            print(f"  {name:<18} no samples")
+            return
+        print(f"  {name:<18} p50 {stats['p50'] * 1000:8.2f} ms  p90 {stats['p90'] * 1000:8.2f} ms  "
+              f"p99 {stats['p99'] * 1000:8.2f} ms  max {stats['max'] * 1000:8.2f} ms  {note}")
+
+    def run(self) -> Dict:
+        result = {
+            'version': RESULT_VERSION,
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': {
+                'mode': self.args.mode,
+                'debounce': self.args.debounce,
+                'npm_delay': self.args.npm_delay,
+                'npm_lines': self.args.npm_lines,
+                'sizes': [f"{c}x{f}" for c, f in self.args.sizes],
+                'requests': self.args.requests,
+                'concurrency': self.args.concurrency,
+                'burst_size': self.args.burst_size,
+                'deploys': self.args.deploys,
+                'install_every': self.args.install_every,
+                'burst_pushes': self.args.burst_pushes,
+                'log_size': '{}x{}'.format(*self.args.log_size)
+            }
+        }
+        scenarios = (
+            ('ack_latency', 'ack', self.run_ack),
+            ('deploy', 'deploy', self.run_deploy),
+            ('burst', 'burst', self.run_burst),
+            ('log_commits', 'log_commits', self.run_log_commits),
+        )
+        for key, name, scenario in scenarios:
+            if name in self.args.skip:
+                continue
+            print(f"{Fore.CYAN}▶️ {name}{Style.RESET_ALL}")
+            result[key] = scenario()
+        return result
+
+
+def metric(result: Dict, path: str):
+    value = result
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Print a comparison with the baseline and return the regressed metrics"""
+    regressions = []
+    print(f"{Fore.CYAN}📊 Compared with baseline from {baseline.get('timestamp', 'unknown')}{Style.RESET_ALL}")
+    if baseline.get('config') != result.get('config'):
+        print(f"{Fore.YELLOW}⚠️ Baseline was recorded with different options, numbers may not be comparable{Style.RESET_ALL}")
+    for path, direction, noise in COMPARED_METRICS:
+        old, new = metric(baseline, path), metric(result, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = change > tolerance if direction == 'lower' else change < -tolerance
+        worse = worse and abs(new - old) >= noise
+        color = Fore.RED if worse else Fore.GREEN
+        print(f"  {path:<32} {old:>14.6g} -> {new:<14.6g} {color}{change:+.1%}{Style.RESET_ALL}")
+        if worse:
+            regressions.append(path)
+    return regressions
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    """'20x50' -> 20 commits with 50 changed files each"""
+    try:
+        commits, files = value.lower().split('x')
+        return int(commits), int(files)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected COMMITSxFILES, got {value!r}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the GitHub webhook listener end to end')
+    parser.add_argument('--sizes', type=parse_size, nargs='+', default=[(1, 3), (20, 20), (200, 50)],
+                        help='push payload sizes for the ack scenario as COMMITSxFILES')
+    parser.add_argument('--requests', type=int, default=200, help='webhooks per payload size')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--burst-size', type=int, default=20, help='webhooks sent back to back per burst')
+    parser.add_argument('--burst-interval', type=float, default=0.05, help='pause between bursts in seconds')
+    parser.add_argument('--deploys', type=int, default=10, help='sequential deployments')
+    parser.add_argument('--install-every', type=int, default=2,
+                        help='every Nth deployment changes package.json (npm install), 0 = never')
+    parser.add_argument('--burst-pushes', type=int, default=10, help='pushes in the burst scenario')
+    parser.add_argument('--log-size', type=parse_size, default=(2000, 100),
+                        help='payload for the log_commits memory scenario as COMMITSxFILES')
+    parser.add_argument('--npm-delay', type=float, default=0.5, help='seconds the fake npm install takes')
+    parser.add_argument('--npm-lines', type=int, default=200, help='output lines of the fake npm install')
+    parser.add_argument('--mode', choices=('inplace', 'release'), default='inplace', help='DEPLOY_MODE')
+    parser.add_argument('--debounce', type=float, default=0, help='DEPLOY_DEBOUNCE_SECONDS')
+    parser.add_argument('--timeout', type=float, default=300, help='max. seconds to wait for one deployment')
+    parser.add_argument('--skip', nargs='*', default=[], choices=('ack', 'deploy', 'burst', 'log_commits'))
+    parser.add_argument('--output', default='webhook_benchmark.json', help='where to write the JSON result')
+    parser.add_argument('--baseline', help='earlier JSON result to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative change before a metric counts as regressed')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary working directory')
+    parser.add_argument('--verbose', action='store_true', help='show the listener log output')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix='webhook-benchmark-')
+    cwd = os.getcwd()
+    # The listener writes ./logs relative to the working directory
+    os.chdir(workdir)
+    benchmark = WebhookBenchmark(args, workdir)
+    try:
+        print(f"{Fore.BLUE}🧪 Webhook listener benchmark ({workdir}){Style.RESET_ALL}")
+        benchmark.setup()
+        result = benchmark.run()
+    finally:
+        benchmark.teardown()
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Working directory kept: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"{Fore.GREEN}✅ Results written to {output}{Style.RESET_ALL}")
+
+    if baseline is not None:
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"{Fore.RED}❌ Regressed: {', '.join(regressions)}{Style.RESET_ALL}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
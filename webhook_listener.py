@@ -27,21 +27,45 @@ import hmac
 import hashlib
 import subprocess
 import logging
+import logging.handlers
+import queue
+import re
+import shlex
+import atexit
+import bisect
+import fcntl
+from contextlib import closing, contextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 import signal
+import shutil
+import socket
+import sqlite3
+import struct
+import fnmatch
 import time
+import threading
+import uuid
+import itertools
+from collections import deque, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 # Third-party imports
 try:
-    from flask import Flask, request, jsonify
+    from flask import Flask, Response, request, jsonify
     from colorama import Fore, Back, Style, init
     import requests
 except ImportError as e:
     print(f"Missing required packages. Install with: pip install flask colorama requests")
     sys.exit(1)
 
+# Optional faster JSON parser for webhook payloads
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Initialize colorama for Windows compatibility
 init(autoreset=True)
 
@@ -57,32 +81,2104 @@ class ColoredFormatter(logging.Formatter):
     }
     
     def format(self, record):
+        # Color a copy so other handlers still see the plain level name
+        record = logging.makeLogRecord(record.__dict__)
         color = self.COLORS.get(record.levelname, '')
         record.levelname = f"{color}{record.levelname}{Style.RESET_ALL}"
         return super().format(record)
 
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with ANSI colors stripped and structured extras kept"""
+    
+    ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+    EXTRA_FIELDS = ('deployment_id', 'commit', 'files')
+    
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': self.ANSI_ESCAPE.sub('', record.getMessage()).strip()
+        }
+        for field in self.EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DeploymentContextFilter(logging.Filter):
+    """Tag records with the id of the deployment running on the current thread"""
+    
+    def __init__(self, context: threading.local):
+        super().__init__()
+        self.context = context
+        
+    def filter(self, record):
+        if getattr(record, 'deployment_id', None) is None:
+            record.deployment_id = getattr(self.context, 'deployment_id', None)
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller; records are dropped when the queue is full"""
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        
+    def prepare(self, record):
+        # Merge args into the message in the calling thread but leave
+        # formatting (colors, JSON) to the background handlers
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+        
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class ConfigurationError(Exception):
+    """Raised when required configuration is missing"""
+
+
+class QueueFullError(Exception):
+    """Raised when the deployment queue cannot accept another job"""
+
+
+class DeploymentCancelled(Exception):
+    """Raised inside the deployment pipeline when a job has been cancelled"""
+
+
+class CommandRunner:
+    """Run commands from argument vectors, streaming output line by line
+    
+    Each command runs in its own process group so a timeout or cancellation
+    kills everything it spawned. Only the last `tail_lines` lines of each
+    stream are kept, so memory stays flat for verbose commands.
+    """
+    
+    KILL_GRACE = 5
+    
+    def __init__(self, tail_lines: int = 200):
+        self.tail_lines = tail_lines
+        
+    def pump(self, pipe, stream: str, tail: deque, on_line):
+        """Forward lines from a pipe until it is closed"""
+        with pipe:
+            for line in pipe:
+                line = line.rstrip('\n')
+                tail.append(line)
+                if on_line:
+                    on_line(stream, line)
+                    
+    def kill(self, proc: subprocess.Popen):
+        """Terminate the process group, escalating to SIGKILL after a grace period"""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                return
+            try:
+                proc.wait(timeout=self.KILL_GRACE)
+                return
+            except subprocess.TimeoutExpired:
+                continue
+                
+    def run(self, argv: List[str], cwd: str = None, timeout: float = None,
+            cancel_event: threading.Event = None, on_line=None) -> Tuple[int, str, str, str]:
+        """Run a command and return (returncode, stdout tail, stderr tail, outcome)
+        
+        outcome is 'exited', 'timeout' or 'cancelled'.
+        """
+        proc = subprocess.Popen(
+            argv,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors='replace',
+            start_new_session=True
+        )
+        stdout, stderr = deque(maxlen=self.tail_lines), deque(maxlen=self.tail_lines)
+        readers = [
+            threading.Thread(target=self.pump, args=(proc.stdout, 'stdout', stdout, on_line), daemon=True),
+            threading.Thread(target=self.pump, args=(proc.stderr, 'stderr', stderr, on_line), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+            
+        deadline = time.time() + timeout if timeout else None
+        outcome = 'exited'
+        while True:
+            try:
+                proc.wait(timeout=0.05)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if cancel_event is not None and cancel_event.is_set():
+                outcome = 'cancelled'
+            elif deadline and time.time() > deadline:
+                outcome = 'timeout'
+            else:
+                continue
+            self.kill(proc)
+            break
+            
+        for reader in readers:
+            reader.join(timeout=1)
+        return proc.returncode, '\n'.join(stdout), '\n'.join(stderr), outcome
+
+
+def amp_encode(args: List) -> bytes:
+    """Encode a message in the amp framing used by PM2's axon sockets
+    
+    Strings are sent as 's:<str>', bytes as-is and everything else as 'j:<json>'.
+    """
+    parts = []
+    for arg in args:
+        if isinstance(arg, bytes):
+            parts.append(arg)
+        elif isinstance(arg, str):
+            parts.append(b's:' + arg.encode('utf-8'))
+        else:
+            parts.append(b'j:' + json.dumps(arg).encode('utf-8'))
+    header = bytes([(1 << 4) | len(parts)])
+    return header + b''.join(struct.pack('>I', len(part)) + part for part in parts)
+
+
+class AmpDecoder:
+    """Incremental decoder for amp frames read from a stream socket"""
+    
+    def __init__(self):
+        self.buffer = b''
+        
+    def feed(self, data: bytes) -> List[List]:
+        """Add received bytes and return all complete messages"""
+        self.buffer += data
+        messages = []
+        while True:
+            message, consumed = self.parse(self.buffer)
+            if message is None:
+                return messages
+            self.buffer = self.buffer[consumed:]
+            messages.append(message)
+            
+    @staticmethod
+    def parse(buffer: bytes) -> Tuple[Optional[List], int]:
+        if not buffer:
+            return None, 0
+        argc = buffer[0] & 0x0f
+        offset = 1
+        args = []
+        for _ in range(argc):
+            if len(buffer) < offset + 4:
+                return None, 0
+            (length,) = struct.unpack('>I', buffer[offset:offset + 4])
+            offset += 4
+            if len(buffer) < offset + length:
+                return None, 0
+            part = buffer[offset:offset + length]
+            offset += length
+            if part.startswith(b'j:'):
+                args.append(json.loads(part[2:].decode('utf-8')))
+            elif part.startswith(b's:'):
+                args.append(part[2:].decode('utf-8'))
+            else:
+                args.append(part)
+        return args, offset
+
+
+class PM2Client:
+    """Long-lived connection to the PM2 daemon with a cached process list
+    
+    The process list is fetched over the daemon's RPC socket (axon req/rep,
+    the same channel the pm2 CLI uses) and kept in memory. It is refreshed
+    when the daemon publishes a process event on its bus socket, or when the
+    snapshot is older than `ttl` seconds. If the sockets are unavailable the
+    `fallback` callable (normally `pm2 jlist`) is used instead.
+    
+    Lookups never wait for a refresh: a stale snapshot is returned right away
+    while a single background thread fetches the next one.
+    """
+    
+    def __init__(self, pm2_home: str, ttl: float, fallback, logger: logging.Logger, rpc_timeout: float = 5):
+        self.rpc_path = os.path.join(pm2_home, 'rpc.sock')
+        self.bus_path = os.path.join(pm2_home, 'pub.sock')
+        self.ttl = ttl
+        self.fallback = fallback
+        self.logger = logger
+        self.rpc_timeout = rpc_timeout
+        self.identity = f"webhook-{os.getpid()}"
+        self.request_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.refresh_state = threading.Lock()
+        self.refreshing = False
+        self.sock = None
+        self.decoder = None
+        self.processes = None
+        self.fetched_at = 0
+        self.source = None
+        self.rpc_calls = 0
+        self.fallback_calls = 0
+        self.bus_events = 0
+        self.bus_connected = False
+        
+    def start(self):
+        """Start following the daemon's event bus and fetch a first snapshot in the background"""
+        threading.Thread(target=self.follow_bus, name='pm2-bus', daemon=True).start()
+        self.refresh_in_background()
+        
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.rpc_timeout)
+        self.sock.connect(self.rpc_path)
+        self.decoder = AmpDecoder()
+        
+    def disconnect(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        
+    def call(self, method: str, *args):
+        """Invoke a method on the daemon's RPC server and return its result"""
+        if self.sock is None:
+            self.connect()
+        request_id = f"{self.identity}:{next(self.request_ids)}"
+        self.sock.sendall(amp_encode([{'type': 'call', 'method': method, 'args': list(args)}, request_id]))
+        while True:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError('PM2 RPC socket closed')
+            for message in self.decoder.feed(data):
+                if not message or message[-1] != request_id:
+                    continue
+                reply = message[0] or {}
+                if reply.get('type') == 'error' or 'error' in reply:
+                    raise RuntimeError(f"PM2 RPC {method} failed: {reply.get('error')}")
+                self.rpc_calls += 1
+                result = reply.get('args') or [None]
+                return result[0]
+                
+    def refresh(self) -> Optional[List[Dict]]:
+        """Fetch a new process list, preferring RPC over the fallback"""
+        with self.lock:
+            processes = None
+            if os.path.exists(self.rpc_path):
+                try:
+                    processes = self.call('getMonitorData', {})
+                    self.source = 'rpc'
+                except (OSError, ValueError, RuntimeError) as e:
+                    self.logger.debug(f"PM2 RPC unavailable, falling back to CLI: {e}")
+                    self.disconnect()
+            if processes is None and self.fallback:
+                processes = self.fallback()
+                self.fallback_calls += 1
+                self.source = 'cli'
+            if processes is not None:
+                self.processes = processes
+                self.fetched_at = time.time()
+            return self.processes
+            
+    def refresh_in_background(self):
+        """Start a refresh on its own thread unless one is already running"""
+        with self.refresh_state:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.background_refresh, name='pm2-refresh', daemon=True).start()
+        
+    def background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self.logger.debug(f"PM2 status refresh failed: {e}")
+        finally:
+            with self.refresh_state:
+                self.refreshing = False
+                
+    def invalidate(self):
+        """Mark the snapshot stale, e.g. after a pm2 command"""
+        self.fetched_at = 0
+        
+    def snapshot(self) -> Optional[List[Dict]]:
+        """Cached process list (None until the first fetch); a stale one triggers a background refresh"""
+        if self.processes is None or time.time() - self.fetched_at >= self.ttl:
+            self.refresh_in_background()
+        return self.processes
+        
+    def process_status(self, name: str, fresh: bool = False) -> Dict:
+        """Status of a single PM2 app in the shape /status has always returned
+        
+        fresh=True fetches the current list on the calling thread; only use it off the request path.
+        """
+        for proc in (self.refresh() if fresh else self.snapshot()) or []:
+            if proc.get('name') == name:
+                pm2_env = proc.get('pm2_env', {})
+                return {
+                    'status': pm2_env.get('status'),
+                    'pid': proc.get('pid'),
+                    'uptime': pm2_env.get('pm_uptime'),
+                    'restarts': pm2_env.get('restart_time')
+                }
+        return {'status': 'unknown'}
+        
+    def follow_bus(self):
+        """Refresh the snapshot whenever the daemon reports a process event"""
+        backoff = 1
+        while True:
+            if not os.path.exists(self.bus_path):
+                time.sleep(30)
+                continue
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as bus:
+                    bus.connect(self.bus_path)
+                    self.bus_connected = True
+                    backoff = 1
+                    decoder = AmpDecoder()
+                    while True:
+                        data = bus.recv(65536)
+                        if not data:
+                            break
+                        for message in decoder.feed(data):
+                            if message and message[0] == 'process:event':
+                                self.bus_events += 1
+                                self.refresh()
+            except (OSError, ValueError) as e:
+                self.logger.debug(f"PM2 bus connection lost: {e}")
+            self.bus_connected = False
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            
+    def stats(self) -> Dict:
+        """Summarize client state for /status"""
+        return {
+            'source': self.source,
+            'snapshot_age': round(time.time() - self.fetched_at, 3) if self.fetched_at else None,
+            'rpc_calls': self.rpc_calls,
+            'fallback_calls': self.fallback_calls,
+            'bus_connected': self.bus_connected,
+            'bus_events': self.bus_events
+        }
+
+
+class StateStore:
+    """Small JSON state file shared by all worker processes
+    
+    Writers go through transaction(), which holds an exclusive flock for the
+    read-modify-write and replaces the file atomically; readers can use
+    read() without locking.
+    """
+    
+    def __init__(self, state_dir: str):
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, 'state.json')
+        self.lock_path = os.path.join(state_dir, 'state.lock')
+        
+    def read(self) -> Dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+            
+    @contextmanager
+    def transaction(self):
+        """Yield the current state for modification and write it back on success"""
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self.read()
+                yield state
+                tmp_path = f"{self.path}.tmp-{os.getpid()}-{threading.get_ident()}"
+                with open(tmp_path, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ProcessLock:
+    """Exclusive lock across processes based on flock, released when the holder exits"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        
+    def acquire(self, blocking: bool = True) -> bool:
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self.file = lock_file
+        return True
+        
+    def release(self):
+        if self.file:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+            
+    @property
+    def held(self) -> bool:
+        return self.file is not None
+
+
+class StatusBoard:
+    """Counters and values reported by /status"""
+    
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+        
+    def increment(self, name: str, amount: int = 1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + amount
+            
+    def set(self, name: str, value):
+        with self.lock:
+            self.values[name] = value
+            
+    def get(self, name: str, default=None):
+        return self.values.get(name, default)
+
+
+class SharedStatusBoard(StatusBoard):
+    """StatusBoard kept in the shared state file so every worker reports the same values"""
+    
+    KEY = 'status'
+    
+    def __init__(self, store: StateStore):
+        super().__init__()
+        self.store = store
+        
+    @classmethod
+    def bump(cls, state: Dict, name: str, amount: int = 1):
+        """Increment a counter inside an already open transaction"""
+        values = state.setdefault(cls.KEY, {})
+        values[name] = values.get(name, 0) + amount
+        
+    def increment(self, name: str, amount: int = 1):
+        with self.store.transaction() as state:
+            self.bump(state, name, amount)
+            
+    def set(self, name: str, value):
+        with self.store.transaction() as state:
+            state.setdefault(self.KEY, {})[name] = value
+            
+    def get(self, name: str, default=None):
+        return self.store.read().get(self.KEY, {}).get(name, default)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+    
+    type = 'counter'
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+        
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+            
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {json.dumps(labels): value for labels, value in self.values.items()}
+            
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+        
+    def samples(self, labels: Tuple, value) -> List[Tuple[str, Tuple, float]]:
+        return [(self.name, labels, value)]
+
+
+class Histogram(Counter):
+    """Histogram with fixed buckets; observe() is a bisect and a few additions under a lock"""
+    
+    type = 'histogram'
+    
+    def __init__(self, name: str, documentation: str, labelnames: Tuple = (), buckets: Tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                # Per-bucket counts (last one is +Inf), then sum and count
+                entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+            
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {json.dumps(labels): list(entry) for labels, entry in self.values.items()}
+            
+    @staticmethod
+    def merge(total, value):
+        return [a + b for a, b in zip(total, value)] if total else list(value)
+        
+    def samples(self, labels: Tuple, value) -> List[Tuple[str, Tuple, float]]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value):
+            cumulative += count
+            samples.append((f"{self.name}_bucket", labels + (('le', '+Inf' if bound == float('inf') else repr(bound)),), cumulative))
+        samples.append((f"{self.name}_sum", labels, value[-2]))
+        samples.append((f"{self.name}_count", labels, value[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    """Metrics rendered in the Prometheus text format
+    
+    Counters and histograms are kept in memory. With a shared directory,
+    each worker process also writes its values to <dir>/<pid>.json every
+    flush_interval seconds and render() adds up all workers, so the answer
+    does not depend on which worker serves /metrics. Gauges are callbacks
+    evaluated at scrape time.
+    """
+    
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    
+    def __init__(self, shared_dir: str = None, flush_interval: float = 5):
+        self.metrics = OrderedDict()
+        self.gauges = OrderedDict()
+        self.shared_dir = shared_dir
+        self.flush_interval = flush_interval
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            self.path = os.path.join(shared_dir, f"{os.getpid()}.json")
+            threading.Thread(target=self.flush_loop, name='metrics-flush', daemon=True).start()
+            
+    def counter(self, name: str, documentation: str, labelnames: Tuple = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, documentation, labelnames))
+        
+    def histogram(self, name: str, documentation: str, labelnames: Tuple = (), buckets: Tuple = ()) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+        
+    def gauge(self, name: str, documentation: str, func, labelnames: Tuple = ()):
+        """Register a gauge; func returns a number or a {labels tuple: value} dict"""
+        self.gauges[name] = (documentation, func, labelnames)
+        
+    def snapshot(self) -> Dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+        
+    def flush(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, self.path)
+        
+    def flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+                
+    def collect(self) -> Dict[str, Dict]:
+        """Values of this process merged with the last flush of all other workers"""
+        snapshots = [self.snapshot()]
+        if self.shared_dir:
+            for entry in os.scandir(self.shared_dir):
+                if entry.name.endswith('.json') and entry.path != self.path:
+                    try:
+                        with open(entry.path) as f:
+                            snapshots.append(json.load(f))
+                    except (OSError, ValueError):
+                        pass
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                if name in self.metrics:
+                    for key, value in values.items():
+                        merged[name][key] = self.metrics[name].merge(merged[name].get(key), value)
+        return merged
+        
+    @staticmethod
+    def format_sample(name: str, labels: Tuple, value) -> str:
+        if labels:
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+            name += '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+        return f"{name} {value}"
+        
+    def render(self) -> str:
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for key in sorted(values):
+                labels = tuple(zip(metric.labelnames, json.loads(key)))
+                lines.extend(self.format_sample(*sample) for sample in metric.samples(labels, values[key]))
+        for name, (documentation, func, labelnames) in self.gauges.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            value = func()
+            for labels, sample in (value.items() if isinstance(value, dict) else [((), value)]):
+                lines.append(self.format_sample(name, tuple(zip(labelnames, labels)), sample))
+        return '\n'.join(lines) + '\n'
+
+
+def read_git_head(path: str) -> Optional[str]:
+    """Resolve HEAD of a checkout or worktree to a commit SHA without spawning git"""
+    git_dir = os.path.join(path, '.git')
+    try:
+        if os.path.isfile(git_dir):
+            with open(git_dir) as f:
+                content = f.read().strip()
+            if not content.startswith('gitdir:'):
+                return None
+            git_dir = os.path.join(path, content[len('gitdir:'):].strip())
+            
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+        if not head.startswith('ref:'):
+            return head
+        ref = head[len('ref:'):].strip()
+        
+        # Worktrees keep branch refs in the common git directory
+        common_dir = git_dir
+        if os.path.isfile(os.path.join(git_dir, 'commondir')):
+            with open(os.path.join(git_dir, 'commondir')) as f:
+                common_dir = os.path.join(git_dir, f.read().strip())
+                
+        for base in (git_dir, common_dir):
+            loose = os.path.join(base, ref)
+            if os.path.isfile(loose):
+                with open(loose) as f:
+                    return f.read().strip()
+        with open(os.path.join(common_dir, 'packed-refs')) as f:
+            for line in f:
+                parts = line.strip().split(' ')
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except OSError:
+        pass
+    return None
+
+
+def sync_tree(source: str, destination: str, exclude: Tuple[str, ...] = ()) -> Dict[str, int]:
+    """Mirror a directory tree like `rsync -a --delete`, skipping unchanged files
+    
+    Files are compared by size and mtime and replaced atomically; symlinks
+    are copied as links. Paths matching an exclude pattern (by relative path
+    or top-level name) are neither copied nor deleted.
+    """
+    stats = {'copied': 0, 'deleted': 0, 'unchanged': 0}
+    
+    def excluded(rel: str) -> bool:
+        return any(fnmatch.fnmatch(rel, pattern) or fnmatch.fnmatch(rel.split(os.sep)[0], pattern) for pattern in exclude)
+        
+    def remove(path: str):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+            
+    os.makedirs(destination, exist_ok=True)
+    seen = set()
+    for root, dirs, files in os.walk(source):
+        rel_root = os.path.relpath(root, source)
+        descend = []
+        for name in dirs + files:
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            if excluded(rel):
+                continue
+            seen.add(rel)
+            src = os.path.join(root, name)
+            dst = os.path.join(destination, rel)
+            if os.path.islink(src):
+                link = os.readlink(src)
+                if os.path.islink(dst) and os.readlink(dst) == link:
+                    stats['unchanged'] += 1
+                    continue
+                if os.path.lexists(dst):
+                    remove(dst)
+                os.symlink(link, dst)
+                stats['copied'] += 1
+            elif os.path.isdir(src):
+                if os.path.lexists(dst) and (os.path.islink(dst) or not os.path.isdir(dst)):
+                    remove(dst)
+                os.makedirs(dst, exist_ok=True)
+                descend.append(name)
+            else:
+                src_stat = os.stat(src)
+                try:
+                    dst_stat = os.lstat(dst)
+                    if (dst_stat.st_size == src_stat.st_size
+                            and int(dst_stat.st_mtime) == int(src_stat.st_mtime)
+                            and not os.path.islink(dst)):
+                        stats['unchanged'] += 1
+                        continue
+                    if os.path.isdir(dst):
+                        remove(dst)
+                except FileNotFoundError:
+                    pass
+                tmp_path = f"{dst}.sync-tmp"
+                shutil.copy2(src, tmp_path)
+                os.replace(tmp_path, dst)
+                stats['copied'] += 1
+        dirs[:] = descend
+        
+    for root, dirs, files in os.walk(destination):
+        rel_root = os.path.relpath(root, destination)
+        for name in list(dirs) + files:
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            if rel in seen or excluded(rel):
+                continue
+            remove(os.path.join(root, name))
+            stats['deleted'] += 1
+            if name in dirs:
+                dirs.remove(name)
+    return stats
+
+
+class DeploymentJob:
+    """A single deployment request and its progress"""
+    
+    def __init__(self, ref: str, sha: Optional[str], commits: List[Dict], output_limit: int = 500,
+                 delivery_id: str = None, before: str = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.delivery_id = delivery_id
+        self.ref = ref
+        self.sha = sha
+        # Commit the push was based on; the payload's file list is relative to it
+        self.before = before
+        self.commits = commits
+        self.commit_count = len(commits)
+        self.status = 'queued'
+        self.error = None
+        self.steps = []
+        self.queued_at = time.time()
+        self.first_queued_at = self.queued_at
+        self.started_at = None
+        self.finished_at = None
+        self.superseded = []
+        self.coalesced_into = None
+        self.plan = None
+        self.plan_reason = None
+        self.rollback = None
+        self.pipeline = None
+        self.targets = None
+        self.health = None
+        self.output = deque(maxlen=output_limit)
+        self.output_seq = itertools.count(1)
+        self.cancel_event = threading.Event()
+        self.cancel_lock = threading.Lock()
+        # Cleared once the job has taken production down and has to run to the end
+        self.cancellable = True
+        
+    # Broadcast to /stream subscribers whenever any job records an event
+    changed = threading.Condition()
+    
+    # Ring buffer entries that are not command output
+    EVENT_STREAMS = ('step',)
+    
+    def notify(self):
+        with self.changed:
+            self.changed.notify_all()
+            
+    def append_output(self, stream: str, line: str, **extra):
+        """Add a line of command output (or a step event) to the job's ring buffer"""
+        self.output.append(dict(extra, seq=next(self.output_seq), time=time.time(), stream=stream, line=line))
+        self.notify()
+        
+    def request_cancel(self) -> bool:
+        """Signal the worker to stop the job; False once it can no longer be cancelled"""
+        with self.cancel_lock:
+            if self.cancellable:
+                self.cancel_event.set()
+            return self.cancellable
+            
+    def disable_cancel(self) -> bool:
+        """Pass the point of no return; False if a cancellation came first"""
+        with self.cancel_lock:
+            if self.cancel_event.is_set():
+                return False
+            self.cancellable = False
+            return True
+            
+    def command_output(self) -> List[Dict]:
+        """Buffered command output without step events"""
+        return [entry for entry in self.output if entry['stream'] not in self.EVENT_STREAMS]
+        
+    def changed_files(self) -> List[str]:
+        """All paths added, modified or removed across the job's commits"""
+        files = []
+        for commit in self.commits:
+            for key in ('added', 'modified', 'removed'):
+                files.extend(commit.get(key, []))
+        return list(dict.fromkeys(files))
+        
+    def absorb(self, older: 'DeploymentJob'):
+        """Take over a pending job for the same ref that this job supersedes"""
+        self.commits = older.commits + self.commits
+        self.commit_count += older.commit_count
+        self.before = older.before
+        self.superseded.extend(older.superseded + [older.id])
+        self.first_queued_at = min(self.first_queued_at, older.first_queued_at)
+        older.status = 'coalesced'
+        older.coalesced_into = self.id
+        older.finished_at = time.time()
+        
+    def start_step(self, name: str) -> Dict:
+        """Record the start of a deployment step"""
+        step = {'name': name, 'status': 'running', 'started_at': time.time(), 'duration': None}
+        self.steps.append(step)
+        self.append_output('step', f"{name} running", step=name, status='running')
+        return step
+        
+    def finish_step(self, step: Dict, status: str):
+        """Record the outcome of a deployment step"""
+        step['status'] = status
+        step['duration'] = round(time.time() - step['started_at'], 3)
+        self.append_output('step', f"{step['name']} {status}", step=step['name'], status=status, duration=step['duration'])
+        
+    RECORD_FIELDS = (
+        'id', 'delivery_id', 'ref', 'sha', 'before', 'commit_count', 'status', 'error', 'steps',
+        'queued_at', 'first_queued_at', 'started_at', 'finished_at',
+        'superseded', 'coalesced_into', 'plan', 'plan_reason', 'health', 'rollback', 'pipeline', 'targets',
+        'cancellable'
+    )
+    
+    def to_record(self, include_commits: bool = False) -> Dict:
+        """Raw job state for the shared state file"""
+        record = {field: getattr(self, field) for field in self.RECORD_FIELDS}
+        if include_commits:
+            record['commits'] = self.commits
+        return record
+        
+    @classmethod
+    def from_record(cls, record: Dict, output_limit: int = 500) -> 'DeploymentJob':
+        """Rebuild a job from a record written by to_record()"""
+        job = cls(record['ref'], record['sha'], record.get('commits', []), output_limit)
+        for field in cls.RECORD_FIELDS:
+            if field in record:
+                setattr(job, field, record[field])
+        return job
+        
+    def to_dict(self) -> Dict:
+        """Serialize job state for the API"""
+        def iso(ts):
+            return datetime.fromtimestamp(ts).isoformat() if ts else None
+            
+        duration = None
+        if self.started_at:
+            duration = round((self.finished_at or time.time()) - self.started_at, 3)
+            
+        return {
+            'id': self.id,
+            'delivery_id': self.delivery_id,
+            'ref': self.ref,
+            'sha': self.sha,
+            'before': self.before,
+            'commits': self.commit_count,
+            'status': self.status,
+            'cancellable': self.cancellable,
+            'error': self.error,
+            'plan': self.plan,
+            'plan_reason': self.plan_reason,
+            'health': self.health,
+            'rollback': self.rollback,
+            'pipeline': self.pipeline,
+            'targets': self.targets,
+            'queued_at': iso(self.queued_at),
+            'started_at': iso(self.started_at),
+            'finished_at': iso(self.finished_at),
+            'duration': duration,
+            'superseded': self.superseded,
+            'coalesced_into': self.coalesced_into,
+            'steps': [
+                {
+                    'name': step['name'],
+                    'status': step['status'],
+                    'started_at': iso(step['started_at']),
+                    'duration': step['duration']
+                }
+                for step in self.steps
+            ]
+        }
+
+
+class DeploymentQueue:
+    """Bounded FIFO of pending deployment jobs with a lookup of recent jobs
+    
+    Pending jobs for the same ref are coalesced into the newest one, and a job
+    only becomes available once no newer push has arrived for `debounce` seconds
+    (or `max_delay` seconds have passed since the first push it absorbed).
+    """
+    
+    def __init__(self, max_size: int, history_size: int, debounce: float = 0, max_delay: float = 60,
+                 status: StatusBoard = None):
+        self.max_size = max_size
+        self.history_size = history_size
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.status = status or StatusBoard()
+        self.pending = deque()
+        self.jobs = OrderedDict()
+        self.current = None
+        self.condition = threading.Condition()
+        
+    def put(self, job: DeploymentJob):
+        """Enqueue a job, raising QueueFullError when the queue is at capacity"""
+        with self.condition:
+            superseded = [pending for pending in self.pending if pending.ref == job.ref]
+            if not superseded and len(self.pending) >= self.max_size:
+                raise QueueFullError(f"Deployment queue is full ({self.max_size} jobs pending)")
+            for older in superseded:
+                self.pending.remove(older)
+                job.absorb(older)
+                self.status.increment('coalesced_deploys')
+            self.pending.append(job)
+            self.remember(job)
+            self.condition.notify()
+            
+    def ready_at(self, job: DeploymentJob) -> float:
+        """Time at which a pending job has waited out the debounce window"""
+        if job.plan == 'rollback':
+            # Rollbacks are requested by hand and should not wait for more pushes
+            return job.queued_at
+        return min(job.queued_at + self.debounce, job.first_queued_at + self.max_delay)
+            
+    def get(self) -> DeploymentJob:
+        """Block until a job is available and mark it as current"""
+        with self.condition:
+            while True:
+                if not self.pending:
+                    self.condition.wait()
+                    continue
+                remaining = self.ready_at(self.pending[0]) - time.time()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                self.current = self.pending.popleft()
+                return self.current
+            
+    def cancel(self, job: DeploymentJob) -> bool:
+        """Drop a job that has not started yet; returns False if it is not pending"""
+        with self.condition:
+            if job not in self.pending:
+                return False
+            self.pending.remove(job)
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            return True
+            
+    def request_cancel(self, job: DeploymentJob):
+        """Ask the worker running a job to stop it"""
+        job.request_cancel()
+        
+    def update(self, job: DeploymentJob):
+        """Publish progress of the running job (jobs are shared by reference here)"""
+        
+    def done(self, job: DeploymentJob):
+        """Clear the current job once the worker has finished it"""
+        with self.condition:
+            if self.current is job:
+                self.current = None
+                
+    def remember(self, job: DeploymentJob):
+        """Keep a bounded history of jobs for status lookups"""
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.history_size:
+            self.jobs.popitem(last=False)
+            
+    def find(self, job_id: str) -> Optional[DeploymentJob]:
+        """Look up a queued, running or recently finished job"""
+        with self.condition:
+            return self.jobs.get(job_id)
+            
+    def stats(self) -> Dict:
+        """Summarize queue state for /status"""
+        with self.condition:
+            return {
+                'depth': len(self.pending),
+                'max_size': self.max_size,
+                'current_job': self.current.id if self.current else None,
+                'debounce_seconds': self.debounce,
+                'coalesced_deploys': self.status.get('coalesced_deploys', 0)
+            }
+
+
+class SharedDeploymentQueue(DeploymentQueue):
+    """DeploymentQueue kept in a StateStore so several worker processes can share it
+    
+    Any process can enqueue, cancel and look up jobs. Only the process holding
+    the deploy lock claims and runs jobs; the other workers' deployment
+    threads block on that lock and take over if the holder exits.
+    """
+    
+    POLL_INTERVAL = 0.25
+    
+    def __init__(self, max_size: int, history_size: int, store: StateStore, deploy_lock: ProcessLock,
+                 debounce: float = 0, max_delay: float = 60, status: StatusBoard = None,
+                 output_limit: int = 500):
+        super().__init__(max_size, history_size, debounce, max_delay, status)
+        self.store = store
+        self.deploy_lock = deploy_lock
+        self.output_limit = output_limit
+        self.output_dir = os.path.join(store.state_dir, 'output')
+        os.makedirs(self.output_dir, exist_ok=True)
+        threading.Thread(target=self.watch_current, name='deployment-watch', daemon=True).start()
+        
+    @staticmethod
+    def queue_state(state: Dict) -> Dict:
+        return state.setdefault('queue', {'pending': [], 'jobs': {}, 'current': None})
+        
+    def store_record(self, queue_state: Dict, record: Dict):
+        """Insert or replace a job record, keeping the history bounded"""
+        jobs = queue_state['jobs']
+        if record['id'] in jobs:
+            record['cancel_requested'] = jobs.pop(record['id']).get('cancel_requested', False)
+        jobs[record['id']] = record
+        for job_id in list(jobs)[:max(len(jobs) - self.history_size, 0)]:
+            del jobs[job_id]
+            
+    def put(self, job: DeploymentJob):
+        """Enqueue a job, raising QueueFullError when the queue is at capacity"""
+        with self.condition, self.store.transaction() as state:
+            queue_state = self.queue_state(state)
+            pending = queue_state['pending']
+            superseded = [record for record in pending if record['ref'] == job.ref]
+            if not superseded and len(pending) >= self.max_size:
+                raise QueueFullError(f"Deployment queue is full ({self.max_size} jobs pending)")
+            for record in superseded:
+                pending.remove(record)
+                older = DeploymentJob.from_record(record)
+                job.absorb(older)
+                self.store_record(queue_state, older.to_record())
+                SharedStatusBoard.bump(state, 'coalesced_deploys')
+            pending.append(job.to_record(include_commits=True))
+            self.store_record(queue_state, job.to_record())
+            
+    def get(self) -> DeploymentJob:
+        """Become the deploying process, then claim the next ready job"""
+        if not self.deploy_lock.held:
+            self.deploy_lock.acquire()
+            self.recover_interrupted()
+        while True:
+            pending = self.queue_state(self.store.read())['pending']
+            if pending and self.ready_at(DeploymentJob.from_record(pending[0])) <= time.time():
+                with self.condition, self.store.transaction() as state:
+                    queue_state = self.queue_state(state)
+                    if queue_state['pending']:
+                        record = queue_state['pending'][0]
+                        job = DeploymentJob.from_record(record, self.output_limit)
+                        if self.ready_at(job) <= time.time():
+                            queue_state['pending'].pop(0)
+                            queue_state['current'] = job.id
+                            self.current = job
+                            return job
+            time.sleep(self.POLL_INTERVAL)
+            
+    def recover_interrupted(self):
+        """Fail the job a previous lock holder was running when it died"""
+        with self.store.transaction() as state:
+            queue_state = self.queue_state(state)
+            record = queue_state['jobs'].get(queue_state['current'])
+            queue_state['current'] = None
+            if record and record['status'] == 'running':
+                record['status'] = 'failed'
+                record['error'] = 'Interrupted: the deploying worker exited'
+                record['finished_at'] = time.time()
+                SharedStatusBoard.bump(state, 'interrupted_deploys')
+                state.setdefault(SharedStatusBoard.KEY, {})['last_job_failed'] = True
+                
+    def cancel(self, job: DeploymentJob) -> bool:
+        """Drop a job that has not started yet; returns False if it is not pending"""
+        with self.condition, self.store.transaction() as state:
+            queue_state = self.queue_state(state)
+            for record in queue_state['pending']:
+                if record['id'] == job.id:
+                    queue_state['pending'].remove(record)
+                    job.status = 'cancelled'
+                    job.finished_at = time.time()
+                    self.store_record(queue_state, job.to_record())
+                    return True
+            return False
+            
+    def request_cancel(self, job: DeploymentJob):
+        """Flag a running job for cancellation; the deploying process picks it up"""
+        with self.store.transaction() as state:
+            record = self.queue_state(state)['jobs'].get(job.id)
+            if record:
+                record['cancel_requested'] = True
+        if self.current and self.current.id == job.id:
+            self.current.request_cancel()
+            
+    def update(self, job: DeploymentJob):
+        """Publish the running job's progress and output to the other workers"""
+        with self.store.transaction() as state:
+            queue_state = self.queue_state(state)
+            self.store_record(queue_state, job.to_record())
+            if queue_state['jobs'][job.id].get('cancel_requested'):
+                job.request_cancel()
+        self.write_output(job)
+        
+    def write_output(self, job: DeploymentJob):
+        # Pipeline steps, watch_current and done() write concurrently; each needs its own temp file
+        path = os.path.join(self.output_dir, f"{job.id}.json")
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(list(job.output), f)
+        os.replace(tmp_path, path)
+        
+    def watch_current(self):
+        """Keep output and cancellation of a long-running step in sync"""
+        while True:
+            time.sleep(1)
+            job = self.current
+            if job is not None:
+                try:
+                    self.update(job)
+                except OSError:
+                    pass
+                    
+    def done(self, job: DeploymentJob):
+        """Record the finished job and clear the current slot"""
+        with self.condition:
+            self.current = None
+            with self.store.transaction() as state:
+                queue_state = self.queue_state(state)
+                self.store_record(queue_state, job.to_record())
+                if queue_state['current'] == job.id:
+                    queue_state['current'] = None
+            self.write_output(job)
+            # Drop output files of jobs that fell out of the history
+            known = set(queue_state['jobs'])
+            for entry in os.scandir(self.output_dir):
+                if entry.name.endswith('.json') and entry.name[:-5] not in known:
+                    os.unlink(entry.path)
+                    
+    def find(self, job_id: str) -> Optional[DeploymentJob]:
+        """Look up a job; the deploying process answers from memory for the running job"""
+        current = self.current
+        if current is not None and current.id == job_id:
+            return current
+        record = self.queue_state(self.store.read())['jobs'].get(job_id)
+        if record is None:
+            return None
+        job = DeploymentJob.from_record(record, self.output_limit)
+        try:
+            with open(os.path.join(self.output_dir, f"{job_id}.json")) as f:
+                job.output.extend(json.load(f))
+        except (OSError, ValueError):
+            pass
+        return job
+        
+    def stats(self) -> Dict:
+        """Summarize queue state for /status"""
+        state = self.store.read()
+        queue_state = state.get('queue', {'pending': [], 'current': None})
+        return {
+            'depth': len(queue_state['pending']),
+            'max_size': self.max_size,
+            'current_job': queue_state['current'],
+            'debounce_seconds': self.debounce,
+            'coalesced_deploys': state.get(SharedStatusBoard.KEY, {}).get('coalesced_deploys', 0)
+        }
+
+
+class DeployPlanner:
+    """Pick the cheapest deployment plan that covers a set of changed paths
+    
+    Plans from cheapest to most expensive:
+      noop   - documentation only, nothing to deploy
+      static - public/ assets only, pull without restart
+      reload - server code changed, pull and reload the process
+      full   - package manifests changed, pull, install and restart
+    """
+    
+    PLANS = ('noop', 'static', 'reload', 'full')
+    
+    # GitHub truncates the commits list of a push payload at 20 entries
+    MAX_PAYLOAD_COMMITS = 20
+    
+    MANIFEST_PATTERNS = ('package.json', 'package-lock.json', 'npm-shrinkwrap.json')
+    STATIC_PATTERNS = ('public/*',)
+    DOC_PATTERNS = ('*.md', 'docs/*', 'LICENSE', '.gitignore', '.gitattributes')
+    
+    def classify(self, path: str) -> str:
+        """Plan required by a single changed path"""
+        if any(fnmatch.fnmatch(path, pattern) for pattern in self.MANIFEST_PATTERNS):
+            return 'full'
+        if any(fnmatch.fnmatch(path, pattern) for pattern in self.STATIC_PATTERNS):
+            return 'static'
+        if any(fnmatch.fnmatch(path, pattern) for pattern in self.DOC_PATTERNS):
+            return 'noop'
+        return 'reload'
+        
+    def plan(self, commits: List[Dict], files: List[str]) -> Tuple[str, str]:
+        """Return (plan, reason) for a push"""
+        if not commits:
+            return 'full', 'no commit information in payload'
+        if len(commits) >= self.MAX_PAYLOAD_COMMITS:
+            return 'full', f'{len(commits)} commits, payload file list may be truncated'
+        if not files:
+            return 'full', 'no file information in payload'
+            
+        by_plan = {}
+        for path in files:
+            by_plan.setdefault(self.classify(path), []).append(path)
+        plan = max(by_plan, key=self.PLANS.index)
+        
+        sample = ', '.join(by_plan[plan][:3])
+        if len(by_plan[plan]) > 3:
+            sample += f" (+{len(by_plan[plan]) - 3} more)"
+        reasons = {
+            'noop': f'documentation only: {sample}',
+            'static': f'static assets only: {sample}',
+            'reload': f'server files changed: {sample}',
+            'full': f'package manifests changed: {sample}'
+        }
+        return plan, reasons[plan]
+
+
+class PipelineStep:
+    """A deployment step and the steps it has to wait for
+    
+    on_failure is 'abort' (stop the pipeline), 'continue' (log and carry on
+    as if the step succeeded) or a callable that is run once all running
+    steps have finished, before the pipeline reports failure.
+    """
+    
+    def __init__(self, name: str, func, after: Tuple[str, ...] = (), on_failure='abort',
+                 timeout: float = None, description: str = None):
+        self.name = name
+        self.func = func
+        self.after = tuple(after)
+        self.on_failure = on_failure
+        self.timeout = timeout
+        self.description = description or name
+
+
+class Pipeline:
+    """Run PipelineSteps as a dependency graph, independent steps in parallel"""
+    
+    def __init__(self, steps: List[PipelineStep], executor: ThreadPoolExecutor):
+        self.steps = OrderedDict((step.name, step) for step in steps)
+        self.executor = executor
+        for step in steps:
+            missing = [name for name in step.after if name not in self.steps]
+            if missing:
+                raise ValueError(f"Step {step.name} depends on unknown steps {missing}")
+        self.order = self.topological_order()
+        
+    def topological_order(self) -> List[str]:
+        order = []
+        remaining = dict(self.steps)
+        while remaining:
+            ready = [name for name, step in remaining.items() if set(order).issuperset(step.after)]
+            if not ready:
+                raise ValueError(f"Steps {sorted(remaining)} form a dependency cycle")
+            for name in ready:
+                order.append(name)
+                del remaining[name]
+        return order
+                
+    def run(self, execute) -> Dict:
+        """Run all steps with execute(step) -> bool and report outcome and critical path
+        
+        Exceptions raised by a step (e.g. DeploymentCancelled) are re-raised
+        once the steps already running have finished.
+        """
+        started = time.time()
+        timings = {}
+        finished = set()
+        failed = None
+        error = None
+        running = {}
+        pending = list(self.steps.values())
+        
+        def timed(step):
+            step_started = time.time()
+            try:
+                return execute(step)
+            finally:
+                timings[step.name] = (step_started, time.time())
+                
+        while True:
+            if failed is None and error is None:
+                for step in [step for step in pending if finished.issuperset(step.after)]:
+                    pending.remove(step)
+                    running[self.executor.submit(timed, step)] = step
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if ok or step.on_failure == 'continue':
+                    finished.add(step.name)
+                elif failed is None:
+                    failed = step
+                    
+        if error is not None:
+            raise error
+        if failed is not None and callable(failed.on_failure):
+            failed.on_failure()
+            
+        critical_path, critical_time = self.critical_path(timings)
+        return {
+            'success': failed is None,
+            'failed_step': failed.name if failed else None,
+            'skipped': [step.name for step in pending],
+            'critical_path': critical_path,
+            'critical_path_seconds': round(critical_time, 3),
+            'wall_seconds': round(time.time() - started, 3)
+        }
+        
+    def critical_path(self, timings: Dict[str, Tuple[float, float]]) -> Tuple[List[str], float]:
+        """Longest chain of dependent steps by measured duration"""
+        longest = {}
+        for name in self.order:
+            step = self.steps[name]
+            if name not in timings:
+                continue
+            duration = timings[name][1] - timings[name][0]
+            predecessors = [longest[dep] for dep in step.after if dep in longest]
+            path, total = max(predecessors, key=lambda item: item[1], default=([], 0.0))
+            longest[name] = (path + [name], total + duration)
+        return max(longest.values(), key=lambda item: item[1], default=([], 0.0))
+
+
+class HealthChecker:
+    """Readiness polling of several health endpoints over a pooled HTTP session
+    
+    All endpoints are probed concurrently; endpoints that failed are re-probed
+    with exponential backoff until every one has answered 200 or the deadline
+    has passed.
+    """
+    
+    def __init__(self, deadline: float, initial_delay: float, max_delay: float, probe_timeout: float):
+        self.deadline = deadline
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.probe_timeout = probe_timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='health-probe')
+        
+    def probe(self, url: str) -> Dict:
+        """Probe a single endpoint once"""
+        started = time.time()
+        try:
+            response = self.session.get(url, timeout=self.probe_timeout)
+            return {
+                'healthy': response.status_code == 200,
+                'status_code': response.status_code,
+                'latency': round(time.time() - started, 4),
+                'error': None
+            }
+        except requests.RequestException as e:
+            return {
+                'healthy': False,
+                'status_code': None,
+                'latency': round(time.time() - started, 4),
+                'error': str(e)
+            }
+            
+    def wait_until_healthy(self, endpoints: Dict[str, str], cancel_event: threading.Event = None) -> Dict:
+        """Poll all endpoints until they are healthy, the deadline passes or cancel_event is set"""
+        started = time.time()
+        deadline = started + self.deadline
+        delay = self.initial_delay
+        probes = {name: {'url': url, 'attempts': 0, 'latencies': [], 'healthy': False}
+                  for name, url in endpoints.items()}
+        
+        while True:
+            pending = [name for name, probe in probes.items() if not probe['healthy']]
+            futures = {name: self.executor.submit(self.probe, probes[name]['url']) for name in pending}
+            for name, future in futures.items():
+                result = future.result()
+                probe = probes[name]
+                probe['attempts'] += 1
+                probe['latencies'].append(result['latency'])
+                probe.update(
+                    healthy=result['healthy'],
+                    status_code=result['status_code'],
+                    error=result['error']
+                )
+                if result['healthy']:
+                    probe['healthy_after'] = round(time.time() - started, 3)
+                    
+            if all(probe['healthy'] for probe in probes.values()):
+                return {
+                    'healthy': True,
+                    'time_to_healthy': round(time.time() - started, 3),
+                    'probes': probes
+                }
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            if cancelled or time.time() + delay > deadline:
+                return {
+                    'healthy': False,
+                    'time_to_healthy': None,
+                    'waited': round(time.time() - started, 3),
+                    'cancelled': cancelled,
+                    'probes': probes
+                }
+            if cancel_event is not None:
+                cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+
+
+class DeliveryCache:
+    """Bounded LRU of seen X-GitHub-Delivery ids with TTL expiry
+    
+    Maps each delivery id to the deployment job it created, so GitHub
+    redeliveries can be answered without deploying again. When `path` is
+    set the cache is written to disk after each change and reloaded on
+    startup.
+    """
+    
+    PENDING = object()
+    
+    def __init__(self, max_entries: int, ttl: float, path: str = None, status: StatusBoard = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.status = status or StatusBoard()
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.load()
+        
+    def load(self):
+        """Restore persisted entries, dropping any that have expired"""
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        cutoff = time.time() - self.ttl
+        for delivery_id, entry in entries:
+            if entry['seen_at'] >= cutoff:
+                self.entries[delivery_id] = entry
+        self.evict()
+        
+    def save(self):
+        """Atomically write completed entries to disk"""
+        if not self.path:
+            return
+        entries = [(key, entry) for key, entry in self.entries.items() if entry is not self.PENDING]
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+        
+    def evict(self):
+        cutoff = time.time() - self.ttl
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if len(self.entries) > self.max_entries or (entry is not self.PENDING and entry['seen_at'] < cutoff):
+                self.entries.popitem(last=False)
+            else:
+                break
+                
+    def claim(self, delivery_id: str) -> Optional[Dict]:
+        """Reserve a delivery id; returns the earlier entry if it was already seen"""
+        with self.lock:
+            self.evict()
+            entry = self.entries.get(delivery_id)
+            if entry is not None and (entry is self.PENDING or entry['seen_at'] >= time.time() - self.ttl):
+                self.status.increment('duplicate_deliveries')
+                self.entries.move_to_end(delivery_id)
+                return {'job_id': None, 'seen_at': None} if entry is self.PENDING else entry
+            self.entries[delivery_id] = self.PENDING
+            return None
+            
+    def complete(self, delivery_id: str, job_id: Optional[str]):
+        """Record the outcome of a claimed delivery"""
+        with self.lock:
+            self.entries[delivery_id] = {'job_id': job_id, 'seen_at': time.time()}
+            self.evict()
+            try:
+                self.save()
+            except OSError:
+                pass
+                
+    def release(self, delivery_id: str):
+        """Forget a claim whose delivery was not processed, so a redelivery can retry"""
+        with self.lock:
+            if self.entries.get(delivery_id) is self.PENDING:
+                del self.entries[delivery_id]
+                
+    def stats(self) -> Dict:
+        """Summarize cache usage for /status"""
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'duplicate_hits': self.status.get('duplicate_deliveries', 0),
+            'persistent': bool(self.path)
+        }
+
+
+class SharedDeliveryCache(DeliveryCache):
+    """DeliveryCache whose entries live in a StateStore shared by all worker processes"""
+    
+    def __init__(self, max_entries: int, ttl: float, store: StateStore, status: StatusBoard = None):
+        self.store = store
+        super().__init__(max_entries, ttl, status=status)
+        
+    @contextmanager
+    def shared_entries(self):
+        """Load the shared entries, let the caller modify them and write them back"""
+        with self.lock, self.store.transaction() as state:
+            self.entries = OrderedDict(
+                (key, self.PENDING if entry == 'pending' else entry)
+                for key, entry in state.get('deliveries', [])
+            )
+            yield state
+            state['deliveries'] = [
+                (key, 'pending' if entry is self.PENDING else entry)
+                for key, entry in self.entries.items()
+            ]
+            
+    def claim(self, delivery_id: str) -> Optional[Dict]:
+        with self.shared_entries() as state:
+            self.evict()
+            entry = self.entries.get(delivery_id)
+            if entry is not None and (entry is self.PENDING or entry['seen_at'] >= time.time() - self.ttl):
+                SharedStatusBoard.bump(state, 'duplicate_deliveries')
+                self.entries.move_to_end(delivery_id)
+                return {'job_id': None, 'seen_at': None} if entry is self.PENDING else entry
+            self.entries[delivery_id] = self.PENDING
+            return None
+            
+    def complete(self, delivery_id: str, job_id: Optional[str]):
+        with self.shared_entries():
+            self.entries[delivery_id] = {'job_id': job_id, 'seen_at': time.time()}
+            self.evict()
+            
+    def release(self, delivery_id: str):
+        with self.shared_entries():
+            if self.entries.get(delivery_id) is self.PENDING:
+                del self.entries[delivery_id]
+                
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats['entries'] = len(self.store.read().get('deliveries', []))
+        stats['persistent'] = True
+        return stats
+
+
+class DeploymentHistory:
+    """Finished deployments in an SQLite database, indexed by time and SHA
+    
+    Each deployment is one row in `deployments` with the columns used for
+    filtering and stats plus the full job record as JSON; step durations go
+    to `deployment_steps`. Connections are opened per call so the history
+    can be used from any thread or worker process.
+    """
+    
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS deployments (
+            id TEXT PRIMARY KEY,
+            delivery_id TEXT,
+            ref TEXT,
+            sha TEXT,
+            plan TEXT,
+            status TEXT NOT NULL,
+            error TEXT,
+            queued_at REAL,
+            started_at REAL,
+            finished_at REAL NOT NULL,
+            duration REAL,
+            healthy INTEGER,
+            time_to_healthy REAL,
+            time_to_recover REAL,
+            critical_path REAL,
+            record TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS deployment_steps (
+            deployment_id TEXT NOT NULL REFERENCES deployments(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            duration REAL,
+            PRIMARY KEY (deployment_id, position)
+        )""",
+        "CREATE INDEX IF NOT EXISTS deployments_finished_at ON deployments (finished_at)",
+        "CREATE INDEX IF NOT EXISTS deployments_sha ON deployments (sha)",
+        "CREATE INDEX IF NOT EXISTS deployment_steps_name ON deployment_steps (name, duration)"
+    )
+    # Columns added after the first release, created on existing databases at startup
+    MIGRATIONS = (
+        ('deployments', 'time_to_recover', 'REAL'),
+        ('deployments', 'critical_path', 'REAL'),
+    )
+    FILTERS = ('status', 'plan', 'ref', 'delivery_id')
+    FAILED = ('failed', 'rolled_back')
+    # Columns reported as p50/p95 by stats()
+    TIMINGS = ('duration', 'time_to_healthy', 'time_to_recover', 'critical_path')
+    
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self.connect()) as db, db:
+            db.execute('PRAGMA journal_mode=WAL')
+            for statement in self.SCHEMA:
+                db.execute(statement)
+            for table, column, column_type in self.MIGRATIONS:
+                columns = [row['name'] for row in db.execute(f"PRAGMA table_info({table})")]
+                if column not in columns:
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA foreign_keys=ON')
+        return db
+        
+    def record(self, job: DeploymentJob):
+        """Insert or replace a finished job"""
+        health = job.health or {}
+        duration = round(job.finished_at - job.started_at, 3) if job.started_at and job.finished_at else None
+        with closing(self.connect()) as db, db:
+            db.execute(
+                """INSERT OR REPLACE INTO deployments
+                   (id, delivery_id, ref, sha, plan, status, error, queued_at, started_at,
+                    finished_at, duration, healthy, time_to_healthy, time_to_recover, critical_path, record)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (job.id, job.delivery_id, job.ref, job.sha, job.plan, job.status, job.error,
+                 job.first_queued_at, job.started_at, job.finished_at or time.time(), duration,
+                 None if 'healthy' not in health else int(health['healthy']),
+                 health.get('time_to_healthy'), (job.rollback or {}).get('time_to_recover'),
+                 (job.pipeline or {}).get('critical_path_seconds'), json.dumps(job.to_record()))
+            )
+            db.executemany(
+                "INSERT INTO deployment_steps (deployment_id, position, name, status, duration) VALUES (?, ?, ?, ?, ?)",
+                [(job.id, position, step['name'], step['status'], step['duration'])
+                 for position, step in enumerate(job.steps)]
+            )
+            
+    @classmethod
+    def where(cls, filters: Dict) -> Tuple[str, List]:
+        """Build a WHERE clause from API filters (FILTERS, sha prefix, since/until timestamps)
+        
+        Raises ValueError for malformed sha or timestamp values.
+        """
+        clauses, params = [], []
+        for name in cls.FILTERS:
+            if filters.get(name):
+                clauses.append(f"{name} = ?")
+                params.append(filters[name])
+        if filters.get('sha'):
+            if not re.fullmatch(r'[0-9a-f]{1,40}', filters['sha']):
+                raise ValueError(f"Invalid sha {filters['sha']!r}")
+            clauses.append("sha GLOB ?")
+            params.append(filters['sha'] + '*')
+        if filters.get('since'):
+            clauses.append("finished_at >= ?")
+            params.append(float(filters['since']))
+        if filters.get('until'):
+            clauses.append("finished_at < ?")
+            params.append(float(filters['until']))
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+        
+    def query(self, filters: Dict, limit: int = 20, offset: int = 0) -> Tuple[List[DeploymentJob], int]:
+        """Return one page of jobs, newest first, and the total number of matches"""
+        where, params = self.where(filters)
+        with closing(self.connect()) as db:
+            total = db.execute(f"SELECT COUNT(*) FROM deployments{where}", params).fetchone()[0]
+            rows = db.execute(
+                f"SELECT record FROM deployments{where} ORDER BY finished_at DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        return [DeploymentJob.from_record(json.loads(row['record'])) for row in rows], total
+        
+    def get(self, job_id: str) -> Optional[DeploymentJob]:
+        with closing(self.connect()) as db:
+            row = db.execute("SELECT record FROM deployments WHERE id = ?", (job_id,)).fetchone()
+        return DeploymentJob.from_record(json.loads(row['record'])) if row else None
+        
+    @staticmethod
+    def percentiles(values: List[float]) -> Dict:
+        """Nearest-rank p50/p95 of an ascending list"""
+        if not values:
+            return {'p50': None, 'p95': None}
+        return {
+            f"p{pct}": values[max(0, -(-len(values) * pct // 100) - 1)]
+            for pct in (50, 95)
+        }
+        
+    def stats(self, filters: Dict) -> Dict:
+        """Outcome counts, failure rate and duration percentiles for matching deployments"""
+        where, params = self.where(filters)
+        with closing(self.connect()) as db:
+            outcomes = dict(db.execute(
+                f"SELECT status, COUNT(*) FROM deployments{where} GROUP BY status", params
+            ).fetchall())
+            timings = {
+                column: self.percentiles([row[0] for row in db.execute(
+                    f"SELECT {column} FROM deployments{where}{' AND' if where else ' WHERE'} "
+                    f"{column} IS NOT NULL ORDER BY {column}",
+                    params
+                )])
+                for column in self.TIMINGS
+            }
+            steps = {}
+            for name, duration in db.execute(
+                f"""SELECT name, duration FROM deployment_steps
+                    WHERE duration IS NOT NULL AND deployment_id IN (SELECT id FROM deployments{where})
+                    ORDER BY name, duration""",
+                params
+            ):
+                steps.setdefault(name, []).append(duration)
+                
+        total = sum(outcomes.values())
+        failed = sum(outcomes.get(status, 0) for status in self.FAILED)
+        finished = outcomes.get('succeeded', 0) + failed
+        return {
+            'count': total,
+            'outcomes': outcomes,
+            'failure_rate': round(failed / finished, 4) if finished else None,
+            **timings,
+            'steps': {
+                name: dict(self.percentiles(values), count=len(values))
+                for name, values in steps.items()
+            }
+        }
+
+
+class DependencyCache:
+    """LRU cache of installed node_modules trees keyed by a hash of the package manifests"""
+    
+    MANIFESTS = ('package.json', 'package-lock.json', 'npm-shrinkwrap.json')
+    MARKER = '.deploy-cache-key'
+    
+    def __init__(self, cache_dir: str, max_entries: int, status: StatusBoard = None):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.status = status or StatusBoard()
+        
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+        
+    def key(self, path: str, install_command: str) -> str:
+        """Hash the package manifests and install command of a checkout"""
+        digest = hashlib.sha256(install_command.encode('utf-8'))
+        for name in self.MANIFESTS:
+            manifest = os.path.join(path, name)
+            if os.path.isfile(manifest):
+                digest.update(name.encode('utf-8'))
+                with open(manifest, 'rb') as f:
+                    digest.update(f.read())
+        return digest.hexdigest()[:16]
+        
+    def installed_key(self, path: str) -> Optional[str]:
+        """Cache key of the node_modules tree currently installed in a checkout"""
+        try:
+            with open(os.path.join(path, 'node_modules', self.MARKER)) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+            
+    def mark_installed(self, path: str, key: str):
+        """Record which cache key the installed node_modules tree belongs to"""
+        modules = os.path.join(path, 'node_modules')
+        os.makedirs(modules, exist_ok=True)
+        with open(os.path.join(modules, self.MARKER), 'w') as f:
+            f.write(key)
+            
+    def record(self, hit: bool):
+        self.status.increment('dependency_cache_hits' if hit else 'dependency_cache_misses')
+                
+    def restore(self, key: str, path: str) -> bool:
+        """Copy a cached node_modules tree into a checkout, replacing any existing one"""
+        entry = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry):
+            return False
+            
+        modules = os.path.join(path, 'node_modules')
+        staging = f"{modules}.restore-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.copytree(entry, staging, symlinks=True)
+        if os.path.lexists(modules):
+            retired = f"{modules}.old-{os.getpid()}"
+            os.rename(modules, retired)
+            os.rename(staging, modules)
+            shutil.rmtree(retired, ignore_errors=True)
+        else:
+            os.rename(staging, modules)
+            
+        # Touch the entry so eviction sees it as recently used
+        os.utime(entry)
+        return True
+        
+    def store(self, key: str, path: str):
+        """Copy a freshly installed node_modules tree into the cache and evict old entries"""
+        modules = os.path.join(path, 'node_modules')
+        entry = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(modules) or os.path.isdir(entry):
+            return
+            
+        os.makedirs(self.cache_dir, exist_ok=True)
+        staging = f"{entry}.tmp-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.copytree(modules, staging, symlinks=True)
+        os.rename(staging, entry)
+        self.evict()
+        
+    def evict(self):
+        """Drop least recently used entries beyond max_entries"""
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.is_dir() and '.' not in entry.name),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in entries[:max(len(entries) - self.max_entries, 0)]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            
+    def stats(self) -> Dict:
+        """Summarize cache usage for /status"""
+        entries = 0
+        if os.path.isdir(self.cache_dir):
+            entries = sum(1 for entry in os.scandir(self.cache_dir) if entry.is_dir() and '.' not in entry.name)
+        return {
+            'enabled': self.enabled,
+            'hits': self.status.get('dependency_cache_hits', 0),
+            'misses': self.status.get('dependency_cache_misses', 0),
+            'entries': entries,
+            'max_entries': self.max_entries
+        }
+
+
 class WebhookListener:
     """GitHub Webhook Listener for Auto-Deployment"""
     
-    def __init__(self):
+    # Seconds each deployment step may take in total; override with STEP_TIMEOUTS=name=seconds,...
+    DEFAULT_STEP_TIMEOUTS = {
+        'stop_pm2_process': 60,
+        'git_fetch': 120,
+        'git_checkout': 60,
+        'prepare_release': 120,
+        'install_dependencies': 600,
+        'switch_release': 30,
+        'flush_pm2_logs': 30,
+        'start_pm2_process': 60,
+        'reload_pm2_process': 120,
+        'prune_releases': 120,
+        'rollback_release': 180,
+        'rollout_targets': 3600,
+        'deploy_target': 300
+    }
+    
+    READ_CHUNK_SIZE = 64 * 1024
+    
+    # Minimum gap between two batches sent to a /stream subscriber
+    STREAM_BATCH_INTERVAL = 0.1
+    
+    # Written into a release directory once it has passed its health checks
+    KNOWN_GOOD_MARKER = '.deploy-known-good'
+    
+    def __init__(self, state_dir: str = None):
         self.app = Flask(__name__)
-        self.setup_logging()
+        self.setup_logging(shared=bool(state_dir))
+        
+        # With a state directory, queue, delivery ids and status counters live
+        # on disk so several worker processes (see create_app) share them
+        self.state_store = StateStore(state_dir) if state_dir else None
+        self.status_board = SharedStatusBoard(self.state_store) if self.state_store else StatusBoard()
+        self.metrics = MetricsRegistry(
+            os.path.join(self.state_store.state_dir, 'metrics') if self.state_store else None,
+            flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+        )
         self.load_config()
+        self.setup_metrics()
         self.setup_routes()
         
+        # Subprocess execution; step_context carries the running job and step deadline
+        self.command_runner = CommandRunner()
+        self.step_context = threading.local()
+        
+        # Independent pipeline steps run concurrently on this pool
+        self.step_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('PIPELINE_WORKERS', 4)),
+            thread_name_prefix='deploy-step'
+        )
+        
+        # PM2 daemon connection with cached process state
+        self.pm2_client = PM2Client(
+            os.getenv('PM2_HOME', os.path.join(os.path.expanduser('~'), '.pm2')),
+            ttl=float(os.getenv('PM2_STATUS_TTL', 5)),
+            fallback=self.pm2_jlist,
+            logger=self.logger
+        )
+        
+        # Deployment planning and queue with background worker
+        self.planner = DeployPlanner()
+        if self.state_store:
+            self.deployment_queue = SharedDeploymentQueue(
+                self.queue_size,
+                self.job_history_size,
+                self.state_store,
+                ProcessLock(os.path.join(self.state_store.state_dir, 'deploy.lock')),
+                debounce=self.debounce_seconds,
+                max_delay=self.debounce_max_delay,
+                status=self.status_board,
+                output_limit=self.output_buffer_lines
+            )
+        else:
+            self.deployment_queue = DeploymentQueue(
+                self.queue_size,
+                self.job_history_size,
+                debounce=self.debounce_seconds,
+                max_delay=self.debounce_max_delay,
+                status=self.status_board
+            )
+        
         # PM2 configuration
         self.pm2_app_name = "live-error-display"
         self.server_path = "/opt/live-error-display/server.js"
         self.repo_path = "/opt/live-error-display"
         
+        # Release directory mode: each deploy gets a fresh checkout next to
+        # repo_path and traffic is switched over with an atomic symlink swap
+        self.deploy_mode = os.getenv('DEPLOY_MODE', 'inplace')
+        self.releases_dir = os.getenv('RELEASES_DIR', f"{self.repo_path}-releases")
+        self.current_link = os.getenv('CURRENT_LINK', f"{self.repo_path}-current")
+        self.keep_releases = int(os.getenv('KEEP_RELEASES', 5))
+        
+        # node_modules cache keyed by package.json/lockfile hash
+        self.install_command = ['npm', 'install', '--production']
+        self.dependency_cache = DependencyCache(
+            os.getenv('DEPENDENCY_CACHE_DIR', f"{self.repo_path}-dependency-cache"),
+            int(os.getenv('DEPENDENCY_CACHE_SIZE', 3)),
+            status=self.status_board
+        )
+        
+        # SQLite record of every finished deployment for /deployments
+        default_history_db = (
+            os.path.join(self.state_store.state_dir, 'deployments.db') if self.state_store
+            else './logs/deployments.db'
+        )
+        history_db = os.getenv('DEPLOY_HISTORY_DB', default_history_db)
+        try:
+            self.deployment_history = DeploymentHistory(history_db)
+        except sqlite3.Error as e:
+            self.logger.warning(f"{Fore.YELLOW}Cannot open {history_db} ({e}), using ./deployments.db{Style.RESET_ALL}")
+            self.deployment_history = DeploymentHistory('./deployments.db')
+        
         # Health check URLs
-        self.health_check_url = "http://localhost:9090/api/health"
-        self.db_health_url = "http://localhost:9090/api/db/health"
+        self.health_check_url = os.getenv('HEALTH_CHECK_URL', "http://localhost:9090/api/health")
+        self.db_health_url = os.getenv('DB_HEALTH_CHECK_URL', "http://localhost:9090/api/db/health")
+        
+        # Readiness polling; HEALTH_FAILURE_POLICY is 'rollback' (release mode: switch back
+        # to the previous known-good release, otherwise like 'fail'), 'fail' or 'warn' (log and continue)
+        self.health_checker = HealthChecker(
+            deadline=float(os.getenv('HEALTH_CHECK_DEADLINE', 60)),
+            initial_delay=float(os.getenv('HEALTH_CHECK_INITIAL_DELAY', 0.5)),
+            max_delay=float(os.getenv('HEALTH_CHECK_MAX_DELAY', 5)),
+            probe_timeout=float(os.getenv('HEALTH_CHECK_TIMEOUT', 5))
+        )
+        self.health_failure_policy = os.getenv('HEALTH_FAILURE_POLICY', 'rollback')
+        
+        # Optional fan-out: build once in repo_path, then roll out to several apps/hosts
+        self.targets = self.load_targets()
         
-    def setup_logging(self):
-        """Configure detailed logging with colors"""
+        # Last, so a recovered job or the first pm2 lookup never sees a half-configured listener
+        self.pm2_client.start()
+        self.start_deployment_worker()
+        
+    def load_targets(self) -> List[Dict]:
+        """Read deployment targets from DEPLOY_TARGETS (JSON) or DEPLOY_TARGETS_FILE
+        
+        Each target is a local path or an object with path, and optionally
+        name, pm2_app, host (user@host for SSH), health_url and db_health_url.
+        A single target inherits the global health URLs; with several targets
+        each needs its own health_url, or the batch gate would keep probing
+        the same instance.
+        """
+        raw = os.getenv('DEPLOY_TARGETS')
+        targets_file = os.getenv('DEPLOY_TARGETS_FILE')
+        if not raw and targets_file:
+            with open(targets_file) as f:
+                raw = f.read()
+        if not raw:
+            return []
+            
+        try:
+            entries = json.loads(raw)
+        except ValueError as e:
+            raise ConfigurationError(f"DEPLOY_TARGETS is not valid JSON: {e}")
+        if self.deploy_mode == 'release':
+            raise ConfigurationError("DEPLOY_TARGETS cannot be combined with DEPLOY_MODE=release")
+            
+        targets = []
+        for entry in entries:
+            target = {'path': entry} if isinstance(entry, str) else dict(entry)
+            if not target.get('path'):
+                raise ConfigurationError(f"Deployment target without path: {entry!r}")
+            target.setdefault('pm2_app', self.pm2_app_name)
+            target.setdefault('host', None)
+            target.setdefault('name', target['pm2_app'] if target['pm2_app'] != self.pm2_app_name
+                              else os.path.basename(target['path'].rstrip('/')))
+            if len(entries) == 1:
+                target.setdefault('health_url', self.health_check_url)
+                target.setdefault('db_health_url', self.db_health_url)
+            elif not target.get('health_url'):
+                raise ConfigurationError(f"Deployment target {target['name']} needs its own health_url when several targets are configured")
+            target.setdefault('db_health_url', None)
+            targets.append(target)
+        names = [target['name'] for target in targets]
+        if len(set(names)) != len(names):
+            raise ConfigurationError(f"Deployment target names must be unique: {names}")
+        health_urls = [target['health_url'] for target in targets]
+        if len(set(health_urls)) != len(health_urls):
+            raise ConfigurationError(f"Deployment targets must not share a health_url: {health_urls}")
+            
+        self.target_batch_size = max(int(os.getenv('TARGET_BATCH_SIZE', 1)), 1)
+        self.target_concurrency = max(int(os.getenv('TARGET_CONCURRENCY', 4)), 1)
+        self.target_sync_exclude = tuple(filter(None, os.getenv('TARGET_SYNC_EXCLUDE', '.git,logs,.env').split(',')))
+        self.ssh_options = shlex.split(os.getenv('SSH_OPTIONS', '-o BatchMode=yes -o ConnectTimeout=10'))
+        self.logger.info(f"  Deploy Targets: {', '.join(names)} (batch {self.target_batch_size}, concurrency {self.target_concurrency})")
+        return targets
+        
+    def setup_logging(self, shared: bool = False):
+        """Configure detailed logging with colors
+        
+        Callers only put records on a bounded queue; a background listener
+        thread does the formatting and disk writes. shared means several
+        worker processes append to the same log file.
+        """
         self.logger = logging.getLogger('webhook_listener')
         self.logger.setLevel(logging.DEBUG)
+        self.log_context = threading.local()
         
         # Console handler with colors
         console_handler = logging.StreamHandler()
@@ -98,55 +2194,199 @@ class WebhookListener:
         log_file = "./logs/webhook-listener.log"
         
         # Create logs directory if it doesn't exist
-        import os
         os.makedirs("./logs", exist_ok=True)
         
         # Create file formatter first
-        file_formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        if os.getenv('LOG_FORMAT', 'text') == 'json':
+            file_formatter = JsonFormatter()
+        else:
+            file_formatter = logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+            )
         
+        handlers = []
+        setup_warnings = []
         try:
-            file_handler = logging.FileHandler(log_file)
-            file_handler.setLevel(logging.DEBUG)
-            file_handler.setFormatter(file_formatter)
-            self.logger.addHandler(file_handler)
+            handlers.append(self.create_file_handler(log_file, file_formatter, shared))
         except PermissionError:
-            self.logger.warning(f"Cannot write to {log_file}, using current directory")
+            setup_warnings.append(f"Cannot write to {log_file}, using current directory")
             try:
-                file_handler = logging.FileHandler("webhook-listener.log")
-                file_handler.setLevel(logging.DEBUG)
-                file_handler.setFormatter(file_formatter)
-                self.logger.addHandler(file_handler)
+                handlers.append(self.create_file_handler("webhook-listener.log", file_formatter, shared))
             except Exception as e:
-                self.logger.warning(f"Could not create log file: {e}")
+                setup_warnings.append(f"Could not create log file: {e}")
         except Exception as e:
-            self.logger.warning(f"Log file error: {e}")
+            setup_warnings.append(f"Log file error: {e}")
+        if shared and (os.getenv('LOG_MAX_BYTES') or os.getenv('LOG_ROTATE_WHEN')):
+            setup_warnings.append("LOG_MAX_BYTES / LOG_ROTATE_WHEN are ignored with STATE_DIR, rotate the log with logrotate")
+        
+        handlers.append(console_handler)
+        
+        # Replace handlers of a previous instance in this process
+        previous_listener = getattr(self.logger, 'queue_listener', None)
+        if previous_listener:
+            previous_listener.stop()
+            atexit.unregister(previous_listener.stop)
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        
+        self.log_handler = DroppingQueueHandler(queue.Queue(int(os.getenv('LOG_QUEUE_SIZE', 10000))))
+        self.log_handler.addFilter(DeploymentContextFilter(self.log_context))
+        self.logger.addHandler(self.log_handler)
+        self.logger.queue_listener = logging.handlers.QueueListener(
+            self.log_handler.queue, *handlers, respect_handler_level=True
+        )
+        self.logger.queue_listener.start()
+        atexit.register(self.logger.queue_listener.stop)
+        
+        for warning in setup_warnings:
+            self.logger.warning(warning)
         
-        self.logger.addHandler(console_handler)
+    def create_file_handler(self, log_file: str, formatter: logging.Formatter, shared: bool = False) -> logging.Handler:
+        """File handler rotating by size (LOG_MAX_BYTES) or time (LOG_ROTATE_WHEN)
+        
+        Rotating handlers only work within one process: a shared file gets a
+        WatchedFileHandler, which reopens it after an external logrotate.
+        """
+        backup_count = int(os.getenv('LOG_BACKUP_COUNT', 5))
+        rotate_when = os.getenv('LOG_ROTATE_WHEN')
+        if shared:
+            handler = logging.handlers.WatchedFileHandler(log_file)
+        elif rotate_when:
+            handler = logging.handlers.TimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count)
+        else:
+            handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+                backupCount=backup_count
+            )
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(formatter)
+        return handler
         
     def load_config(self):
         """Load configuration from environment variables"""
         self.github_secret = os.getenv('GITHUB_WEBHOOK_SECRET')
         if not self.github_secret:
-            self.logger.error(f"{Fore.RED}GITHUB_WEBHOOK_SECRET environment variable not set!{Style.RESET_ALL}")
-            sys.exit(1)
+            raise ConfigurationError("GITHUB_WEBHOOK_SECRET environment variable not set!")
             
         self.port = int(os.getenv('WEBHOOK_PORT', 9090))
         self.host = os.getenv('WEBHOOK_HOST', '0.0.0.0')
         self.target_branch = os.getenv('TARGET_BRANCH', 'live')
+        self.git_fetch_depth = int(os.getenv('GIT_FETCH_DEPTH', 0))
+        self.git_fetch_filter = os.getenv('GIT_FETCH_FILTER', '')
+        self.queue_size = int(os.getenv('DEPLOY_QUEUE_SIZE', 10))
+        self.job_history_size = int(os.getenv('DEPLOY_HISTORY_SIZE', 50))
+        self.debounce_seconds = float(os.getenv('DEPLOY_DEBOUNCE_SECONDS', 3))
+        self.debounce_max_delay = float(os.getenv('DEPLOY_DEBOUNCE_MAX_DELAY', 60))
+        self.output_buffer_lines = int(os.getenv('DEPLOY_OUTPUT_LINES', 500))
+        self.max_payload_bytes = int(os.getenv('MAX_PAYLOAD_BYTES', 10 * 1024 * 1024))
+        self.commit_files_threshold = int(os.getenv('LOG_COMMIT_FILES_THRESHOLD', 20))
+        json_backend = os.getenv('JSON_BACKEND', 'auto')
+        self.json_loads = orjson.loads if orjson and json_backend != 'json' else json.loads
+        if self.state_store:
+            self.delivery_cache = SharedDeliveryCache(
+                int(os.getenv('DELIVERY_CACHE_SIZE', 1000)),
+                float(os.getenv('DELIVERY_CACHE_TTL', 86400)),
+                self.state_store,
+                status=self.status_board
+            )
+        else:
+            self.delivery_cache = DeliveryCache(
+                int(os.getenv('DELIVERY_CACHE_SIZE', 1000)),
+                float(os.getenv('DELIVERY_CACHE_TTL', 86400)),
+                os.getenv('DELIVERY_CACHE_FILE') or None,
+                status=self.status_board
+            )
+        self.command_timeout = float(os.getenv('COMMAND_TIMEOUT', 300))
+        self.step_timeouts = dict(self.DEFAULT_STEP_TIMEOUTS)
+        for item in filter(None, os.getenv('STEP_TIMEOUTS', '').split(',')):
+            name, _, seconds = item.partition('=')
+            self.step_timeouts[name.strip()] = float(seconds)
+        self.max_stream_subscribers = int(os.getenv('MAX_STREAM_SUBSCRIBERS', 50))
+        # Every stream holds a request thread until it ends; with a fixed thread
+        # count per worker (gunicorn --threads) some must stay free for /webhook
+        self.web_threads = int(os.getenv('WEB_THREADS', 0)) or None
+        if self.web_threads:
+            reserved = int(os.getenv('STREAM_RESERVED_THREADS', 2))
+            self.max_stream_subscribers = min(self.max_stream_subscribers, max(self.web_threads - reserved, 0))
+        self.stream_heartbeat = float(os.getenv('STREAM_HEARTBEAT_SECONDS', 15))
+        self.stream_subscribers = 0
+        self.stream_lock = threading.Lock()
         
         self.logger.info(f"{Fore.GREEN}Configuration loaded:{Style.RESET_ALL}")
         self.logger.info(f"  Port: {self.port}")
         self.logger.info(f"  Host: {self.host}")
         self.logger.info(f"  Target Branch: {self.target_branch}")
+        self.logger.info(f"  Deploy Queue Size: {self.queue_size}")
+        self.logger.info(f"  Max Payload: {self.max_payload_bytes} bytes")
+        self.logger.info(f"  Deploy Debounce: {self.debounce_seconds}s")
+        self.logger.info(f"  Max Stream Subscribers: {self.max_stream_subscribers}"
+                         + (f" ({self.web_threads} request threads)" if self.web_threads else ''))
+        
+    def setup_metrics(self):
+        """Register the metrics exposed on /metrics"""
+        self.ack_latency = self.metrics.histogram(
+            'webhook_ack_seconds', 'Time to answer a webhook delivery', ('code',),
+            (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+        )
+        self.step_duration = self.metrics.histogram(
+            'deploy_step_duration_seconds', 'Duration of deployment steps', ('step', 'status'),
+            (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+        )
+        self.deploy_duration = self.metrics.histogram(
+            'deploy_duration_seconds', 'Duration of deployments from start to finish', ('plan', 'outcome'),
+            (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+        )
+        self.deploy_outcomes = self.metrics.counter(
+            'deployments_total', 'Finished deployments by plan and outcome', ('plan', 'outcome')
+        )
+        self.subprocess_spawns = self.metrics.counter(
+            'subprocess_spawns_total', 'Subprocesses started, by executable', ('command',)
+        )
+        self.health_probe_latency = self.metrics.histogram(
+            'health_probe_seconds', 'Latency of individual health probe requests', ('endpoint',),
+            (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+        )
+        self.critical_path_time = self.metrics.histogram(
+            'deploy_critical_path_seconds', 'Longest chain of dependent steps in a deployment', ('plan',),
+            (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+        )
+        self.target_results = self.metrics.counter(
+            'deploy_target_results_total', 'Per-target rollout results', ('target', 'status')
+        )
+        self.target_duration = self.metrics.histogram(
+            'deploy_target_seconds', 'Time to sync, reload and health-check one target', ('target',),
+            (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+        )
+        self.rollbacks = self.metrics.counter(
+            'deploy_rollbacks_total', 'Rollbacks to a known-good release', ('trigger', 'result')
+        )
+        self.time_to_recover = self.metrics.histogram(
+            'deploy_time_to_recover_seconds', 'Time from switching to a broken release until the rollback is healthy', ('trigger',),
+            (1, 2.5, 5, 10, 30, 60, 120, 300)
+        )
+        self.metrics.gauge(
+            'deploy_queue_depth', 'Deployments waiting in the queue',
+            lambda: self.deployment_queue.stats()['depth']
+        )
+        self.metrics.gauge(
+            'deploy_running', 'Whether a deployment is running',
+            lambda: int(self.deployment_queue.stats()['current_job'] is not None)
+        )
         
     def setup_routes(self):
         """Setup Flask routes"""
         
         @self.app.route('/webhook', methods=['POST'])
         def github_webhook():
-            return self.handle_webhook()
+            started = time.perf_counter()
+            response = self.handle_webhook()
+            self.ack_latency.observe(time.perf_counter() - started, str(response[1]))
+            return response
+            
+        @self.app.route('/metrics', methods=['GET'])
+        def metrics():
+            return self.metrics.render(), 200, {'Content-Type': MetricsRegistry.CONTENT_TYPE}
             
         @self.app.route('/health', methods=['GET'])
         def health_check():
@@ -158,51 +2398,279 @@ class WebhookListener:
             
         @self.app.route('/status', methods=['GET'])
         def status():
+            started_at = self.status_board.get('started_at')
             return jsonify({
                 'pm2_status': self.get_pm2_status(),
-                'last_deployment': getattr(self, 'last_deployment', None),
-                'uptime': time.time() - getattr(self, 'start_time', time.time())
+                'last_deployment': self.status_board.get('last_deployment'),
+                'queue': self.deployment_queue.stats(),
+                'dependency_cache': self.dependency_cache.stats(),
+                'delivery_cache': self.delivery_cache.stats(),
+                'uptime': time.time() - started_at if started_at else 0,
+                # Details of the worker process that served this request
+                'worker': {
+                    'pid': os.getpid(),
+                    'pm2_client': self.pm2_client.stats(),
+                    'log_records_dropped': self.log_handler.dropped,
+                    'stream_subscribers': self.stream_subscribers,
+                    'max_stream_subscribers': self.max_stream_subscribers
+                }
+            })
+            
+        @self.app.route('/deployments', methods=['GET'])
+        def list_deployments():
+            try:
+                limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+                offset = max(int(request.args.get('offset', 0)), 0)
+                jobs, total = self.deployment_history.query(request.args, limit, offset)
+            except ValueError:
+                return jsonify({'error': 'limit, offset, since and until must be numbers and sha hexadecimal'}), 400
+            return jsonify({
+                'deployments': [job.to_dict() for job in jobs],
+                'total': total,
+                'limit': limit,
+                'offset': offset,
+                'next_offset': offset + limit if offset + limit < total else None
+            })
+            
+        @self.app.route('/deployments/stats', methods=['GET'])
+        def deployment_stats():
+            try:
+                return jsonify(self.deployment_history.stats(request.args))
+            except ValueError:
+                return jsonify({'error': 'since and until must be numbers and sha hexadecimal'}), 400
+                
+        @self.app.route('/deployments/<job_id>', methods=['GET'])
+        def deployment_status(job_id):
+            job = self.find_deployment(job_id)
+            if job is None:
+                return jsonify({'error': 'Deployment not found'}), 404
+            return jsonify(job.to_dict())
+            
+        @self.app.route('/deployments/<job_id>/output', methods=['GET'])
+        def deployment_output(job_id):
+            job = self.find_deployment(job_id)
+            if job is None:
+                return jsonify({'error': 'Deployment not found'}), 404
+            return jsonify({'id': job.id, 'status': job.status, 'output': job.command_output()})
+            
+        @self.app.route('/deployments/<job_id>/stream', methods=['GET'])
+        def deployment_stream(job_id):
+            job = self.find_deployment(job_id)
+            if job is None:
+                return jsonify({'error': 'Deployment not found'}), 404
+            cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor') or -1
+            try:
+                cursor = int(cursor)
+            except ValueError:
+                return jsonify({'error': 'Last-Event-ID / cursor must be an integer'}), 400
+            with self.stream_lock:
+                if self.stream_subscribers >= self.max_stream_subscribers:
+                    if not self.max_stream_subscribers:
+                        return jsonify({'error': 'Streaming is disabled, use /output'}), 503
+                    return jsonify({'error': 'Too many stream subscribers'}), 503, {'Retry-After': '5'}
+                self.stream_subscribers += 1
+            response = Response(self.stream_deployment(job, cursor), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'Connection': 'keep-alive',
+                'X-Accel-Buffering': 'no'
             })
+            response.call_on_close(self.release_stream_subscriber)
+            return response
+            
+        @self.app.route('/rollback', methods=['POST'])
+        def rollback():
+            body, status_code = self.request_rollback()
+            return jsonify(body), status_code
+            
+        @self.app.route('/deployments/<job_id>/cancel', methods=['POST'])
+        def cancel_deployment(job_id):
+            if not self.verify_request():
+                return jsonify({'error': 'Invalid signature'}), 401
+            job = self.find_deployment(job_id)
+            if job is None:
+                return jsonify({'error': 'Deployment not found'}), 404
+            body, status_code = self.cancel_deployment(job)
+            return jsonify(body), status_code
     
-    def verify_signature(self, payload_body: bytes, signature_header: str) -> bool:
-        """Verify GitHub webhook signature"""
-        if not signature_header:
-            return False
+    def read_signed_body(self) -> Tuple[Optional[bytes], Optional[Tuple[Dict, int]]]:
+        """Read the request body while computing its HMAC, enforcing MAX_PAYLOAD_BYTES
+        
+        Returns (body, None) for a correctly signed body, otherwise
+        (None, (error response, status code)). Requests without a usable
+        signature header or with an oversized Content-Length are rejected
+        before any of the body is read.
+        """
+        sha_name, _, signature = (request.headers.get('X-Hub-Signature-256') or '').partition('=')
+        if sha_name != 'sha256' or not signature:
+            return None, ({'error': 'Invalid signature'}, 401)
+        if request.content_length is not None and request.content_length > self.max_payload_bytes:
+            return None, ({'error': 'Payload too large'}, 413)
             
-        try:
-            sha_name, signature = signature_header.split('=')
-            if sha_name != 'sha256':
-                return False
+        mac = hmac.new(self.github_secret.encode('utf-8'), digestmod=hashlib.sha256)
+        body = bytearray()
+        while True:
+            chunk = request.stream.read(self.READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            if len(body) + len(chunk) > self.max_payload_bytes:
+                return None, ({'error': 'Payload too large'}, 413)
+            mac.update(chunk)
+            body += chunk
+            
+        if not hmac.compare_digest(mac.hexdigest(), signature):
+            return None, ({'error': 'Invalid signature'}, 401)
+        return bytes(body), None
+    
+    def verify_request(self) -> bool:
+        """Verify the signature of a management request (same scheme as GitHub webhooks)"""
+        _, error = self.read_signed_body()
+        return error is None
+    
+    def find_deployment(self, job_id: str) -> Optional[DeploymentJob]:
+        """Look up a job in the queue, falling back to the deployment history"""
+        return self.deployment_queue.find(job_id) or self.deployment_history.get(job_id)
+    
+    @staticmethod
+    def format_event(data: Dict, event_id: int = None) -> str:
+        """Encode one server-sent event the way express-sse does for /events"""
+        message = f"id: {event_id}\n" if event_id is not None else ''
+        return f"{message}data: {json.dumps(data)}\n\n"
+        
+    def stream_deployment(self, job: DeploymentJob, cursor: int):
+        """Yield status, step and output events of a job until it has finished
+        
+        Subscribers share DeploymentJob.changed instead of polling, wake at most
+        every STREAM_BATCH_INTERVAL and replay buffered entries newer than cursor.
+        """
+        yield ':ok\n\n'
+        status = None
+        last_write = time.monotonic()
+        while True:
+            # Jobs of other gunicorn workers are snapshots, so look them up again
+            job = self.find_deployment(job.id) or job
+            current_status = job.status
+            entries = list(job.output)
+            if entries and entries[-1]['seq'] > cursor:
+                first = entries[0]['seq']
+                if cursor >= 0 and first > cursor + 1:
+                    yield self.format_event({'type': 'truncated', 'missed': first - cursor - 1})
+                for entry in entries[max(0, cursor + 1 - first):]:
+                    event = dict(entry, type='step' if entry['stream'] == 'step' else 'output')
+                    yield self.format_event(event, entry['seq'])
+                cursor = entries[-1]['seq']
+                last_write = time.monotonic()
                 
-            mac = hmac.new(
-                self.github_secret.encode('utf-8'),
-                msg=payload_body,
-                digestmod=hashlib.sha256
-            )
+            if current_status != status:
+                status = current_status
+                yield self.format_event(dict(job.to_dict(), type='status'))
+                last_write = time.monotonic()
+            if status not in ('queued', 'running'):
+                return
+                
+            time.sleep(self.STREAM_BATCH_INTERVAL)
+            with DeploymentJob.changed:
+                if job.status == status and (not job.output or job.output[-1]['seq'] <= cursor):
+                    DeploymentJob.changed.wait(min(self.stream_heartbeat, 1.0))
+            if time.monotonic() - last_write >= self.stream_heartbeat:
+                yield ':keepalive\n\n'
+                last_write = time.monotonic()
+                
+    def release_stream_subscriber(self):
+        with self.stream_lock:
+            self.stream_subscribers -= 1
             
-            return hmac.compare_digest(mac.hexdigest(), signature)
-        except Exception as e:
-            self.logger.error(f"Signature verification error: {e}")
-            return False
+    def cancel_deployment(self, job: DeploymentJob) -> Tuple[Dict, int]:
+        """Cancel a queued job or signal a running one to stop"""
+        if self.deployment_queue.cancel(job):
+            self.record_deployment(job)
+            self.logger.info(f"{Fore.YELLOW}🛑 Deployment {job.id} cancelled before it started{Style.RESET_ALL}")
+            return {'message': 'Deployment cancelled', 'job_id': job.id}, 200
+        if job.status != 'running':
+            return {'error': f'Deployment is already {job.status}'}, 409
+        if not job.cancellable:
+            return {'error': 'Deployment has stopped the app and can no longer be cancelled'}, 409
+        self.deployment_queue.request_cancel(job)
+        self.logger.info(f"{Fore.YELLOW}🛑 Cancelling running deployment {job.id}{Style.RESET_ALL}")
+        return {'message': 'Cancellation requested', 'job_id': job.id}, 202
+    
+    def request_rollback(self) -> Tuple[Dict, int]:
+        """Queue a switch back to a known-good release (signed like a webhook)
+        
+        The optional JSON body {"sha": "<prefix>"} selects the release; by
+        default the newest known-good release other than the live one is used.
+        """
+        body, error = self.read_signed_body()
+        if error:
+            return error
+        if self.deploy_mode != 'release':
+            return {'error': 'Rollback requires DEPLOY_MODE=release'}, 409
+        try:
+            sha = (self.json_loads(body) if body.strip() else {}).get('sha')
+        except (ValueError, AttributeError):
+            return {'error': 'Invalid JSON payload'}, 400
+        target = self.rollback_target(sha)
+        if target is None:
+            return {'error': 'No known-good release to roll back to'}, 404
+            
+        job = DeploymentJob('rollback', read_git_head(target), [], self.output_buffer_lines)
+        job.plan = 'rollback'
+        job.plan_reason = f"manual rollback to {os.path.basename(target)}"
+        try:
+            self.deployment_queue.put(job)
+        except QueueFullError as e:
+            return {'error': str(e)}, 503
+        self.logger.info(f"{Fore.YELLOW}⏪ Rollback to {os.path.basename(target)} queued as {job.id}{Style.RESET_ALL}")
+        return {
+            'message': 'Rollback queued',
+            'job_id': job.id,
+            'release': os.path.basename(target),
+            'status_url': f"/deployments/{job.id}"
+        }, 202
+    
+    def duplicate_delivery_response(self, delivery_id: str, entry: Dict) -> Tuple[Dict, int]:
+        """Answer a redelivered webhook with the result of the original delivery"""
+        self.logger.info(f"{Fore.CYAN}♻️ Duplicate delivery {delivery_id}, not deploying again{Style.RESET_ALL}")
+        response = {'message': 'Duplicate delivery', 'delivery_id': delivery_id, 'job_id': entry['job_id']}
+        if entry['job_id']:
+            response['status_url'] = f"/deployments/{entry['job_id']}"
+            job = self.find_deployment(entry['job_id'])
+            if job:
+                response['deployment'] = job.to_dict()
+        return response, 200
     
     def handle_webhook(self) -> Tuple[Dict, int]:
         """Handle incoming GitHub webhook"""
+        claimed_delivery = None
         try:
-            # Get raw payload
-            payload_body = request.get_data()
-            signature_header = request.headers.get('X-Hub-Signature-256')
+            # Read and verify the payload in one bounded pass
+            payload_body, error = self.read_signed_body()
+            if error:
+                self.logger.warning(f"{Fore.YELLOW}Rejected webhook: {error[0]['error']}{Style.RESET_ALL}")
+                return error
             
-            # Verify signature
-            if not self.verify_signature(payload_body, signature_header):
-                self.logger.warning(f"{Fore.YELLOW}Invalid webhook signature{Style.RESET_ALL}")
-                return {'error': 'Invalid signature'}, 401
+            # Answer redeliveries from the cache
+            delivery_id = request.headers.get('X-GitHub-Delivery')
+            if delivery_id:
+                entry = self.delivery_cache.claim(delivery_id)
+                if entry is not None:
+                    return self.duplicate_delivery_response(delivery_id, entry)
+                claimed_delivery = delivery_id
             
-            # Parse JSON payload
-            payload = request.get_json()
+            # Parse JSON payload once from the verified buffer
+            try:
+                payload = self.json_loads(payload_body)
+            except ValueError:
+                payload = None
+            if not isinstance(payload, dict):
+                if claimed_delivery:
+                    self.delivery_cache.release(claimed_delivery)
+                return {'error': 'Invalid JSON payload'}, 400
             
             # Check if it's a push event to target branch
             if payload.get('ref') != f'refs/heads/{self.target_branch}':
                 self.logger.info(f"Ignoring push to {payload.get('ref', 'unknown')} branch")
+                if claimed_delivery:
+                    self.delivery_cache.complete(claimed_delivery, None)
                 return {'message': 'Branch ignored'}, 200
             
             self.logger.info(f"{Fore.GREEN}🚀 Webhook received for {self.target_branch} branch{Style.RESET_ALL}")
@@ -211,21 +2679,48 @@ class WebhookListener:
             commits = payload.get('commits', [])
             self.log_commits(commits)
             
-            # Start deployment process
-            success = self.deploy()
+            # Queue deployment for the background worker
+            job = DeploymentJob(
+                payload['ref'],
+                payload.get('after'),
+                commits,
+                self.output_buffer_lines,
+                delivery_id=delivery_id,
+                before=payload.get('before')
+            )
+            try:
+                self.deployment_queue.put(job)
+            except QueueFullError as e:
+                self.logger.error(f"{Fore.RED}{e}{Style.RESET_ALL}")
+                if claimed_delivery:
+                    self.delivery_cache.release(claimed_delivery)
+                return {'error': str(e)}, 503
+            if claimed_delivery:
+                self.delivery_cache.complete(claimed_delivery, job.id)
             
-            if success:
-                self.last_deployment = datetime.now().isoformat()
-                return {'message': 'Deployment successful'}, 200
-            else:
-                return {'error': 'Deployment failed'}, 500
+            self.logger.info(f"{Fore.CYAN}📥 Deployment {job.id} queued{Style.RESET_ALL}")
+            if job.superseded:
+                self.logger.info(f"  Coalesced pending deployments: {', '.join(job.superseded)}")
+            return {
+                'message': 'Deployment queued',
+                'job_id': job.id,
+                'superseded': job.superseded,
+                'status_url': f'/deployments/{job.id}'
+            }, 202
                 
         except Exception as e:
             self.logger.error(f"{Fore.RED}Webhook handling error: {e}{Style.RESET_ALL}")
+            if claimed_delivery:
+                self.delivery_cache.release(claimed_delivery)
             return {'error': str(e)}, 500
     
     def log_commits(self, commits: List[Dict]):
-        """Log detailed commit information"""
+        """Log detailed commit information
+        
+        Commits touching more than LOG_COMMIT_FILES_THRESHOLD files get a
+        one-line summary; the full file lists are kept on the structured
+        record (visible with LOG_FORMAT=json).
+        """
         self.logger.info(f"{Fore.CYAN}📝 Commits received: {len(commits)}{Style.RESET_ALL}")
         
         for commit in commits:
@@ -233,12 +2728,24 @@ class WebhookListener:
             message = commit.get('message', 'No message')
             commit_id = commit.get('id', '')[:8]
             
-            self.logger.info(f"  {Fore.YELLOW}[{commit_id}]{Style.RESET_ALL} {message} by {author}")
-            
             # Log file changes
             added = commit.get('added', [])
             modified = commit.get('modified', [])
             removed = commit.get('removed', [])
+            files = {'added': added, 'modified': modified, 'removed': removed}
+            
+            self.logger.info(
+                f"  {Fore.YELLOW}[{commit_id}]{Style.RESET_ALL} {message} by {author}",
+                extra={'commit': commit.get('id'), 'files': files}
+            )
+            
+            if len(added) + len(modified) + len(removed) > self.commit_files_threshold:
+                self.logger.info(
+                    f"    {Fore.GREEN}++++ {len(added)}{Style.RESET_ALL} "
+                    f"{Fore.YELLOW}~~~~ {len(modified)}{Style.RESET_ALL} "
+                    f"{Fore.RED}---- {len(removed)}{Style.RESET_ALL} files (list omitted)"
+                )
+                continue
             
             for file in added:
                 self.logger.info(f"    {Fore.GREEN}++++ {file}{Style.RESET_ALL}")
@@ -247,140 +2754,836 @@ class WebhookListener:
             for file in removed:
                 self.logger.info(f"    {Fore.RED}---- {file}{Style.RESET_ALL}")
     
-    def deploy(self) -> bool:
-        """Execute deployment process"""
-        self.logger.info(f"{Fore.BLUE}🔄 Starting deployment process...{Style.RESET_ALL}")
+    def start_deployment_worker(self):
+        """Start the background thread that executes queued deployments"""
+        self.worker_thread = threading.Thread(
+            target=self.deployment_worker,
+            name='deployment-worker',
+            daemon=True
+        )
+        self.worker_thread.start()
+        
+    def deployment_worker(self):
+        """Run queued deployments one at a time"""
+        while True:
+            job = self.deployment_queue.get()
+            try:
+                self.run_deployment(job)
+            except Exception as e:
+                # Never let the worker die: in shared mode it holds deploy.lock
+                self.logger.error(f"{Fore.RED}❌ Deployment worker error in {job.id}: {e}{Style.RESET_ALL}")
+                if job.status in ('queued', 'running'):
+                    job.status = 'failed'
+                    job.error = job.error or str(e)
+                    job.finished_at = job.finished_at or time.time()
+                try:
+                    self.deployment_queue.done(job)
+                except Exception as e:
+                    self.logger.error(f"{Fore.RED}❌ Could not release deployment {job.id}: {e}{Style.RESET_ALL}")
+                job.notify()
+            finally:
+                self.log_context.deployment_id = None
+                
+    def run_deployment(self, job: DeploymentJob):
+        """Plan, run and record one deployment job"""
+        self.log_context.deployment_id = job.id
+        job.status = 'running'
+        job.started_at = time.time()
+        self.logger.info(f"{Fore.BLUE}▶️ Running deployment {job.id} ({job.sha or 'unknown sha'}){Style.RESET_ALL}")
+        self.deployment_queue.update(job)
+        job.notify()
         
         try:
-            # Step 1: Stop PM2 process
-            self.logger.info(f"{Fore.YELLOW}1. Stopping PM2 process: {self.pm2_app_name}{Style.RESET_ALL}")
-            if not self.stop_pm2_process():
-                return False
+            job.plan, job.plan_reason = self.plan_deployment(job)
+            self.logger.info(f"{Fore.CYAN}🧭 Deploy plan: {job.plan} ({job.plan_reason}){Style.RESET_ALL}")
+            success = self.deploy(job)
+            job.status = 'succeeded' if success else 'failed'
+            if not success and (job.rollback or {}).get('healthy'):
+                job.status = 'rolled_back'
+        except DeploymentCancelled:
+            self.logger.warning(f"{Fore.YELLOW}🛑 Deployment {job.id} cancelled{Style.RESET_ALL}")
+            job.error = 'Cancelled'
+            job.status = 'cancelled'
+            success = False
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            success = False
             
-            # Step 2: Pull latest changes
-            self.logger.info(f"{Fore.YELLOW}2. Pulling latest changes from {self.target_branch}{Style.RESET_ALL}")
-            if not self.git_pull():
-                return False
+        job.finished_at = time.time()
+        if not success and not job.error:
+            failed = [step['name'] for step in job.steps if step['status'] == 'failed']
+            job.error = f"Step {failed[-1]} failed" if failed else 'Deployment failed'
+        if success:
+            self.status_board.set('last_deployment', datetime.now().isoformat())
+            self.status_board.set('deployed_sha', job.sha if job.plan == 'noop' else self.current_sha())
+        self.status_board.set('last_job_failed', not success)
+        self.deployment_queue.done(job)
+        self.record_deployment(job)
+        job.notify()
             
-            # Step 3: Install dependencies
-            self.logger.info(f"{Fore.YELLOW}3. Installing dependencies{Style.RESET_ALL}")
-            if not self.install_dependencies():
-                return False
+    def record_deployment(self, job: DeploymentJob):
+        """Store a finished job in the deployment history and metrics"""
+        plan = job.plan or 'none'
+        self.deploy_outcomes.inc(plan, job.status)
+        if job.started_at:
+            self.deploy_duration.observe(job.finished_at - job.started_at, plan, job.status)
+        for target in job.targets or []:
+            self.target_results.inc(target['name'], target['status'])
+            if target['duration'] is not None:
+                self.target_duration.observe(target['duration'], target['name'])
+        if job.pipeline:
+            self.critical_path_time.observe(job.pipeline['critical_path_seconds'], plan)
+        for step in job.steps:
+            if step['duration'] is not None:
+                self.step_duration.observe(step['duration'], step['name'], step['status'])
+        for name, probe in (job.health or {}).get('probes', {}).items():
+            for latency in probe['latencies']:
+                self.health_probe_latency.observe(latency, name)
+        if self.metrics.shared_dir:
+            try:
+                self.metrics.flush()
+            except OSError:
+                pass
+                
+        try:
+            self.deployment_history.record(job)
+        except sqlite3.Error as e:
+            self.logger.warning(f"{Fore.YELLOW}Could not record deployment {job.id}: {e}{Style.RESET_ALL}")
+            
+    def plan_deployment(self, job: DeploymentJob) -> Tuple[str, str]:
+        """Choose the deployment plan for a job from its changed files"""
+        if job.plan == 'rollback':
+            return job.plan, job.plan_reason
+        if self.status_board.get('last_job_failed'):
+            return 'full', 'previous deployment failed'
+        # A noop push is live without a checkout, so the checkout alone can lag behind
+        current_sha = self.current_sha()
+        deployed = {sha for sha in (current_sha, self.status_board.get('deployed_sha')) if sha}
+        if job.sha and job.sha in deployed:
+            return 'noop', f'already at {job.sha[:8]}'
+        if job.before and deployed and job.before not in deployed:
+            # A cancelled or rejected push sits in between; its changes are not in this payload
+            return 'full', f'deployed {(current_sha or min(deployed))[:8]} is not the push base {job.before[:8]}'
+        plan, reason = self.planner.plan(job.commits, job.changed_files())
+        if self.deploy_mode == 'release' and plan == 'static':
+            # The running process serves public/ from its own release directory
+            return 'reload', f'{reason} (release mode needs a reload to serve them)'
+        return plan, reason
+            
+    def run_step(self, job: Optional[DeploymentJob], name: str, func, timeout: float = None) -> bool:
+        """Run a deployment step and record its timing on the job
+        
+        Commands run by the step share the step's timeout and stream their
+        output into the job's buffer.
+        """
+        if job and job.cancel_event.is_set():
+            raise DeploymentCancelled()
+            
+        step = job.start_step(name) if job else None
+        if job:
+            self.deployment_queue.update(job)
+        timeout = timeout or self.step_timeouts.get(name)
+        self.step_context.job = job
+        self.step_context.step = name
+        self.step_context.deadline = time.time() + timeout if timeout else None
+        try:
+            result = func()
+        except Exception as e:
+            if step:
+                job.finish_step(step, 'cancelled' if isinstance(e, DeploymentCancelled) else 'failed')
+            raise
+        finally:
+            self.step_context.job = self.step_context.step = self.step_context.deadline = None
+            
+        if job and job.cancel_event.is_set():
+            job.finish_step(step, 'cancelled')
+            raise DeploymentCancelled()
+        if step:
+            job.finish_step(step, 'failed' if result is False else 'succeeded')
+            self.deployment_queue.update(job)
+        return result is not False
+    
+    def disable_cancel(self, job: Optional[DeploymentJob]):
+        """Pass the point of no return, or raise DeploymentCancelled if a cancel came first
+        
+        From here on production is being changed, and only running the
+        deployment to its end (including any rollback) leaves it consistent.
+        """
+        if job and not job.disable_cancel():
+            raise DeploymentCancelled()
+            
+    def stop_for_install(self, job: Optional[DeploymentJob]) -> bool:
+        """Stop the app before reinstalling in place; a cancel would leave production stopped"""
+        self.disable_cancel(job)
+        return self.stop_pm2_process()
+        
+    def checkout_in_place(self, job: Optional[DeploymentJob], sha: str = None) -> bool:
+        """Check out the live tree; a cancel would leave new code on disk that was never reloaded"""
+        self.disable_cancel(job)
+        return self.git_checkout(sha)
+        
+    def deploy(self, job: Optional[DeploymentJob] = None) -> bool:
+        """Execute deployment process"""
+        plan = (job.plan if job else None) or 'full'
+        if plan == 'noop':
+            self.logger.info(f"{Fore.GREEN}✅ Nothing to deploy ({job.plan_reason}){Style.RESET_ALL}")
+            return True
+        if plan == 'rollback':
+            return self.run_step(job, 'rollback_release', lambda: self.rollback(job, 'manual', job.sha))
+        if self.targets:
+            return self.deploy_targets(job)
+        if self.deploy_mode == 'release':
+            return self.deploy_release(job)
+            
+        self.logger.info(f"{Fore.BLUE}🔄 Starting deployment process ({plan})...{Style.RESET_ALL}")
+        sha = job.sha if job else None
+        full = plan == 'full'
+        
+        # The fetch overlaps with stopping the process; only the checkout has to wait for both.
+        # The process is only stopped when dependencies are reinstalled underneath it.
+        steps = [PipelineStep('git_fetch', lambda: self.git_fetch(sha), description=f"Fetching {sha or self.target_branch}")]
+        if full:
+            steps.append(PipelineStep(
+                'stop_pm2_process', lambda: self.stop_for_install(job),
+                description=f"Stopping PM2 process: {self.pm2_app_name}"
+            ))
+        steps.append(PipelineStep(
+            'git_checkout', lambda: self.checkout_in_place(job, sha),
+            after=('git_fetch', 'stop_pm2_process') if full else ('git_fetch',),
+            description=f"Checking out {self.target_branch} at {(sha or 'FETCH_HEAD')[:8]}"
+        ))
+        if plan != 'static':
+            steps.append(PipelineStep(
+                'flush_pm2_logs', self.flush_pm2_logs,
+                after=('stop_pm2_process',) if full else (), on_failure='continue',
+                description="Flushing PM2 logs"
+            ))
+            if full:
+                steps += [
+                    PipelineStep('install_dependencies', self.install_dependencies, after=('git_checkout',),
+                                 description="Installing dependencies"),
+                    PipelineStep('start_pm2_process', self.start_pm2_process,
+                                 after=('install_dependencies', 'flush_pm2_logs'), description="Starting PM2 process")
+                ]
+            else:
+                steps.append(PipelineStep(
+                    'reload_pm2_process', self.reload_pm2_process,
+                    after=('git_checkout', 'flush_pm2_logs'), description="Reloading PM2 process"
+                ))
+            # There is no previous tree to switch back to in place, so 'rollback' fails the deploy
+            steps.append(PipelineStep(
+                'perform_health_checks', lambda: self.perform_health_checks(job),
+                after=('start_pm2_process' if full else 'reload_pm2_process',),
+                on_failure='continue' if self.health_failure_policy == 'warn' else 'abort',
+                description="Performing health checks"
+            ))
             
-            # Step 4: Flush PM2 logs
-            self.logger.info(f"{Fore.YELLOW}4. Flushing PM2 logs{Style.RESET_ALL}")
-            self.flush_pm2_logs()
+        try:
+            result = self.run_pipeline(job, steps)
+        except DeploymentCancelled:
+            raise
+        except Exception as e:
+            self.logger.error(f"{Fore.RED}❌ Deployment failed: {e}{Style.RESET_ALL}")
+            if job:
+                job.error = str(e)
+            return False
             
-            # Step 5: Start PM2 process
-            self.logger.info(f"{Fore.YELLOW}5. Starting PM2 process{Style.RESET_ALL}")
-            if not self.start_pm2_process():
+        if not result['success']:
+            self.logger.error(f"{Fore.RED}❌ Deployment failed at {result['failed_step']}{Style.RESET_ALL}")
+            return False
+        if plan == 'static':
+            self.logger.info(f"{Fore.GREEN}✅ Static assets updated, no restart needed{Style.RESET_ALL}")
+        else:
+            self.logger.info(f"{Fore.GREEN}✅ Deployment completed successfully!{Style.RESET_ALL}")
+        self.print_deployment_summary()
+        return True
+    
+    def deploy_release(self, job: Optional[DeploymentJob] = None) -> bool:
+        """Execute deployment into a fresh release directory while the old one keeps serving"""
+        self.logger.info(f"{Fore.BLUE}🔄 Starting release deployment process...{Style.RESET_ALL}")
+        
+        sha = job.sha if job else None
+        release_dir = os.path.join(
+            self.releases_dir,
+            f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{(sha or 'head')[:8]}"
+        )
+        switched_at = []
+        adopt_previous = not self.status_board.get('last_job_failed')
+        
+        def switch():
+            # Once live, the release is either verified or rolled back, never abandoned by a cancel
+            self.disable_cancel(job)
+            previous = self.current_release()
+            if previous and adopt_previous and not self.is_known_good(previous):
+                # Releases from before rollback support have served without a failed deploy
+                self.mark_known_good(previous)
+            if not self.switch_release(release_dir):
                 return False
+            switched_at.append(time.time())
+            return True
             
-            # Step 6: Health checks
-            self.logger.info(f"{Fore.YELLOW}6. Performing health checks{Style.RESET_ALL}")
-            if not self.perform_health_checks():
-                self.logger.warning(f"{Fore.YELLOW}Health checks failed, but deployment continued{Style.RESET_ALL}")
+        def roll_back(trigger):
+            self.logger.error(f"{Fore.RED}❌ {trigger.replace('_', ' ').capitalize()} failed, rolling back{Style.RESET_ALL}")
+            self.run_step(job, 'rollback_release', lambda: self.rollback(job, trigger, since=switched_at[0]))
             
+        rollback = self.health_failure_policy == 'rollback'
+        health_policy = {'rollback': lambda: roll_back('health_check'), 'warn': 'continue'}.get(self.health_failure_policy, 'abort')
+        steps = [
+            PipelineStep('git_fetch', lambda: self.git_fetch(sha),
+                         description=f"Fetching latest changes from {self.target_branch}"),
+            PipelineStep('prepare_release', lambda: self.prepare_release(release_dir, sha), after=('git_fetch',),
+                         description=f"Preparing release {os.path.basename(release_dir)}"),
+            PipelineStep('install_dependencies', lambda: self.install_dependencies(release_dir), after=('prepare_release',),
+                         description="Installing dependencies"),
+            PipelineStep('flush_pm2_logs', self.flush_pm2_logs, on_failure='continue',
+                         description="Flushing PM2 logs"),
+            PipelineStep('switch_release', switch, after=('install_dependencies',),
+                         description=f"Switching {self.current_link} to new release"),
+            PipelineStep('reload_pm2_process', lambda: self.reload_pm2_process(self.current_link),
+                         after=('switch_release', 'flush_pm2_logs'),
+                         on_failure=(lambda: roll_back('reload')) if rollback else 'abort',
+                         description="Reloading PM2 process"),
+            PipelineStep('perform_health_checks', lambda: self.check_release_health(job, release_dir),
+                         after=('reload_pm2_process',), on_failure=health_policy,
+                         description="Performing health checks"),
+            PipelineStep('prune_releases', self.prune_releases, after=('perform_health_checks',), on_failure='continue',
+                         description="Removing old releases")
+        ]
+        
+        try:
+            result = self.run_pipeline(job, steps)
+            if not result['success']:
+                self.logger.error(f"{Fore.RED}❌ Deployment failed at {result['failed_step']}{Style.RESET_ALL}")
+                return False
             self.logger.info(f"{Fore.GREEN}✅ Deployment completed successfully!{Style.RESET_ALL}")
-            self.print_deployment_summary()
+            self.print_deployment_summary(release_dir)
             return True
             
+        except DeploymentCancelled:
+            raise
         except Exception as e:
             self.logger.error(f"{Fore.RED}❌ Deployment failed: {e}{Style.RESET_ALL}")
+            if job:
+                job.error = str(e)
             return False
+        finally:
+            if not switched_at and os.path.isdir(release_dir):
+                self.remove_release(release_dir)
     
-    def run_command(self, command: str, cwd: str = None) -> Tuple[bool, str]:
-        """Run shell command and return success status and output"""
+    def deploy_targets(self, job: DeploymentJob) -> bool:
+        """Build once in repo_path, then roll the result out to all targets in batches"""
+        plan = job.plan or 'full'
+        sha = job.sha
+        self.logger.info(f"{Fore.BLUE}🔄 Starting deployment to {len(self.targets)} targets ({plan})...{Style.RESET_ALL}")
+        
+        steps = [
+            PipelineStep('git_fetch', lambda: self.git_fetch(sha), description=f"Fetching {sha or self.target_branch}"),
+            PipelineStep('git_checkout', lambda: self.git_checkout(sha), after=('git_fetch',),
+                         description=f"Checking out build at {(sha or 'FETCH_HEAD')[:8]}")
+        ]
+        if plan == 'full':
+            steps.append(PipelineStep('install_dependencies', self.install_dependencies, after=('git_checkout',),
+                                      description="Installing dependencies into the build"))
+        steps.append(PipelineStep(
+            'rollout_targets', lambda: self.rollout(job, plan), after=(steps[-1].name,),
+            description=f"Rolling out to {len(self.targets)} targets"
+        ))
+        
         try:
-            result = subprocess.run(
-                command,
-                shell=True,
-                cwd=cwd or self.repo_path,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout
+            result = self.run_pipeline(job, steps)
+        except DeploymentCancelled:
+            raise
+        except Exception as e:
+            self.logger.error(f"{Fore.RED}❌ Deployment failed: {e}{Style.RESET_ALL}")
+            job.error = str(e)
+            return False
+            
+        for target in job.targets or []:
+            color = Fore.GREEN if target['status'] == 'succeeded' else Fore.RED
+            self.logger.info(f"  {color}{target['name']}: {target['status']}{Style.RESET_ALL} {target['error'] or ''}")
+        if not result['success']:
+            self.logger.error(f"{Fore.RED}❌ Deployment failed at {result['failed_step']}{Style.RESET_ALL}")
+            return False
+        self.logger.info(f"{Fore.GREEN}✅ Deployed to all {len(self.targets)} targets{Style.RESET_ALL}")
+        return True
+    
+    def rollout(self, job: DeploymentJob, plan: str) -> bool:
+        """Deploy the build to the targets batch by batch
+        
+        Targets within a batch run concurrently (up to TARGET_CONCURRENCY);
+        the next batch only starts once every target of the current one is
+        healthy. A failed batch stops the rollout and the remaining targets
+        are reported as skipped.
+        """
+        size = self.target_batch_size
+        batches = [self.targets[i:i + size] for i in range(0, len(self.targets), size)]
+        job.targets = [
+            {
+                'name': target['name'], 'host': target['host'], 'path': target['path'],
+                'pm2_app': target['pm2_app'], 'batch': index // size, 'status': 'pending',
+                'error': None, 'steps': [], 'health': None, 'duration': None
+            }
+            for index, target in enumerate(self.targets)
+        ]
+        results = {result['name']: result for result in job.targets}
+        
+        with ThreadPoolExecutor(max_workers=min(self.target_concurrency, size),
+                                thread_name_prefix='deploy-target') as executor:
+            for number, batch in enumerate(batches, 1):
+                if job.cancel_event.is_set():
+                    raise DeploymentCancelled()
+                self.logger.info(
+                    f"{Fore.CYAN}🚚 Batch {number}/{len(batches)}: {', '.join(t['name'] for t in batch)}{Style.RESET_ALL}"
+                )
+                futures = [executor.submit(self.deploy_target, job, target, results[target['name']], plan)
+                           for target in batch]
+                outcomes = [future.result() for future in futures]
+                self.deployment_queue.update(job)
+                if not all(outcomes):
+                    for result in job.targets:
+                        if result['status'] == 'pending':
+                            result['status'] = 'skipped'
+                    failed = [target['name'] for target, ok in zip(batch, outcomes) if not ok]
+                    job.error = f"Batch {number}/{len(batches)} failed on {', '.join(failed)}"
+                    self.logger.error(f"{Fore.RED}✗ Batch {number} failed ({', '.join(failed)}), stopping rollout{Style.RESET_ALL}")
+                    return False
+        return True
+    
+    def deploy_target(self, job: DeploymentJob, target: Dict, result: Dict, plan: str) -> bool:
+        """Sync the build to one target, reload its process and wait for it to be healthy"""
+        self.log_context.deployment_id = job.id
+        started = time.time()
+        deadline = started + self.step_timeouts.get('deploy_target', 300)
+        result['status'] = 'running'
+        steps = [('sync', lambda: self.sync_target(target))]
+        if plan != 'static':
+            steps += [
+                ('reload', lambda: self.reload_target(target)),
+                ('health', lambda: self.check_target_health(job, target, result))
+            ]
+        try:
+            for name, func in steps:
+                if job.cancel_event.is_set():
+                    raise DeploymentCancelled()
+                step = {'name': name, 'status': 'running', 'started_at': time.time(), 'duration': None}
+                result['steps'].append(step)
+                self.step_context.job = job
+                self.step_context.step = f"{target['name']}:{name}"
+                self.step_context.deadline = deadline
+                try:
+                    ok = func()
+                except Exception as e:
+                    ok = False
+                    result['error'] = str(e)
+                finally:
+                    self.step_context.job = self.step_context.step = self.step_context.deadline = None
+                step['duration'] = round(time.time() - step['started_at'], 3)
+                if job.cancel_event.is_set():
+                    step['status'] = 'cancelled'
+                    raise DeploymentCancelled()
+                step['status'] = 'succeeded' if ok else 'failed'
+                if not ok:
+                    result['status'] = 'failed'
+                    result['error'] = result['error'] or f"{name} failed"
+                    return False
+            result['status'] = 'succeeded'
+            return True
+        except DeploymentCancelled:
+            result['status'] = 'cancelled'
+            raise
+        finally:
+            result['duration'] = round(time.time() - started, 3)
+            self.log_context.deployment_id = None
+    
+    def sync_target(self, target: Dict) -> bool:
+        """Copy the build to a target directory, over SSH with rsync for remote hosts"""
+        if target['host']:
+            excludes = [f"--exclude={pattern}" for pattern in self.target_sync_exclude]
+            success, _ = self.run_command(
+                ['rsync', '-a', '--delete', '--protect-args', '-e', shlex.join(['ssh'] + self.ssh_options)] + excludes
+                + [f"{self.repo_path}/", f"{target['host']}:{target['path']}/"]
             )
+            if success:
+                self.logger.info(f"  {Fore.GREEN}✓ {target['name']}: synced to {target['host']}:{target['path']}{Style.RESET_ALL}")
+            return success
+        if os.path.realpath(target['path']) == os.path.realpath(self.repo_path):
+            return True
+        stats = sync_tree(self.repo_path, target['path'], self.target_sync_exclude)
+        self.logger.info(
+            f"  {Fore.GREEN}✓ {target['name']}: synced to {target['path']} "
+            f"({stats['copied']} copied, {stats['deleted']} deleted, {stats['unchanged']} unchanged){Style.RESET_ALL}"
+        )
+        return True
+    
+    def reload_target(self, target: Dict) -> bool:
+        """Reload a target's PM2 app, starting it from its ecosystem file if it is not running"""
+        reload = ['pm2', 'reload', target['pm2_app'], '--update-env']
+        start = ['pm2', 'start', 'ecosystem.config.js', '--only', target['pm2_app'], '--env', 'production']
+        if target['host']:
+            script = f"cd {shlex.quote(target['path'])} && ({shlex.join(reload)} || {shlex.join(start)})"
+            success, _ = self.run_command(['ssh'] + self.ssh_options + [target['host'], script])
+        else:
+            success, _ = self.run_pm2(reload[1:], cwd=target['path'])
+            if not success:
+                success, _ = self.run_pm2(start[1:], cwd=target['path'])
+        if success:
+            self.logger.info(f"  {Fore.GREEN}✓ {target['name']}: PM2 app {target['pm2_app']} reloaded{Style.RESET_ALL}")
+        else:
+            self.logger.error(f"  {Fore.RED}✗ {target['name']}: PM2 reload failed{Style.RESET_ALL}")
+        return success
+    
+    def check_target_health(self, job: DeploymentJob, target: Dict, result: Dict) -> bool:
+        """Poll a target's health endpoints until ready, the deadline passes or the job is cancelled"""
+        endpoints = {name: target[key] for name, key in (('api', 'health_url'), ('database', 'db_health_url')) if target[key]}
+        if not endpoints:
+            return True
+        result['health'] = self.health_checker.wait_until_healthy(endpoints, job.cancel_event)
+        if result['health']['healthy']:
+            self.logger.info(f"  {Fore.GREEN}✓ {target['name']}: healthy{Style.RESET_ALL}")
+        else:
+            failed = [name for name, probe in result['health']['probes'].items() if not probe['healthy']]
+            self.logger.warning(f"  {Fore.YELLOW}⚠ {target['name']}: health check failed ({', '.join(failed)}){Style.RESET_ALL}")
+        return result['health']['healthy']
+    
+    def run_pipeline(self, job: Optional[DeploymentJob], steps: List[PipelineStep]) -> Dict:
+        """Run deployment steps as a dependency graph on the step thread pool"""
+        deployment_id = job.id if job else None
+        
+        def execute(step: PipelineStep) -> bool:
+            self.log_context.deployment_id = deployment_id
+            try:
+                self.logger.info(f"{Fore.YELLOW}▶ {step.description}{Style.RESET_ALL}")
+                ok = self.run_step(job, step.name, step.func, step.timeout)
+                if not ok and step.on_failure == 'continue':
+                    self.logger.warning(f"{Fore.YELLOW}{step.name} failed, but deployment continued{Style.RESET_ALL}")
+                return ok
+            finally:
+                self.log_context.deployment_id = None
+                
+        result = Pipeline(steps, self.step_executor).run(execute)
+        if job:
+            job.pipeline = result
+        self.logger.info(
+            f"{Fore.CYAN}⏱ Critical path {result['critical_path_seconds']}s "
+            f"({' → '.join(result['critical_path'])}), wall time {result['wall_seconds']}s{Style.RESET_ALL}"
+        )
+        return result
+    
+    def run_command(self, command: List[str], cwd: str = None, timeout: float = None) -> Tuple[bool, str]:
+        """Run a command and return success status and output
+        
+        Output is streamed line by line into the debug log and, inside a
+        deployment step, into the job's output buffer. The timeout defaults to
+        whatever is left of the current step's timeout.
+        """
+        display = ' '.join(command)
+        job = getattr(self.step_context, 'job', None)
+        step = getattr(self.step_context, 'step', None)
+        if timeout is None:
+            deadline = getattr(self.step_context, 'deadline', None)
+            timeout = max(deadline - time.time(), 0.1) if deadline else self.command_timeout
             
-            if result.returncode == 0:
-                self.logger.debug(f"Command succeeded: {command}")
-                return True, result.stdout
-            else:
-                self.logger.error(f"Command failed: {command}")
-                self.logger.error(f"Error output: {result.stderr}")
-                return False, result.stderr
+        def on_line(stream, line):
+            self.logger.debug(f"    [{step or command[0]}] {line}", extra={'deployment_id': job.id if job else None})
+            if job:
+                job.append_output(stream, line)
                 
-        except subprocess.TimeoutExpired:
-            self.logger.error(f"Command timed out: {command}")
-            return False, "Command timed out"
+        self.subprocess_spawns.inc(os.path.basename(command[0]))
+        try:
+            returncode, stdout, stderr, outcome = self.command_runner.run(
+                command,
+                cwd=cwd or self.repo_path,
+                timeout=timeout,
+                cancel_event=job.cancel_event if job else None,
+                on_line=on_line
+            )
         except Exception as e:
             self.logger.error(f"Command execution error: {e}")
             return False, str(e)
+            
+        if outcome == 'timeout':
+            self.logger.error(f"Command timed out after {timeout:.0f}s: {display}")
+            return False, "Command timed out"
+        if outcome == 'cancelled':
+            self.logger.warning(f"Command cancelled: {display}")
+            return False, "Command cancelled"
+        if returncode == 0:
+            self.logger.debug(f"Command succeeded: {display}")
+            return True, stdout
+        else:
+            self.logger.error(f"Command failed: {display}")
+            self.logger.error(f"Error output: {stderr}")
+            return False, stderr
+    
+    def run_pm2(self, args: List[str], cwd: str = None) -> Tuple[bool, str]:
+        """Run a state-changing pm2 command and drop the cached process list"""
+        try:
+            return self.run_command(['pm2'] + args, cwd=cwd)
+        finally:
+            self.pm2_client.invalidate()
     
     def stop_pm2_process(self) -> bool:
         """Stop PM2 process"""
-        success, output = self.run_command(f"pm2 stop {self.pm2_app_name}")
+        success, output = self.run_pm2(['stop', self.pm2_app_name])
         if success:
             self.logger.info(f"  {Fore.GREEN}✓ PM2 process stopped{Style.RESET_ALL}")
         else:
             self.logger.warning(f"  {Fore.YELLOW}PM2 stop failed (process might not be running){Style.RESET_ALL}")
         return True  # Continue even if stop fails
     
-    def git_pull(self) -> bool:
-        """Pull latest changes from git"""
-        # Ensure we're on the correct branch
-        success, _ = self.run_command(f"git checkout {self.target_branch}")
+    def git_fetch(self, sha: str = None) -> bool:
+        """Fetch exactly the pushed commit (or the branch tip) without touching the working tree"""
+        options = ['--no-tags']
+        if self.git_fetch_depth:
+            options += ['--depth', str(self.git_fetch_depth)]
+        if self.git_fetch_filter:
+            options += ['--filter', self.git_fetch_filter]
+            
+        if sha:
+            success, _ = self.run_command(['git', 'fetch'] + options + ['origin', sha])
+            if success:
+                self.logger.info(f"  {Fore.GREEN}✓ Fetched {sha[:8]}{Style.RESET_ALL}")
+                return True
+            # Servers that refuse to serve a bare SHA still serve the branch containing it
+            self.logger.warning(f"  {Fore.YELLOW}Fetching {sha[:8]} directly failed, fetching {self.target_branch}{Style.RESET_ALL}")
+            
+        success, _ = self.run_command(['git', 'fetch'] + options + ['origin', self.target_branch])
+        if success:
+            self.logger.info(f"  {Fore.GREEN}✓ Git fetch successful{Style.RESET_ALL}")
+            return True
+        self.logger.error(f"  {Fore.RED}✗ Git fetch failed{Style.RESET_ALL}")
+        return False
+    
+    def git_checkout(self, sha: str = None) -> bool:
+        """Force the target branch and working tree onto the fetched commit"""
+        revision = sha or 'FETCH_HEAD'
+        success, _ = self.run_command(['git', 'checkout', '--force', '-B', self.target_branch, revision])
         if not success:
-            self.logger.error(f"  {Fore.RED}✗ Failed to checkout {self.target_branch}{Style.RESET_ALL}")
+            self.logger.error(f"  {Fore.RED}✗ Failed to check out {revision}{Style.RESET_ALL}")
             return False
-        
-        # Reset any local changes (force overwrite)
-        success, _ = self.run_command("git reset --hard HEAD")
+            
+        head = read_git_head(self.repo_path)
+        if sha and head != sha:
+            self.logger.error(f"  {Fore.RED}✗ HEAD is {head}, expected {sha}{Style.RESET_ALL}")
+            return False
+        self.logger.info(f"  {Fore.GREEN}✓ {self.target_branch} now at {(head or 'unknown')[:8]}{Style.RESET_ALL}")
+        return True
+    
+    def current_sha(self) -> Optional[str]:
+        """Commit currently deployed, read from the checkout serving traffic"""
+        if self.deploy_mode == 'release':
+            return read_git_head(self.current_link) if os.path.islink(self.current_link) else None
+        return read_git_head(self.repo_path)
+    
+    def prepare_release(self, release_dir: str, sha: str = None) -> bool:
+        """Check out the fetched commit into a new release directory as a detached worktree"""
+        os.makedirs(self.releases_dir, exist_ok=True)
+        revision = sha or 'FETCH_HEAD'
+        success, _ = self.run_command(['git', 'worktree', 'add', '--force', '--detach', release_dir, revision])
         if not success:
-            self.logger.error(f"  {Fore.RED}✗ Failed to reset local changes{Style.RESET_ALL}")
+            self.logger.error(f"  {Fore.RED}✗ Failed to check out {revision}{Style.RESET_ALL}")
             return False
+            
+        head = read_git_head(release_dir)
+        if sha and head != sha:
+            self.logger.error(f"  {Fore.RED}✗ Release HEAD is {head}, expected {sha}{Style.RESET_ALL}")
+            return False
+        self.logger.info(f"  {Fore.GREEN}✓ Release {(head or 'unknown')[:8]} checked out to {release_dir}{Style.RESET_ALL}")
+        return True
+    
+    def switch_release(self, release_dir: str) -> bool:
+        """Atomically point the current symlink at a release directory"""
+        if os.path.exists(self.current_link) and not os.path.islink(self.current_link):
+            self.logger.error(f"  {Fore.RED}✗ {self.current_link} exists and is not a symlink{Style.RESET_ALL}")
+            return False
+            
+        tmp_link = f"{self.current_link}.tmp-{os.getpid()}"
+        if os.path.lexists(tmp_link):
+            os.unlink(tmp_link)
+        os.symlink(release_dir, tmp_link)
+        os.replace(tmp_link, self.current_link)
+        self.logger.info(f"  {Fore.GREEN}✓ {self.current_link} -> {release_dir}{Style.RESET_ALL}")
+        return True
+    
+    def current_release(self) -> Optional[str]:
+        """Release directory the current symlink points at"""
+        if os.path.islink(self.current_link):
+            return os.path.realpath(self.current_link)
+        return None
+    
+    def is_known_good(self, release_dir: str) -> bool:
+        return os.path.exists(os.path.join(release_dir, self.KNOWN_GOOD_MARKER))
+    
+    def mark_known_good(self, release_dir: str, job: Optional[DeploymentJob] = None):
+        """Record that a release passed its health checks and can be rolled back to"""
+        with open(os.path.join(release_dir, self.KNOWN_GOOD_MARKER), 'w') as f:
+            json.dump({
+                'sha': read_git_head(release_dir),
+                'job_id': job.id if job else None,
+                'marked_at': time.time()
+            }, f)
+    
+    def marked_at(self, release_dir: str) -> float:
+        """When a release was last verified healthy, from its known-good marker"""
+        marker = os.path.join(release_dir, self.KNOWN_GOOD_MARKER)
+        try:
+            with open(marker) as f:
+                return float(json.load(f)['marked_at'])
+        except (OSError, ValueError, KeyError, TypeError):
+            try:
+                return os.path.getmtime(marker)
+            except OSError:
+                return 0
+                
+    def known_good_releases(self) -> List[str]:
+        """Known-good release directories, most recently verified first"""
+        if not os.path.isdir(self.releases_dir):
+            return []
+        return sorted(
+            (entry.path for entry in os.scandir(self.releases_dir)
+             if entry.is_dir() and self.is_known_good(entry.path)),
+            key=lambda path: (self.marked_at(path), path),
+            reverse=True
+        )
+    
+    def rollback_target(self, sha: str = None) -> Optional[str]:
+        """Newest known-good release other than the live one, optionally at a given commit"""
+        current = self.current_release()
+        for release_dir in self.known_good_releases():
+            if os.path.realpath(release_dir) == current:
+                continue
+            if sha and not (read_git_head(release_dir) or '').startswith(sha):
+                continue
+            return release_dir
+        return None
+    
+    def rollback(self, job: DeploymentJob, trigger: str, sha: str = None, since: float = None) -> bool:
+        """Switch back to a known-good release, reload and wait for it to be healthy
         
-        # Pull latest changes
-        success, output = self.run_command(f"git pull origin {self.target_branch}")
-        if success:
-            self.logger.info(f"  {Fore.GREEN}✓ Git pull successful{Style.RESET_ALL}")
-            # Log git changes
-            lines = output.split('\n')
-            for line in lines:
-                if line.strip():
-                    if 'file changed' in line or 'files changed' in line:
-                        self.logger.info(f"    {Fore.CYAN}{line.strip()}{Style.RESET_ALL}")
-            return True
-        else:
-            self.logger.error(f"  {Fore.RED}✗ Git pull failed{Style.RESET_ALL}")
+        time_to_recover runs from `since` (when the broken release went live)
+        or from the start of the rollback until the old release is healthy.
+        """
+        started = time.time()
+        broken = self.current_release()
+        target = self.rollback_target(sha)
+        job.rollback = {
+            'trigger': trigger,
+            'from': os.path.basename(broken) if broken else None,
+            'to': os.path.basename(target) if target else None,
+            'sha': read_git_head(target) if target else None,
+            'healthy': False,
+            'duration': None,
+            'time_to_recover': None
+        }
+        if target is None:
+            self.logger.error(f"  {Fore.RED}✗ No known-good release to roll back to{Style.RESET_ALL}")
+            self.rollbacks.inc(trigger, 'unavailable')
+            return False
+            
+        self.logger.info(f"  {Fore.YELLOW}⏪ Rolling back to {os.path.basename(target)}{Style.RESET_ALL}")
+        switched = self.switch_release(target)
+        if switched and broken and self.is_known_good(broken):
+            # Rolled back by hand, so the release is no longer a rollback candidate
+            os.unlink(os.path.join(broken, self.KNOWN_GOOD_MARKER))
+        healthy = (
+            switched
+            and self.reload_pm2_process(self.current_link)
+            and self.perform_health_checks()
+        )
+        job.rollback['duration'] = round(time.time() - started, 3)
+        self.rollbacks.inc(trigger, 'healthy' if healthy else 'unhealthy')
+        if not healthy:
+            self.logger.error(f"  {Fore.RED}✗ Rollback to {os.path.basename(target)} is not healthy{Style.RESET_ALL}")
             return False
+            
+        time_to_recover = round(time.time() - (since or started), 3)
+        job.rollback.update(healthy=True, time_to_recover=time_to_recover)
+        # Serving again makes it the newest known-good release
+        self.mark_known_good(target, job)
+        self.time_to_recover.observe(time_to_recover, trigger)
+        if trigger != 'manual':
+            job.error = f"Deployment failed ({trigger}), rolled back to {job.rollback['sha'][:8]}"
+        self.logger.info(
+            f"  {Fore.GREEN}✓ Rolled back to {os.path.basename(target)}, recovered in {time_to_recover}s{Style.RESET_ALL}"
+        )
+        return True
+    
+    def remove_release(self, release_dir: str):
+        """Delete a release directory and its worktree registration"""
+        success, _ = self.run_command(['git', 'worktree', 'remove', '--force', release_dir])
+        if not success:
+            shutil.rmtree(release_dir, ignore_errors=True)
+            self.run_command(['git', 'worktree', 'prune'])
+    
+    def prune_releases(self):
+        """Keep the newest KEEP_RELEASES known-good releases and the live one, remove the rest"""
+        if not os.path.isdir(self.releases_dir):
+            return
+        current = self.current_release()
+        keep = set(self.known_good_releases()[:self.keep_releases])
+        releases = sorted(
+            entry.path for entry in os.scandir(self.releases_dir) if entry.is_dir()
+        )
+        for release_dir in releases:
+            if release_dir in keep or os.path.realpath(release_dir) == current:
+                continue
+            self.remove_release(release_dir)
+            self.logger.info(f"  {Fore.CYAN}🗑 Removed old release {os.path.basename(release_dir)}{Style.RESET_ALL}")
     
-    def install_dependencies(self) -> bool:
-        """Install npm dependencies"""
-        success, output = self.run_command("npm install --production")
+    def install_dependencies(self, cwd: str = None) -> bool:
+        """Install npm dependencies, reusing a cached node_modules tree when the manifests are unchanged"""
+        path = cwd or self.repo_path
+        cache = self.dependency_cache
+        key = None
+        
+        if cache.enabled:
+            key = cache.key(path, ' '.join(self.install_command))
+            if cache.installed_key(path) == key:
+                cache.record(hit=True)
+                self.logger.info(f"  {Fore.GREEN}✓ Dependencies unchanged (cache key {key}){Style.RESET_ALL}")
+                return True
+            try:
+                if cache.restore(key, path):
+                    cache.record(hit=True)
+                    self.logger.info(f"  {Fore.GREEN}✓ Dependencies restored from cache (cache key {key}){Style.RESET_ALL}")
+                    return True
+            except OSError as e:
+                self.logger.warning(f"  {Fore.YELLOW}Dependency cache restore failed: {e}{Style.RESET_ALL}")
+            cache.record(hit=False)
+        
+        success, output = self.run_command(self.install_command, cwd=path)
         if success:
             self.logger.info(f"  {Fore.GREEN}✓ Dependencies installed{Style.RESET_ALL}")
+            if key:
+                try:
+                    cache.mark_installed(path, key)
+                    cache.store(key, path)
+                except OSError as e:
+                    self.logger.warning(f"  {Fore.YELLOW}Dependency cache store failed: {e}{Style.RESET_ALL}")
             return True
         else:
             self.logger.error(f"  {Fore.RED}✗ Dependency installation failed{Style.RESET_ALL}")
             return False
     
-    def flush_pm2_logs(self):
+    def flush_pm2_logs(self) -> bool:
         """Flush PM2 logs"""
-        success, _ = self.run_command(f"pm2 flush {self.pm2_app_name}")
+        success, _ = self.run_command(['pm2', 'flush', self.pm2_app_name])
         if success:
             self.logger.info(f"  {Fore.GREEN}✓ PM2 logs flushed{Style.RESET_ALL}")
         else:
             self.logger.warning(f"  {Fore.YELLOW}PM2 log flush failed{Style.RESET_ALL}")
+        return success
     
     def start_pm2_process(self) -> bool:
         """Start PM2 process"""
-        success, output = self.run_command(f"pm2 start {self.pm2_app_name}")
+        success, output = self.run_pm2(['start', self.pm2_app_name])
         if success:
             self.logger.info(f"  {Fore.GREEN}✓ PM2 process started{Style.RESET_ALL}")
             return True
         else:
             # Try starting with ecosystem file
-            success, output = self.run_command("pm2 start ecosystem.config.js --env production")
+            success, output = self.run_pm2(['start', 'ecosystem.config.js', '--env', 'production'])
             if success:
                 self.logger.info(f"  {Fore.GREEN}✓ PM2 process started with ecosystem config{Style.RESET_ALL}")
                 return True
@@ -388,74 +3591,82 @@ class WebhookListener:
                 self.logger.error(f"  {Fore.RED}✗ PM2 start failed{Style.RESET_ALL}")
                 return False
     
-    def perform_health_checks(self) -> bool:
-        """Perform API and database health checks"""
-        # Wait for service to start
-        self.logger.info(f"  Waiting for service to start...")
-        time.sleep(10)
-        
-        # API Health Check
-        try:
-            response = requests.get(self.health_check_url, timeout=10)
-            if response.status_code == 200:
-                self.logger.info(f"  {Fore.GREEN}✓ API health check passed{Style.RESET_ALL}")
-                api_healthy = True
-            else:
-                self.logger.warning(f"  {Fore.YELLOW}⚠ API health check failed: {response.status_code}{Style.RESET_ALL}")
-                api_healthy = False
-        except Exception as e:
-            self.logger.warning(f"  {Fore.YELLOW}⚠ API health check error: {e}{Style.RESET_ALL}")
-            api_healthy = False
-        
-        # Database Health Check
-        try:
-            response = requests.get(self.db_health_url, timeout=10)
-            if response.status_code == 200:
-                self.logger.info(f"  {Fore.GREEN}✓ Database health check passed{Style.RESET_ALL}")
-                db_healthy = True
+    def reload_pm2_process(self, cwd: str = None) -> bool:
+        """Gracefully reload the PM2 process so it picks up new code"""
+        cwd = cwd or self.repo_path
+        success, _ = self.run_pm2(['reload', self.pm2_app_name, '--update-env'], cwd=cwd)
+        if success:
+            self.logger.info(f"  {Fore.GREEN}✓ PM2 process reloaded{Style.RESET_ALL}")
+            return True
+        # Not running yet: start it from the ecosystem file
+        success, _ = self.run_pm2(['start', 'ecosystem.config.js', '--env', 'production'], cwd=cwd)
+        if success:
+            self.logger.info(f"  {Fore.GREEN}✓ PM2 process started with ecosystem config{Style.RESET_ALL}")
+            return True
+        self.logger.error(f"  {Fore.RED}✗ PM2 reload failed{Style.RESET_ALL}")
+        return False
+    
+    def check_release_health(self, job: Optional[DeploymentJob], release_dir: str) -> bool:
+        """Health-check a freshly switched release and mark it known-good if it passes"""
+        if not self.perform_health_checks(job):
+            return False
+        self.mark_known_good(release_dir, job)
+        return True
+    
+    def perform_health_checks(self, job: Optional[DeploymentJob] = None) -> bool:
+        """Poll API and database health endpoints until ready or the deadline passes"""
+        self.logger.info(f"  Waiting for service to become healthy (deadline {self.health_checker.deadline}s)...")
+        result = self.health_checker.wait_until_healthy({
+            'api': self.health_check_url,
+            'database': self.db_health_url
+        }, job.cancel_event if job else None)
+        if job:
+            job.health = result
+            
+        labels = {'api': 'API', 'database': 'Database'}
+        for name, probe in result['probes'].items():
+            if probe['healthy']:
+                self.logger.info(
+                    f"  {Fore.GREEN}✓ {labels[name]} health check passed "
+                    f"after {probe['healthy_after']}s ({probe['attempts']} attempts){Style.RESET_ALL}"
+                )
             else:
-                self.logger.warning(f"  {Fore.YELLOW}⚠ Database health check failed: {response.status_code}{Style.RESET_ALL}")
-                db_healthy = False
-        except Exception as e:
-            self.logger.warning(f"  {Fore.YELLOW}⚠ Database health check error: {e}{Style.RESET_ALL}")
-            db_healthy = False
+                detail = probe['status_code'] or probe['error']
+                self.logger.warning(f"  {Fore.YELLOW}⚠ {labels[name]} health check failed: {detail}{Style.RESET_ALL}")
         
-        return api_healthy and db_healthy
+        return result['healthy']
     
-    def get_pm2_status(self) -> Dict:
-        """Get PM2 process status"""
-        success, output = self.run_command(f"pm2 jlist")
+    def pm2_jlist(self) -> Optional[List[Dict]]:
+        """Get the PM2 process list from the CLI"""
+        success, output = self.run_command(['pm2', 'jlist'], timeout=30)
         if success:
             try:
-                processes = json.loads(output)
-                for proc in processes:
-                    if proc.get('name') == self.pm2_app_name:
-                        return {
-                            'status': proc.get('pm2_env', {}).get('status'),
-                            'pid': proc.get('pid'),
-                            'uptime': proc.get('pm2_env', {}).get('pm_uptime'),
-                            'restarts': proc.get('pm2_env', {}).get('restart_time')
-                        }
-            except:
+                return json.loads(output)
+            except ValueError:
                 pass
-        return {'status': 'unknown'}
+        return None
     
-    def print_deployment_summary(self):
+    def get_pm2_status(self, fresh: bool = False) -> Dict:
+        """Get PM2 process status"""
+        return self.pm2_client.process_status(self.pm2_app_name, fresh)
+    
+    def print_deployment_summary(self, path: str = None):
         """Print detailed deployment summary"""
+        path = path or self.repo_path
+        # The app was just (re)started, so wait for a fresh list instead of the cached one
+        pm2_lookup = self.step_executor.submit(self.get_pm2_status, True)
+        commit = read_git_head(path)
         self.logger.info(f"\n{Fore.CYAN}{'='*60}{Style.RESET_ALL}")
         self.logger.info(f"{Fore.CYAN}🎉 DEPLOYMENT SUMMARY{Style.RESET_ALL}")
         self.logger.info(f"{Fore.CYAN}{'='*60}{Style.RESET_ALL}")
         
         # Git information
-        success, branch_output = self.run_command("git rev-parse --abbrev-ref HEAD")
-        success, commit_output = self.run_command("git rev-parse --short HEAD")
-        
-        if success:
-            self.logger.info(f"📍 Current Branch: {Fore.GREEN}{branch_output.strip()}{Style.RESET_ALL}")
-            self.logger.info(f"📍 Current Commit: {Fore.GREEN}{commit_output.strip()}{Style.RESET_ALL}")
+        self.logger.info(f"📍 Current Branch: {Fore.GREEN}{self.target_branch}{Style.RESET_ALL}")
+        if commit:
+            self.logger.info(f"📍 Current Commit: {Fore.GREEN}{commit[:7]}{Style.RESET_ALL}")
         
         # PM2 Status
-        pm2_status = self.get_pm2_status()
+        pm2_status = pm2_lookup.result()
         status_color = Fore.GREEN if pm2_status.get('status') == 'online' else Fore.RED
         self.logger.info(f"🔧 PM2 Status: {status_color}{pm2_status.get('status', 'unknown')}{Style.RESET_ALL}")
         
@@ -465,7 +3676,7 @@ class WebhookListener:
         # Environment Information
         self.logger.info(f"🌍 Environment: {Fore.YELLOW}production{Style.RESET_ALL}")
         self.logger.info(f"🚪 Port: {Fore.YELLOW}8080{Style.RESET_ALL}")
-        self.logger.info(f"📁 Path: {Fore.YELLOW}{self.repo_path}{Style.RESET_ALL}")
+        self.logger.info(f"📁 Path: {Fore.YELLOW}{path}{Style.RESET_ALL}")
         
         # Deployment time
         self.logger.info(f"⏰ Deployed: {Fore.GREEN}{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}{Style.RESET_ALL}")
@@ -474,12 +3685,13 @@ class WebhookListener:
     
     def run(self):
         """Start the webhook listener"""
-        self.start_time = time.time()
+        self.status_board.set('started_at', time.time())
         
         self.logger.info(f"{Fore.GREEN}🚀 Starting GitHub Webhook Listener{Style.RESET_ALL}")
         self.logger.info(f"📡 Listening on {self.host}:{self.port}")
         self.logger.info(f"🌿 Target branch: {self.target_branch}")
         self.logger.info(f"📦 PM2 app: {self.pm2_app_name}")
+        self.logger.info(f"🗂 Deploy mode: {self.deploy_mode}")
         
         try:
             self.app.run(
@@ -493,6 +3705,33 @@ class WebhookListener:
         except Exception as e:
             self.logger.error(f"{Fore.RED}❌ Server error: {e}{Style.RESET_ALL}")
 
+def create_app() -> Flask:
+    """App factory for running under gunicorn with several workers
+    
+        WEB_THREADS=8 gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:9090 'webhook_listener:create_app()'
+        
+    Workers share queue, history and status through STATE_DIR; only the
+    worker holding the deploy lock runs deployments.
+    """
+    listener = WebhookListener(state_dir=os.getenv('STATE_DIR', './state'))
+    if not listener.web_threads:
+        listener.logger.warning(
+            f"{Fore.YELLOW}WEB_THREADS is not set; set it to gunicorn's --threads so /stream "
+            f"subscribers cannot take every request thread{Style.RESET_ALL}"
+        )
+    # Workers of the same gunicorn master share one service start time
+    with listener.state_store.transaction() as state:
+        service = state.setdefault('service', {})
+        if service.get('master_pid') != os.getppid():
+            service['master_pid'] = os.getppid()
+            state.setdefault(SharedStatusBoard.KEY, {})['started_at'] = time.time()
+            # Per-worker metric files of the previous service run
+            for entry in os.scandir(listener.metrics.shared_dir):
+                if entry.name.endswith('.json'):
+                    os.unlink(entry.path)
+    listener.logger.info(f"{Fore.GREEN}🚀 Webhook worker {os.getpid()} ready (state: {listener.state_store.state_dir}){Style.RESET_ALL}")
+    return listener.app
+
 def signal_handler(signum, frame):
     """Handle shutdown signals gracefully"""
     print(f"\n{Fore.YELLOW}🛑 Received shutdown signal{Style.RESET_ALL}")
@@ -504,5 +3743,9 @@ if __name__ == '__main__':
     signal.signal(signal.SIGTERM, signal_handler)
     
     # Start webhook listener
-    listener = WebhookListener()
+    try:
+        listener = WebhookListener(state_dir=os.getenv('STATE_DIR') or None)
+    except ConfigurationError as e:
+        print(f"{Fore.RED}{e}{Style.RESET_ALL}")
+        sys.exit(1)
     listener.run()